@@ -0,0 +1,86 @@
+"""Fixtures shared by the benchmark suite.
+
+Run with `make bench` (compare against the latest baseline stored under
+`benchmarks/baselines`, or store a first one) or `make bench-save` (store a
+new baseline).
+"""
+import os
+from datetime import date, timedelta
+from typing import Optional
+import pytest
+import redis
+
+from allocation.config import get_redis_config
+from allocation.domain.model import Batch, OrderLine, Product
+from allocation.domain.ports import AbstractPublisher, AbstractQueryRepository
+
+
+@pytest.fixture(scope='session')
+def today():
+    return date.today()
+
+
+# Redis database the benchmarks write to, apart from the read model's
+BENCH_REDIS_DB = int(os.getenv('BENCH_REDIS_DB', 15))
+
+
+@pytest.fixture(scope='session')
+def redis_client():
+    host, port = get_redis_config()
+    client = redis.Redis(host, port, BENCH_REDIS_DB)
+    try:
+        client.ping()
+    except redis.exceptions.ConnectionError:
+        pytest.skip(f'Redis is not reachable at {host}:{port}')
+
+    # everything in the database is the benchmarks', so it can be cleared
+    if client.dbsize():
+        pytest.skip(f'Redis database {BENCH_REDIS_DB} at {host}:{port} is '
+                    f'not empty, set BENCH_REDIS_DB to an unused one')
+
+    yield client
+    client.flushdb()
+
+
+def build_product(sku: str, n_batches: int, n_lines: int,
+                  today: Optional[date] = None,
+                  free_qty: Optional[int] = None) -> Product:
+    """Returns a product with `n_batches` batches, each one holding `n_lines`
+    allocated lines of qty 1 and `free_qty` (defaults to `n_lines`) units left
+    for further allocations."""
+    today = today or date.today()
+    free_qty = n_lines if free_qty is None else free_qty
+    batches = []
+
+    for i in range(n_batches):
+        batch = Batch(f'{sku}-batch-{i}', sku, n_lines + free_qty,
+                      today + timedelta(days=i))
+        for j in range(n_lines):
+            batch.allocate(OrderLine(f'{sku}-order-{i}-{j}', sku, 1))
+        batches.append(batch)
+
+    return Product(sku, batches)
+
+
+class NullQueryRepository(AbstractQueryRepository):
+    def add_batch(self, *args, **kwargs): ...
+    def get_batch(self, *args, **kwargs): ...
+    def update_batch_quantity(self, *args, **kwargs): ...
+    def add_allocation_for_line(self, *args, **kwargs): ...
+    def get_allocation_for_line(self, *args, **kwargs): ...
+    def remove_allocation_for_line(self, *args, **kwargs): ...
+    def add_allocation_for_order(self, *args, **kwargs): ...
+    def get_allocations_for_order(self, *args, **kwargs): ...
+    def remove_allocation_for_order(self, *args, **kwargs): ...
+    def change_available_to_promise(self, *args, **kwargs): ...
+    def get_batches(self, *args, **kwargs): ...
+    def get_allocations_for_orders(self, *args, **kwargs): ...
+    def get_batches_for_sku(self, *args, **kwargs): ...
+    def get_batch_version(self, *args, **kwargs): ...
+    def get_allocations_for_order_version(self, *args, **kwargs): ...
+    def get_free_capacity(self, *args, **kwargs): ...
+    def get_available_to_promise(self, *args, **kwargs): ...
+
+
+class NullPublisher(AbstractPublisher):
+    def publish_event(*args, **kwargs): ...
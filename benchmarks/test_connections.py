@@ -0,0 +1,74 @@
+"""Allocate latency per request with a new Postgres connection each time,
+with persistent connections and with a psycopg pool (see `DATABASES` in the
+settings).
+
+Each round runs the request cycle Django does around a view: connections are
+checked when the request starts and closed, kept or handed back to the pool
+when it finishes. Postgres only: run with `make bench-postgres`.
+"""
+import itertools
+from contextlib import contextmanager
+import pytest
+from django.db import close_old_connections, connection, connections
+from allocation.domain import commands
+from allocation.orchestration import bootstrapper
+from allocation.orchestration.uow import DjangoUoW
+from benchmarks.conftest import NullPublisher, NullQueryRepository
+
+
+CONNECTIONS = {
+    'per_request': {'CONN_MAX_AGE': 0},
+    'persistent': {'CONN_MAX_AGE': 60},
+    'pooled': {'CONN_MAX_AGE': 0,
+               'OPTIONS': {'pool': {'min_size': 1, 'max_size': 2}}},
+}
+
+
+@contextmanager
+def default_connection(settings):
+    """Swaps the default connection for one with `settings` on top of the
+    configured ones."""
+    original = connections['default']
+    settings_dict = {
+        **original.settings_dict,
+        **settings,
+        'OPTIONS': {**original.settings_dict['OPTIONS'],
+                    **settings.get('OPTIONS', {})},
+    }
+    connections['default'] = original.__class__(settings_dict, original.alias)
+    try:
+        yield
+    finally:
+        connections['default'].close()
+        connections['default'].close_pool()
+        connections['default'] = original
+
+
+@pytest.fixture
+def bus():
+    return bootstrapper.bootstrap(
+        uow=DjangoUoW(),
+        publisher=NullPublisher(),
+        query_repository=NullQueryRepository(),
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('settings', CONNECTIONS)
+def test_allocate_request(benchmark, bus, settings):
+    if connection.vendor != 'postgresql':
+        pytest.skip('connection handling is only benchmarked against Postgres')
+    if 'OPTIONS' in CONNECTIONS[settings]:
+        pytest.importorskip('psycopg_pool')
+
+    benchmark.group = 'connections.allocate_request'
+    bus.handle(commands.CreateBatch('batch', 'sku', 1_000_000))
+    order_ids = (f'order-{i}' for i in itertools.count())
+
+    def request():
+        close_old_connections()
+        bus.handle(commands.Allocate(next(order_ids), 'sku', 1))
+        close_old_connections()
+
+    with default_connection(CONNECTIONS[settings]):
+        benchmark.pedantic(request, rounds=200, warmup_rounds=5)
@@ -0,0 +1,48 @@
+"""Benchmarks for `DjangoRepository` reads and writes.
+
+They run against SQLite by default. Set `DJANGO_TEST_POSTGRES=1` (see
+`make bench-postgres`) to run them against the Postgres configured in the
+environment instead.
+"""
+import itertools
+import pytest
+from django.db import connection
+from allocation.adapters.django_repository import DjangoRepository
+from benchmarks.conftest import build_product
+
+
+SIZES = [(1, 10), (10, 100), (10, 1_000)]
+SIZE_IDS = [f'{b}batches-{l}lines' for b, l in SIZES]
+
+
+@pytest.fixture(params=SIZES, ids=SIZE_IDS)
+def stored_product(request, today):
+    n_batches, n_lines = request.param
+    product = build_product('sku', n_batches, n_lines, today, free_qty=100)
+    DjangoRepository().add(product)
+    return product
+
+
+@pytest.mark.django_db
+def test_get(benchmark, stored_product):
+    benchmark.group = f'django_repository.get[{connection.vendor}]'
+    benchmark(lambda: DjangoRepository().get(stored_product.sku))
+
+
+@pytest.mark.django_db
+def test_update_after_allocate(benchmark, stored_product):
+    benchmark.group = f'django_repository.update[{connection.vendor}]'
+
+    order_ids = (f'order-{i}' for i in itertools.count())
+
+    def setup():
+        repo = DjangoRepository()
+        product = repo.get(stored_product.sku)
+        product.allocate(next(order_ids), product.sku, 1)
+        return (repo, product), {}
+
+    benchmark.pedantic(
+        lambda repo, product: repo.update(product),
+        setup=setup,
+        rounds=20,
+    )
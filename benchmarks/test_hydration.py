@@ -0,0 +1,49 @@
+"""Products hydrated per second (see `OPS` in the report) from rows as read
+from the database, through the validating constructors and through the
+trusted `rehydrate` ones used by the repositories."""
+from datetime import timedelta
+import pytest
+from allocation.domain.model import Batch, OrderLine, Product
+
+
+SIZES = [(1, 10), (10, 100), (10, 1_000)]
+SIZE_IDS = [f'{b}batches-{l}lines' for b, l in SIZES]
+
+
+@pytest.fixture(scope='module', params=SIZES, ids=SIZE_IDS)
+def rows(request, today):
+    """`(ref, qty, eta, [(order_id, qty), ...])` per batch."""
+    n_batches, n_lines = request.param
+    return [
+        (f'batch-{i}', 2 * n_lines, today + timedelta(days=i),
+         [(f'order-{i}-{j}', 1) for j in range(n_lines)])
+        for i in range(n_batches)
+    ]
+
+
+def validated(sku, rows):
+    batches = []
+    for ref, qty, eta, lines in rows:
+        batch = Batch(ref, sku, qty, eta)
+        for order_id, line_qty in lines:
+            batch.allocate(OrderLine(order_id, sku, line_qty))
+        batches.append(batch)
+    return Product(sku, batches)
+
+
+def trusted(sku, rows):
+    return Product.rehydrate(sku, [
+        Batch.rehydrate(ref, sku, qty, eta,
+                        [OrderLine(order_id, sku, line_qty)
+                         for order_id, line_qty in lines])
+        for ref, qty, eta, lines in rows
+    ])
+
+
+@pytest.mark.parametrize('hydrate', [validated, trusted])
+def test_hydrate_product(benchmark, rows, hydrate):
+    benchmark.group = 'product.hydrate'
+    product = benchmark(hydrate, 'sku', rows)
+    
+    assert sum(b.allocated_qty for b in product.batches) == \
+           sum(len(lines) for *_, lines in rows)
@@ -0,0 +1,71 @@
+"""Memory held per allocation line by a batch, before and after slotting
+`OrderLine` and sharing the product's `sku` string between lines.
+
+Bytes per line are measured with `tracemalloc` and stored in each benchmark's
+`extra_info`, so they end up in the saved baselines next to the timings.
+"""
+import tracemalloc
+from dataclasses import dataclass
+import pytest
+from allocation.domain.model import OrderLine
+
+
+N_LINES = 100_000
+SKU = 'SMALL-TABLE-0001'
+
+
+@dataclass(frozen=True)
+class DictOrderLine:
+    """`OrderLine` as it was before: a `__dict__` per instance."""
+    order_id: str
+    sku: str
+    qty: int
+
+
+def copied_sku():
+    # a new string, as each row read from the database used to give
+    return ''.join(SKU)
+
+
+def shared_sku():
+    return SKU
+
+
+LAYOUTS = {
+    'before': (DictOrderLine, copied_sku),
+    'after': (OrderLine, shared_sku),
+}
+
+
+def build_lines(line_cls, sku, order_ids):
+    return {line_cls(order_id, sku(), 1) for order_id in order_ids}
+
+
+def bytes_per_line(line_cls, sku, n_lines=N_LINES) -> float:
+    # order ids are unique per line and cost the same either way
+    order_ids = [f'order-{i:08}' for i in range(n_lines)]
+    tracemalloc.start()
+    try:
+        lines = build_lines(line_cls, sku, order_ids)
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(lines) == n_lines
+    return allocated / n_lines
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_order_lines_memory(benchmark, layout):
+    benchmark.group = 'memory.order_lines'
+    line_cls, sku = LAYOUTS[layout]
+    benchmark.extra_info['bytes_per_line'] = round(bytes_per_line(line_cls, sku), 1)
+    order_ids = [f'order-{i:08}' for i in range(N_LINES)]
+    benchmark.pedantic(build_lines, args=(line_cls, sku, order_ids), rounds=5)
+
+
+def test_slotted_lines_with_shared_sku_take_less_memory():
+    before = bytes_per_line(*LAYOUTS['before'])
+    after = bytes_per_line(*LAYOUTS['after'])
+
+    assert after < before * 0.75, (before, after)
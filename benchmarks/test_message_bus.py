@@ -0,0 +1,38 @@
+"""Benchmarks for `MessageBus.handle` dispatch, isolated from any I/O."""
+import itertools
+import pytest
+from allocation.domain import commands, queries
+from allocation.orchestration import bootstrapper
+from allocation.orchestration.uow import InMemoryUoW
+from benchmarks.conftest import NullPublisher, NullQueryRepository, build_product
+
+
+@pytest.fixture
+def bus(today):
+    product = build_product('sku', 10, 10, today, free_qty=10_000_000)
+    uow = InMemoryUoW([product])
+    return bootstrapper.bootstrap(
+        uow=uow,
+        publisher=NullPublisher(),
+        query_repository=NullQueryRepository(),
+    )
+
+
+def test_handle_allocate(benchmark, bus):
+    benchmark.group = 'message_bus.handle'
+    order_ids = (f'order-{i}' for i in itertools.count())
+    benchmark(lambda: bus.handle(commands.Allocate(next(order_ids), 'sku', 1)))
+
+
+def test_handle_create_batch(benchmark, bus):
+    benchmark.group = 'message_bus.handle'
+    refs = (f'batch-{i}' for i in itertools.count())
+    benchmark.pedantic(
+        lambda: bus.handle(commands.CreateBatch(next(refs), 'new-sku', 10)),
+        rounds=200,
+    )
+
+
+def test_handle_query(benchmark, bus):
+    benchmark.group = 'message_bus.handle'
+    benchmark(lambda: bus.handle(queries.BatchByRef('sku-batch-0')))
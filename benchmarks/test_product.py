@@ -0,0 +1,101 @@
+"""Benchmarks for the `Product` aggregate at varying batch and line counts."""
+import copy
+import pytest
+from allocation.domain.exceptions import OutOfStock
+from allocation.domain.model import Product
+from benchmarks.conftest import build_product
+
+
+SIZES = [(1, 10), (10, 100), (100, 100), (10, 1_000)]
+SIZE_IDS = [f'{b}batches-{l}lines' for b, l in SIZES]
+
+
+@pytest.fixture(scope='module', params=SIZES, ids=SIZE_IDS)
+def product_template(request, today):
+    n_batches, n_lines = request.param
+    return build_product('sku', n_batches, n_lines, today)
+
+
+def fresh_copy(template):
+    return lambda: ((copy.deepcopy(template),), {})
+
+
+def test_allocate(benchmark, product_template):
+    benchmark.group = 'product.allocate'
+    benchmark.pedantic(
+        lambda product: product.allocate('new-order', 'sku', 1),
+        setup=fresh_copy(product_template),
+        rounds=50,
+    )
+
+
+def test_deallocate(benchmark, product_template):
+    benchmark.group = 'product.deallocate'
+    # the line allocated last lives in the last batch: worst case for the scan
+    last_batch = product_template.batches[-1]
+    line = max(last_batch.allocations, key=lambda l: l.order_id)
+    benchmark.pedantic(
+        lambda product: product.deallocate(line.order_id, line.sku, line.qty),
+        setup=fresh_copy(product_template),
+        rounds=50,
+    )
+
+
+def test_change_batch_quantity(benchmark, product_template):
+    benchmark.group = 'product.change_batch_quantity'
+    batch = product_template.batches[0]
+    # one line less than currently allocated forces a deallocation
+    new_qty = batch.allocated_qty - 1
+    benchmark.pedantic(
+        lambda product: product.change_batch_quantity(batch.ref, new_qty),
+        setup=fresh_copy(product_template),
+        rounds=50,
+    )
+
+
+WAVE_SIZES = [100, 1_000, 10_000]
+
+
+@pytest.fixture(params=WAVE_SIZES, ids=[f'{n}lines' for n in WAVE_SIZES])
+def wave(request):
+    # mostly single units, as in wave picking
+    return [(f'wave-order-{i}', 1 if i % 10 else 3) for i in range(request.param)]
+
+
+def allocate_one_by_one(product, lines):
+    for order_id, qty in lines:
+        try:
+            product.allocate(order_id, product.sku, qty)
+        except OutOfStock:
+            pass
+
+
+@pytest.mark.parametrize('allocate', [
+    allocate_one_by_one,
+    lambda product, lines: product.allocate_wave(product.sku, lines),
+], ids=['one_by_one', 'wave'])
+def test_allocate_wave(benchmark, wave, today, allocate):
+    benchmark.group = f'product.allocate_wave[{len(wave)}lines]'
+    template = build_product('sku', 20, 0, today, free_qty=len(wave) // 10)
+    benchmark.pedantic(
+        allocate,
+        setup=lambda: ((copy.deepcopy(template), wave), {}),
+        rounds=10,
+    )
+
+
+@pytest.mark.parametrize('strategy', ['earliest_eta', 'best_fit'])
+def test_allocate_many_by_strategy(benchmark, today, strategy):
+    benchmark.group = 'product.allocate[strategy]'
+    template = build_product('sku', 100, 0, today, free_qty=50)
+    
+    def allocate_many(product):
+        for i in range(1_000):
+            product.allocate(f'o{i}', 'sku', 1 + i % 4)
+    
+    benchmark.pedantic(
+        allocate_many,
+        setup=lambda: ((Product.rehydrate('sku', copy.deepcopy(template.batches),
+                                          strategy),), {}),
+        rounds=10,
+    )
@@ -0,0 +1,55 @@
+"""Benchmarks for `RedisQueryRepository` against a local Redis.
+
+Skipped when Redis is not reachable (see `REDIS_HOST`/`REDIS_PORT`). Writes
+to the `BENCH_REDIS_DB` database only.
+"""
+import pytest
+from allocation.adapters.redis_query_repository import RedisQueryRepository
+from allocation.config import get_redis_config
+from benchmarks.conftest import BENCH_REDIS_DB
+
+
+@pytest.fixture
+def repo(redis_client):
+    redis_client.flushdb()
+    repo = RedisQueryRepository(*get_redis_config(), db=BENCH_REDIS_DB)
+    repo.add_batch('batch', 'sku', 10)
+    repo.add_allocation_for_line('order', 'sku', 'batch')
+    for i in range(10):
+        repo.add_allocation_for_order('order', f'sku{i}', 'batch')
+    return repo
+
+
+def test_get_batch(benchmark, repo):
+    benchmark.group = 'redis_query_repository.read'
+    benchmark(repo.get_batch, 'batch')
+
+
+def test_get_allocation_for_line(benchmark, repo):
+    benchmark.group = 'redis_query_repository.read'
+    benchmark(repo.get_allocation_for_line, 'order', 'sku')
+
+
+def test_get_allocations_for_order(benchmark, repo):
+    benchmark.group = 'redis_query_repository.read'
+    benchmark(repo.get_allocations_for_order, 'order')
+
+
+def test_add_batch(benchmark, repo, today):
+    benchmark.group = 'redis_query_repository.write'
+    benchmark(repo.add_batch, 'other-batch', 'sku', 10, today)
+
+
+def test_update_batch_quantity(benchmark, repo):
+    benchmark.group = 'redis_query_repository.write'
+    benchmark(repo.update_batch_quantity, 'batch', 20)
+
+
+def test_add_and_remove_allocation_for_order(benchmark, repo):
+    benchmark.group = 'redis_query_repository.write'
+
+    def add_and_remove():
+        repo.add_allocation_for_order('order', 'new-sku', 'batch')
+        repo.remove_allocation_for_order('order', 'new-sku', 'batch')
+
+    benchmark(add_and_remove)
@@ -0,0 +1,36 @@
+"""Cold start of the Redis consumer: a fresh interpreter importing it, setting
+Django up and bootstrapping its bus, i.e. what an autoscaled consumer goes
+through before it subscribes (Redis is not needed).
+
+It took about 0.57s before the consumer's imports were made lazy and it got
+settings of its own, and 0.44s after; `COLD_START_TARGET` leaves room for
+slower machines.
+"""
+import os
+import subprocess
+import sys
+
+
+COLD_START_TARGET = 0.75
+
+
+def cold_start():
+    subprocess.run(
+        [sys.executable, '-c',
+         'from allocation.entrypoints import redis_consumer; '
+         'redis_consumer.setup()'],
+        env={**os.environ,
+             'PYTHONPATH': os.pathsep.join(sys.path),
+             'DJANGO_SETTINGS_MODULE': 'dddjango.dddjango.consumer_settings'},
+        check=True,
+    )
+
+
+def test_consumer_cold_start(benchmark):
+    benchmark.group = 'startup.consumer'
+    benchmark.pedantic(cold_start, rounds=5, warmup_rounds=1)
+    
+    # no stats are collected under `--benchmark-disable`
+    if benchmark.disabled:
+        return
+    assert benchmark.stats['median'] < COLD_START_TARGET
@@ -0,0 +1,46 @@
+"""Gunicorn settings for serving the API (the container's command), read from
+the working directory by a plain `gunicorn`.
+
+The app is loaded once in the master process, with Django set up and the API
+imported, and then forked into `WEB_CONCURRENCY` workers. Each worker thread
+bootstraps its own bus on its first request (see `dddjango.alloc.api`).
+
+Migrations are not run here: see `make migrate`.
+"""
+import multiprocessing
+import os
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dddjango.dddjango.settings')
+pythonpath = 'src'
+
+# `wsgi` (threaded workers) or `asgi` (uvicorn workers)
+SERVER_INTERFACE = os.getenv('SERVER_INTERFACE', 'wsgi')
+
+if SERVER_INTERFACE == 'asgi':
+    wsgi_app = 'dddjango.dddjango.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'dddjango.dddjango.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+accesslog = '-'
+
+
+def when_ready(server):
+    # runs in the master before any worker is forked: importing the URLconf
+    # imports the API, the bus and its handlers once for all workers
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+
+
+def pre_fork(server, worker):
+    # database connections must not be shared with the workers
+    from django.db import connections
+    connections.close_all()
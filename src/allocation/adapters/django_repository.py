@@ -1,125 +1,210 @@
-from typing import List
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+from typing import Dict, Iterator, List, Tuple
+from django.db import IntegrityError
+from django.db.models import F, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from allocation.domain import model as domain_
-from allocation.domain.exceptions import InexistentProduct
+from allocation.domain.exceptions import (
+    InexistentProduct, LineIsAlreadyAllocatedError, OrderHasNoAllocations
+)
 from allocation.domain.ports import AbstractWriteRepository
 from dddjango.alloc import models as orm
 
 
 class DjangoRepository(AbstractWriteRepository):
 
+    # what `iter_allocations` yields of each allocation, in order
+    ALLOCATION_FIELDS = ('order_id', 'sku', 'qty', 'batch_ref')
+
     def add(self, product: domain_.Product) -> None:
         super().add(product)
-        orm_product = orm.Product.objects.create(sku=product.sku)
-        self._add_batches(product.batches, orm_product)
+        orm.Product.objects.create(
+            sku=product.sku,
+            allocation_strategy=product.allocation_strategy,
+        )
+        self._add_batches(product.batches, product.sku)
 
     
-    def _add_batches(self, batches, orm_product):
+    def _add_batches(self, batches, sku):
         for batch in batches:
-            orm_batch = orm.Batch.objects.create(
+            orm.Batch.objects.create(
                 ref=batch.ref,
-                product=orm_product,
+                product_id=sku,
                 qty=batch.available_qty + batch.allocated_qty,
                 eta=batch.eta,
+                allocated_qty=batch.allocated_qty,
             )
-            self._add_lines(batch.allocations, orm_batch)
+            self._insert_lines(batch.allocations, batch.ref)
+
+    
+    def _add_lines(self, allocations, batch_ref):
+        if not allocations:
+            return
+        
+        self._insert_lines(allocations, batch_ref)
+        orm.Batch.objects.filter(ref=batch_ref).update(
+            allocated_qty=F('allocated_qty') + sum(line.qty for line in allocations)
+        )
+
+
+    @staticmethod
+    def _remove_lines(lines, batch_ref):
+        # one `order_id IN` per part number, nearly always only part 0: a batch
+        # may hold several parts of a split line and keep some of them
+        order_ids_by_part = defaultdict(set)
+        for line in lines:
+            order_ids_by_part[line.part].add(line.order_id)
+        removed = orm.Allocation.objects.filter(
+            reduce(or_, (Q(part=part, order_id__in=order_ids)
+                         for part, order_ids in order_ids_by_part.items())),
+            batch_id=batch_ref,
+        )
+        # the total is taken from the rows actually being deleted, and updating
+        # the batch first locks its row against concurrent changes
+        removed_qty = removed.order_by() \
+                             .values('batch_id') \
+                             .annotate(total=Sum('qty')) \
+                             .values('total')
+        orm.Batch.objects.filter(ref=batch_ref).update(
+            allocated_qty=F('allocated_qty') - Coalesce(Subquery(removed_qty), 0)
+        )
+        removed.delete()
 
     
     @staticmethod
-    def _add_lines(allocations, orm_batch):
-        for line in allocations:
-            orm.Allocation.objects.create(
-                    batch = orm_batch,
+    def _insert_lines(allocations, batch_ref):
+        if not allocations:
+            return
+        
+        try:
+            orm.Allocation.objects.bulk_create(
+                orm.Allocation(
+                    batch_id=batch_ref,
                     order_id=line.order_id,
                     sku=line.sku,
                     qty=line.qty,
+                    part=line.part,
                 )
+                for line in allocations
+            )
+        except IntegrityError:
+            # `unique_order_line_part`: the line (or this part of it) is
+            # already allocated, to this batch or another one
+            raise LineIsAlreadyAllocatedError()
+
+
+    @staticmethod
+    def _products():
+        return orm.Product.objects.prefetch_related('batches')
+
+
+    @staticmethod
+    def _load_lines(batch_ref: str, sku: str) -> List[domain_.OrderLine]:
+        # `sku` is the product's, shared by every line rather than read per row
+        return [
+            domain_.OrderLine(order_id, sku, qty, part)
+            for order_id, qty, part in orm.Allocation.objects
+                                          .filter(batch_id=batch_ref)
+                                          .values_list('order_id', 'qty', 'part')
+        ]
 
 
     def _get(self, sku) -> domain_.Product:
+        # batches are hydrated with their `allocated_qty` only, their lines are
+        # loaded if and when the domain needs them
         try:
-            return orm.Product.objects.get(sku=sku).to_domain()
+            return self._products().get(sku=sku).to_domain(self._load_lines)
         except orm.Product.DoesNotExist:
             raise InexistentProduct(sku=sku)
 
 
     def update(self, updated_product: domain_.Product) -> None:
         # not using `get` here to prevent triggering update on uow commit
-        current_domain_product = self._get(updated_product.sku)
+        current_product = self._get(updated_product.sku)
+        current_batches = {
+            batch.ref: batch
+            for batch in current_product.batches
+        }
         
-        self._delete_removed_allocations_from_updated_product(
-            updated_product.batches,
-            current_domain_product.batches
-        )
-        self._create_new_allocations_from_updated_product(
-            updated_product.batches,
-            current_domain_product.batches
-        )
-        self._add_new_batches(
-            updated_product.batches,
-            current_domain_product.batches
-        )
-
-
-    def _delete_removed_allocations_from_updated_product(
-            self,
-            updated_batches: List[domain_.Batch],
-            current_batches: List[domain_.Batch],
-    ):
-        for batch in current_batches:
-            updated_batch = self._get_batch_by_ref(updated_batches, batch.ref)
-            orm_batch = orm.Batch.objects.get(ref=batch.ref)
-            removed_lines_order_id = {line.order_id for line in batch.allocations
-                                      if line not in updated_batch.allocations}
+        if updated_product.allocation_strategy != current_product.allocation_strategy:
+            orm.Product.objects.filter(sku=updated_product.sku).update(
+                allocation_strategy=updated_product.allocation_strategy
+            )
+        
+        for batch in updated_product.batches:
+            current_batch = current_batches.get(batch.ref)
             
-            for line in orm_batch.allocations.all():
-                if line.order_id in removed_lines_order_id:
-                    line.delete()
-    
-    
-    def _create_new_allocations_from_updated_product(
-            self,
-            updated_batches: List[domain_.Batch],
-            current_batches: List[domain_.Batch]
-    ):
-        for batch in current_batches:
-            updated_batch = self._get_batch_by_ref(updated_batches, batch.ref)
-            orm_batch = orm.Batch.objects.get(ref=batch.ref)
-            new_lines = {line for line in updated_batch.allocations
-                         if line not in batch.allocations}
-            self._add_lines(new_lines, orm_batch)
+            if current_batch is None:
+                self._add_batches([batch], updated_product.sku)
+            else:
+                self._update_batch(current_batch, batch)
 
 
-    def _add_new_batches(
+    def _update_batch(
             self,
-            updated_batches: List[domain_.Batch],
-            current_batches: List[domain_.Batch],
+            current_batch: domain_.Batch,
+            updated_batch: domain_.Batch,
     ):
-        current_batches_ref = {b.ref for b in current_batches}
-        updated_batches_ref = {b.ref for b in updated_batches}
-        new_batches_ref = updated_batches_ref - current_batches_ref
+        if updated_batch.qty != current_batch.qty:
+            orm.Batch.objects.filter(ref=updated_batch.ref) \
+                             .update(qty=updated_batch.qty)
         
-        if new_batches_ref:
-            orm_product = orm.Product.objects.get(sku=updated_batches[0].sku)
+        if not updated_batch.allocations_loaded:
+            # nothing was removed, so there's no need to load lines to diff them
+            self._add_lines(updated_batch.pending_allocations, updated_batch.ref)
+            return
         
-        for batch_ref in new_batches_ref:
-            self._add_batches(
-                [self._get_batch_by_ref(updated_batches, batch_ref)],
-                orm_product
-            )
-
-
-    @staticmethod
-    def _get_batch_by_ref(batches, ref: str):
-        return next(batch for batch in batches if batch.ref == ref)
+        current_lines = set(current_batch.allocations)
+        updated_lines = set(updated_batch.allocations)
+        removed_lines = current_lines - updated_lines
+        
+        # deletions go first: a line whose qty changed is deleted and re-added
+        if removed_lines:
+            self._remove_lines(removed_lines, updated_batch.ref)
+        
+        self._add_lines(updated_lines - current_lines, updated_batch.ref)
 
     
     def list(self) -> List[domain_.Product]:
-        return [p.to_domain() for p in orm.Product.objects.all()]
+        return [p.to_domain(self._load_lines) for p in self._products()]
     
 
     def _get_by_batch_ref(self, ref):
-        products = self.list()
-        return next(
-            (p for p in products for b in p.batches if b.ref == ref),
-            None
-        )
+        sku = orm.Batch.objects.filter(ref=ref) \
+                               .values_list('product_id', flat=True) \
+                               .first()
+        return self._get(sku) if sku is not None else None
+
+
+    @staticmethod
+    def get_allocations_for_order(order_id: str) -> List[Dict[str, str]]:
+        """Returns a list of mappings `sku: batch_ref` for a given `order_id`,
+        straight from the write model (served by `unique_order_line_part`)."""
+        allocations = [
+            {sku: batch_ref}
+            for sku, batch_ref in orm.Allocation.objects
+                                     .filter(order_id=order_id)
+                                     .order_by('id')
+                                     .values_list('sku', 'batch_id')
+        ]
+        
+        if not allocations:
+            raise OrderHasNoAllocations(order_id=order_id)
+        
+        return allocations
+
+
+    @staticmethod
+    def iter_allocations(chunk_size: int = 2000) -> Iterator[Tuple]:
+        """Yields every allocation as a tuple of `ALLOCATION_FIELDS`, in the
+        order they were made, straight from the write model.
+
+        Rows are fetched `chunk_size` at a time, through a server-side cursor
+        on Postgres, and nothing is hydrated: memory stays constant whatever
+        the number of allocations."""
+        return orm.Allocation.objects \
+                             .order_by('id') \
+                             .values_list('order_id', 'sku', 'qty', 'batch_id') \
+                             .iterator(chunk_size=chunk_size)
@@ -0,0 +1,220 @@
+from dataclasses import dataclass
+from datetime import date
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from allocation.domain import model as domain_
+from allocation.domain.exceptions import (
+    InexistentProduct, LineIsAlreadyAllocatedError, OrderHasNoAllocations
+)
+from allocation.domain.ports import AbstractWriteRepository
+
+
+@dataclass(frozen=True, slots=True)
+class _ProductRow:
+    allocation_strategy: str
+    batch_refs: Tuple[str, ...]
+
+
+@dataclass(frozen=True, slots=True)
+class _BatchRow:
+    sku: str
+    qty: int
+    eta: Optional[date]
+    # sum of the lines' qty, as `orm.Batch.allocated_qty`
+    allocated_qty: int
+
+
+# `(order_id, part)` of a line, within a batch or a product
+_LineKey = Tuple[str, int]
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """State of an `InMemoryRepository`, see `InMemoryRepository.snapshot`."""
+    products: Dict[str, _ProductRow]
+    batches: Dict[str, _BatchRow]
+    # batch ref: {(order_id, part): qty}
+    lines: Dict[str, Dict[_LineKey, int]]
+    # (sku, order_id, part): batch ref, as `unique_order_line_part`
+    line_batches: Dict[Tuple[str, str, int], str]
+
+
+class InMemoryRepository(AbstractWriteRepository):
+    """Write repository holding products in memory, in the shape of the
+    database tables `DjangoRepository` works with: products, batches and their
+    lines are stored apart, and products are handed out with lazy batches.
+    Loading and updating a product costs the same whatever the number of lines
+    it holds, unless the domain needs the lines, e.g. to deallocate one.
+
+    Products handed out are built from the stored rows, and the rows only
+    change on `update`: changes the domain makes are thrown away by not
+    updating the product, as a rolled back transaction would. `snapshot` and
+    `restore` save and bring back the whole state, e.g. to run what-if
+    scenarios from the same starting point."""
+
+    def __init__(self, products: Optional[Iterable[domain_.Product]] = None
+                 ) -> None:
+        super().__init__()
+        self._products: Dict[str, _ProductRow] = {}
+        self._batches: Dict[str, _BatchRow] = {}
+        self._lines: Dict[str, Dict[_LineKey, int]] = {}
+        self._line_batches: Dict[Tuple[str, str, int], str] = {}
+        for product in products or []:
+            self.update(product)
+
+
+    def add(self, product: domain_.Product) -> None:
+        # stored by `update`, like every other change, when the unit of work
+        # commits
+        super().add(product)
+
+
+    def _get(self, sku) -> domain_.Product:
+        try:
+            row = self._products[sku]
+        except KeyError:
+            raise InexistentProduct(sku=sku)
+
+        return domain_.Product.rehydrate(
+            sku,
+            [self._batch(ref, sku) for ref in row.batch_refs],
+            row.allocation_strategy,
+        )
+
+
+    def _batch(self, ref: str, sku: str) -> domain_.Batch:
+        row = self._batches[ref]
+        return domain_.Batch.with_lazy_allocations(
+            ref, sku, row.qty, row.eta, row.allocated_qty,
+            partial(self._load_lines, ref, sku),
+        )
+
+
+    def _load_lines(self, batch_ref: str, sku: str) -> List[domain_.OrderLine]:
+        return [
+            domain_.OrderLine(order_id, sku, qty, part)
+            for (order_id, part), qty in self._lines.get(batch_ref, {}).items()
+        ]
+
+
+    def update(self, product: domain_.Product) -> None:
+        # every batch's changes are worked out, and checked, before any is
+        # stored: a product is updated entirely or not at all
+        changed = [batch for batch in product.batches if self._changed(batch)]
+        changes = [self._line_changes(batch) for batch in changed]
+        self._check_lines_unique(product.sku, changes)
+
+        self._products[product.sku] = _ProductRow(
+            product.allocation_strategy,
+            tuple(batch.ref for batch in product.batches),
+        )
+        # removals first, for a part moving between batches
+        for batch, (_, removed) in zip(changed, changes):
+            lines = self._lines.setdefault(batch.ref, {})
+            for key in removed:
+                del lines[key]
+                del self._line_batches[(product.sku, *key)]
+        for batch, (added, _) in zip(changed, changes):
+            self._lines[batch.ref].update(added)
+            for key in added:
+                self._line_batches[(product.sku, *key)] = batch.ref
+            self._batches[batch.ref] = _BatchRow(
+                product.sku, batch.qty, batch.eta, batch.allocated_qty
+            )
+
+
+    def _changed(self, batch: domain_.Batch) -> bool:
+        # lines are only added to a lazy batch, which changes its qty
+        row = self._batches.get(batch.ref)
+        return row is None \
+            or batch.allocations_loaded \
+            or batch.qty != row.qty \
+            or batch.allocated_qty != row.allocated_qty
+
+
+    def _line_changes(self, batch: domain_.Batch
+                      ) -> Tuple[Dict[_LineKey, int], Set[_LineKey]]:
+        """Returns the lines to store for `batch`, as `{(order_id, part):
+        qty}`, and the keys of those to remove."""
+        current = self._lines.get(batch.ref, {})
+
+        if not batch.allocations_loaded:
+            # nothing was removed, so there's no need to load lines to diff them
+            lines = batch.pending_allocations
+            updated = added = {(line.order_id, line.part): line.qty
+                               for line in lines}
+            removed = set()
+        else:
+            lines = batch.allocations
+            updated = {(line.order_id, line.part): line.qty for line in lines}
+            # a line whose qty changed is removed and added again
+            removed = {key for key, qty in current.items()
+                       if updated.get(key) != qty}
+            added = {key: qty for key, qty in updated.items()
+                     if current.get(key) != qty}
+
+        # the same part twice in the batch, with different quantities
+        if len(updated) < len(lines):
+            raise LineIsAlreadyAllocatedError()
+
+        return added, removed
+
+
+    def _check_lines_unique(
+            self, sku: str,
+            changes: List[Tuple[Dict[_LineKey, int], Set[_LineKey]]],
+    ) -> None:
+        # as `unique_order_line_part`: a line, or a part of it, is held by a
+        # single batch of the product
+        removed = {key for _, batch_removed in changes for key in batch_removed}
+        added = [key for batch_added, _ in changes for key in batch_added]
+
+        if len(set(added)) < len(added) or any(
+                (sku, *key) in self._line_batches and key not in removed
+                for key in added
+        ):
+            raise LineIsAlreadyAllocatedError()
+
+
+    def list(self) -> List[domain_.Product]:
+        return [self._get(sku) for sku in self._products]
+
+
+    def _get_by_batch_ref(self, ref):
+        row = self._batches.get(ref)
+        return self._get(row.sku) if row is not None else None
+
+
+    def get_allocations_for_order(self, order_id: str) -> List[Dict[str, str]]:
+        # lines are not stored by order: fine for the sizes kept in memory
+        allocations = [
+            {sku: batch_ref}
+            for (sku, line_order_id, _), batch_ref in self._line_batches.items()
+            if line_order_id == order_id
+        ]
+
+        if not allocations:
+            raise OrderHasNoAllocations(order_id=order_id)
+
+        return allocations
+
+
+    def snapshot(self) -> Snapshot:
+        """Returns a copy of the stored state. Changes to products handed out
+        and not updated yet are not part of it."""
+        return Snapshot(
+            dict(self._products),
+            dict(self._batches),
+            {ref: dict(lines) for ref, lines in self._lines.items()},
+            dict(self._line_batches),
+        )
+
+
+    def restore(self, snapshot: Snapshot) -> None:
+        """Brings the stored state back to `snapshot`, which can be restored
+        again later. Products handed out before are forgotten."""
+        self._products = dict(snapshot.products)
+        self._batches = dict(snapshot.batches)
+        self._lines = {ref: dict(lines) for ref, lines in snapshot.lines.items()}
+        self._line_batches = dict(snapshot.line_batches)
+        self._seen = set()
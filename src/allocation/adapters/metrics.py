@@ -0,0 +1,157 @@
+import bisect
+import socket
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from allocation.domain.ports import AbstractMetrics
+
+
+Tags = Tuple[Tuple[str, str], ...]
+
+
+def _freeze(tags: Optional[Dict[str, str]]) -> Tags:
+    return tuple(sorted(tags.items())) if tags else ()
+
+
+class NullMetrics(AbstractMetrics):
+
+    def increment(self, name, value=1, tags=None) -> None:
+        pass
+
+
+    def observe(self, name, value, tags=None) -> None:
+        pass
+
+
+class InMemoryMetrics(AbstractMetrics):
+    """Keeps every counter and observation in memory; meant for tests."""
+
+    def __init__(self) -> None:
+        self.counters: Dict[Tuple[str, Tags], int] = defaultdict(int)
+        self.observations: Dict[Tuple[str, Tags], List[float]] = defaultdict(list)
+
+
+    def increment(self, name, value=1, tags=None) -> None:
+        self.counters[(name, _freeze(tags))] += value
+
+
+    def observe(self, name, value, tags=None) -> None:
+        self.observations[(name, _freeze(tags))].append(value)
+
+
+    def counter(self, name: str, **tags) -> int:
+        return self.counters[(name, _freeze(tags))]
+
+
+    def observed(self, name: str, **tags) -> List[float]:
+        return self.observations[(name, _freeze(tags))]
+
+
+class PrometheusMetrics(AbstractMetrics):
+    """In-process registry rendered in the Prometheus text exposition format.
+
+    Each process keeps its own registry, so with several workers every one of
+    them must be scraped (or the numbers aggregated) separately."""
+
+    DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5,
+                       1, 2.5, 5, 10)
+
+    def __init__(self, buckets: Optional[Dict[str, Tuple[float, ...]]] = None
+    ) -> None:
+        self._buckets = buckets or {}
+        self._counters: Dict[str, Dict[Tags, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+        self._histograms: Dict[str, Dict[Tags, List]] = defaultdict(dict)
+        self._lock = threading.Lock()
+
+
+    def increment(self, name, value=1, tags=None) -> None:
+        with self._lock:
+            self._counters[name][_freeze(tags)] += value
+
+
+    def observe(self, name, value, tags=None) -> None:
+        buckets = self._buckets.get(name, self.DEFAULT_BUCKETS)
+        key = _freeze(tags)
+
+        with self._lock:
+            # [per-bucket counts (last one is +Inf), sum, count]
+            histogram = self._histograms[name].setdefault(
+                key, [[0] * (len(buckets) + 1), 0.0, 0]
+            )
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+
+    def render(self) -> str:
+        lines = []
+
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                for tags, value in series.items():
+                    lines.append(f'{name}{self._labels(tags)} {value:g}')
+
+            for name, series in sorted(self._histograms.items()):
+                buckets = self._buckets.get(name, self.DEFAULT_BUCKETS)
+                lines.append(f'# TYPE {name} histogram')
+                for tags, (counts, total, count) in series.items():
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, counts):
+                        cumulative += bucket_count
+                        labels = self._labels(tags + (('le', f'{bound:g}'),))
+                        lines.append(f'{name}_bucket{labels} {cumulative}')
+                    labels = self._labels(tags + (('le', '+Inf'),))
+                    lines.append(f'{name}_bucket{labels} {count}')
+                    lines.append(f'{name}_sum{self._labels(tags)} {total:g}')
+                    lines.append(f'{name}_count{self._labels(tags)} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+    @staticmethod
+    def _labels(tags: Tags) -> str:
+        if not tags:
+            return ''
+        escaped = (
+            (k, v.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+            for k, v in tags
+        )
+        return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+class StatsDMetrics(AbstractMetrics):
+    """Fire-and-forget UDP sink using the StatsD line protocol with
+    DogStatsD-style tags. Observations are sent as histograms, unscaled."""
+
+    def __init__(self, host: str, port: int, prefix: str = 'allocation') -> None:
+        self._address = (host, int(port))
+        self._prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+
+    def increment(self, name, value=1, tags=None) -> None:
+        self._send(self.format(name, value, 'c', tags))
+
+
+    def observe(self, name, value, tags=None) -> None:
+        self._send(self.format(name, value, 'h', tags))
+
+
+    def format(self, name: str, value: float, metric_type: str,
+               tags: Optional[Dict[str, str]] = None) -> str:
+        line = f'{self._prefix}.{name}:{value:g}|{metric_type}'
+        if tags:
+            line += '|#' + ','.join(f'{k}:{v}' for k, v in _freeze(tags))
+        return line
+
+
+    def _send(self, line: str) -> None:
+        try:
+            self._socket.sendto(line.encode(), self._address)
+        except OSError:
+            # metrics must never break message handling
+            pass
@@ -10,7 +10,9 @@ class RedisChannels:
     BATCH_CREATED           : str = 'batch_created'
     BATCH_QUANTITY_CHANGED  : str = 'batch_quantity_changed'
     LINE_ALLOCATED          : str = 'line_allocated'
+    LINE_SPLIT_ALLOCATED    : str = 'line_split_allocated'
     LINE_DEALLOCATED        : str = 'line_deallocated'
     OUT_OF_STOCK            : str = 'out_of_stock'
+    ALLOCATION_STRATEGY_CHANGED : str = 'allocation_strategy_changed'
     CONSUMER_PING           : str = 'consumer_ping'
     CONSUMER_PONG           : str = 'consumer_pong'
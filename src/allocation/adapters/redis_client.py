@@ -0,0 +1,38 @@
+import time
+import redis
+from redis.client import Pipeline
+from allocation import profiling
+
+
+class ProfiledPipeline(Pipeline):
+
+    def execute(self, raise_on_error=True):
+        if not profiling.is_profiling():
+            return super().execute(raise_on_error)
+
+        commands = len(self.command_stack)
+        start = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            profiling.record_redis_commands(commands, time.perf_counter() - start)
+
+
+class ProfiledRedis(redis.Redis):
+    """`redis.Redis` that reports its commands to the active profiles, if any."""
+
+    def execute_command(self, *args, **options):
+        if not profiling.is_profiling():
+            return super().execute_command(*args, **options)
+
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            profiling.record_redis_commands(1, time.perf_counter() - start)
+
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return ProfiledPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
@@ -1,4 +1,5 @@
 from allocation.adapters.redis_channels import RedisChannels
+from allocation.adapters.redis_client import ProfiledRedis
 from allocation.domain import events
 from allocation.domain.ports import AbstractPublisher
 import dataclasses
@@ -22,13 +23,16 @@ class RedisEventPublisher(AbstractPublisher):
             events.BatchCreated         : RedisChannels.BATCH_CREATED,
             events.BatchQuantityChanged : RedisChannels.BATCH_QUANTITY_CHANGED,
             events.LineAllocated        : RedisChannels.LINE_ALLOCATED,
+            events.LineSplitAllocated   : RedisChannels.LINE_SPLIT_ALLOCATED,
             events.LineDeallocated      : RedisChannels.LINE_DEALLOCATED,
             events.OutOfStock           : RedisChannels.OUT_OF_STOCK,
+            events.AllocationStrategyChanged
+                                        : RedisChannels.ALLOCATION_STRATEGY_CHANGED,
         }
     
     
     def __init__(self, redis_host, redis_port) -> None:
-        self._client: redis.Redis = redis.Redis(redis_host, redis_port)
+        self._client: redis.Redis = ProfiledRedis(redis_host, redis_port)
 
     
     def publish_event(self, event: events.Event):
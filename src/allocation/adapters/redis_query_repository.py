@@ -1,24 +1,95 @@
 from datetime import date
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 import redis
+from allocation.adapters.redis_client import ProfiledRedis
 from allocation.domain.ports import AbstractQueryRepository
 from allocation.domain import exceptions, model as domain_
 import pickle
 
 
+# Hashes holding an entry per batch, line and order, and their versions
+BATCHES = 'batches'
+LINE_ALLOCATIONS = 'allocation'
+ORDER_ALLOCATIONS = 'order_allocations'
+VERSIONS = 'versions'
+
+# Change log: a sorted set of the entities (`batch:<ref>`, `order:<id>` and
+# `sku:<sku>`) scored by the position of their latest change, taken from a
+# counter, for `ReadModelRebuild` to catch up with the writes made while it
+# runs. Writes only record themselves there, in the same round trip, while a
+# rebuild is registered in `REBUILDS` (scored by the position it started
+# from), and a rebuild trims the log when it ends: the log holds the changes
+# made during rebuilds, not every write.
+CHANGES = 'changes'
+CHANGES_POSITION = 'changes:position'
+REBUILDS = 'changes:rebuilds'
+
+# Records ARGV[1] as changed at the next position (KEYS[2]) of the change log
+# (KEYS[1]) if a rebuild is registered in KEYS[3]
+MARK_CHANGED = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('ZADD', KEYS[1], redis.call('INCR', KEYS[2]), ARGV[1])
+end
+"""
+
+CHANGE_LOG_KEYS = [CHANGES, CHANGES_POSITION, REBUILDS]
+
+# Adds ARGV[2] to the free quantity arriving at ETA ARGV[1] (KEYS[1], a hash
+# keyed by ETA ordinal) and rebuilds the running totals by ETA (KEYS[2], a
+# sorted set scored by ETA ordinal with `<eta>:<total>` members). Writes pay
+# for the rebuild, one member per distinct ETA, so reads are a single
+# O(log batches) lookup. The SKU is recorded in the change log (KEYS[3] to
+# KEYS[5], as in `MARK_CHANGED`) as ARGV[3].
+#
+# Deltas only apply to a SKU whose free quantity is tracked already: applied
+# to one written before it was, they would make up a total out of the batches
+# they touch. A new batch (ARGV[4] set) starts tracking a SKU that has no
+# other batch in its index (KEYS[6]); the others wait for a rebuild.
+CHANGE_AVAILABLE_TO_PROMISE = """
+local tracked = redis.call('EXISTS', KEYS[1]) == 1
+    or (ARGV[4] == '1' and redis.call('ZCARD', KEYS[6]) <= 1)
+if tracked then
+    redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+    local free = redis.call('HGETALL', KEYS[1])
+    local etas = {}
+    for i = 1, #free, 2 do
+        etas[#etas + 1] = {tonumber(free[i]), tonumber(free[i + 1])}
+    end
+    table.sort(etas, function(a, b) return a[1] < b[1] end)
+
+    redis.call('DEL', KEYS[2])
+    local total = 0
+    for _, eta in ipairs(etas) do
+        total = total + eta[2]
+        redis.call('ZADD', KEYS[2], eta[1], eta[1] .. ':' .. total)
+    end
+end
+if redis.call('EXISTS', KEYS[5]) == 1 then
+    redis.call('ZADD', KEYS[3], redis.call('INCR', KEYS[4]), ARGV[3])
+end
+"""
+
+# ETA ordinal of batches in stock, before any shipment
+IN_STOCK = 0
+
+
 class RedisQueryRepository(AbstractQueryRepository):
     
-    def __init__(self, redis_host, redis_port) -> None:
-        self._client: redis.Redis = redis.Redis(redis_host, redis_port)
+    def __init__(self, redis_host, redis_port, db: int = 0) -> None:
+        self._client: redis.Redis = ProfiledRedis(redis_host, redis_port, db)
+        self._change_available_to_promise = self._client.register_script(
+            CHANGE_AVAILABLE_TO_PROMISE
+        )
+        self._mark_changed = self._client.register_script(MARK_CHANGED)
     
     
     def add_batch(self, ref: str, sku: str, qty: int, eta: Optional[date] = None):
-        serialized_batch = pickle.dumps(domain_.Batch(ref, sku, qty, eta))
-        self._client.hset('batches', ref, serialized_batch)
+        self._set_batch(ref, sku, qty, eta, index=True)
+        self._change_sku_available_to_promise(sku, eta, qty, new_batch=True)
 
 
     def get_batch(self, ref: str):
-        batch_data = self._client.hget('batches', ref)
+        batch_data = self._client.hget(BATCHES, ref)
         
         if batch_data is None:
             raise exceptions.BatchDoesNotExist(ref=ref)
@@ -26,19 +97,62 @@ class RedisQueryRepository(AbstractQueryRepository):
         return pickle.loads(batch_data)
 
 
+    def get_batches(self, refs: Iterable[str]) -> Dict[str, domain_.Batch]:
+        return self._get_many(BATCHES, refs)
+
+
     def update_batch_quantity(self, ref: str, qty: int):
         domain_batch = self.get_batch(ref)
         batch_dict = domain_batch.properties_dict
+        delta = qty - batch_dict['qty']
         batch_dict['qty'] = qty
-        self.add_batch(**batch_dict)
+        self._set_batch(**batch_dict)
+        self._change_sku_available_to_promise(
+            batch_dict['sku'], batch_dict['eta'], delta
+        )
+
+
+    def _set_batch(self, ref: str, sku: str, qty: int, eta: Optional[date] = None,
+                   index: bool = False):
+        serialized_batch = pickle.dumps(domain_.Batch(ref, sku, qty, eta))
+        with self._client.pipeline() as pipe:
+            pipe.hset(BATCHES, ref, serialized_batch)
+            if index:
+                pipe.zadd(sku_batches_key(sku), {sku_batches_member(ref, eta): 0})
+            pipe.hincrby(VERSIONS, f'batch:{ref}', 1)
+            self._mark_changed(keys=CHANGE_LOG_KEYS,
+                               args=[f'batch:{ref}'], client=pipe)
+            pipe.execute()
+
+
+    def get_batches_for_sku(
+            self, sku: str, after: Optional[str], limit: int
+    ) -> Tuple[List[domain_.Batch], Optional[str]]:
+        # all members share a score, so they sort by `<eta>:<ref>` and a page
+        # is a ZRANGEBYLEX past the cursor, one member longer than asked for
+        # to tell whether there is a next page
+        members = self._client.zrangebylex(
+            sku_batches_key(sku), '-' if after is None else f'({after}', '+',
+            start=0, num=limit + 1,
+        )
+        page = [member.decode() for member in members[:limit]]
+        refs = [member.split(':', 1)[1] for member in page]
+        batches = self._get_many(BATCHES, refs)
+
+        next_cursor = page[-1] if len(members) > limit else None
+        return [batches[ref] for ref in refs if ref in batches], next_cursor
+
+
+    def get_batch_version(self, ref: str) -> Optional[int]:
+        return self._get_version(f'batch:{ref}')
 
 
     def add_allocation_for_line(self, order_id, sku, batch_ref):
-        self._client.hset('allocation', f'{order_id}--{sku}', batch_ref)
+        self._client.hset(LINE_ALLOCATIONS, line_key(order_id, sku), batch_ref)
 
 
     def get_allocation_for_line(self, order_id: str, sku: str) -> str:
-        batch_ref = self._client.hget('allocation', f'{order_id}--{sku}')
+        batch_ref = self._client.hget(LINE_ALLOCATIONS, line_key(order_id, sku))
 
         if batch_ref is None:
             raise exceptions.LineIsNotAllocatedError(line_info=(order_id, sku))
@@ -47,7 +161,7 @@ class RedisQueryRepository(AbstractQueryRepository):
 
 
     def remove_allocation_for_line(self, order_id, sku):
-        self._client.hdel('allocation', f'{order_id}--{sku}')
+        self._client.hdel(LINE_ALLOCATIONS, line_key(order_id, sku))
 
 
     def add_allocation_for_order(self, order_id, sku, batch_ref):
@@ -59,11 +173,11 @@ class RedisQueryRepository(AbstractQueryRepository):
         except exceptions.OrderHasNoAllocations:
             allocations = [new_allocation]
         
-        self._client.hset('order_allocations', order_id, pickle.dumps(allocations))
+        self._set_allocations_for_order(order_id, allocations)
 
 
     def get_allocations_for_order(self, order_id: str):
-        allocations = self._client.hget('order_allocations', order_id)
+        allocations = self._client.hget(ORDER_ALLOCATIONS, order_id)
 
         if allocations is None:
             raise exceptions.OrderHasNoAllocations(order_id=order_id)
@@ -71,7 +185,114 @@ class RedisQueryRepository(AbstractQueryRepository):
         return pickle.loads(allocations)
 
 
-    def remove_allocation_for_order(self, order_id, sku):
+    def get_allocations_for_orders(
+            self, order_ids: Iterable[str]
+    ) -> Dict[str, List[Dict[str, str]]]:
+        return self._get_many(ORDER_ALLOCATIONS, order_ids)
+
+
+    def _get_many(self, name: str, keys: Iterable[str]) -> Dict:
+        # a single HMGET, whatever the number of keys
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+
+        values = self._client.hmget(name, keys)
+        return {
+            key: pickle.loads(value)
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+
+
+    def remove_allocation_for_order(self, order_id, sku, batch_ref):
         allocations = self.get_allocations_for_order(order_id)
-        allocations = [a for a in allocations if sku not in a]
-        self._client.hset('order_allocations', order_id, pickle.dumps(allocations))
+        removed = {sku: batch_ref}
+        if removed in allocations:
+            allocations.remove(removed)
+        self._set_allocations_for_order(order_id, allocations)
+
+
+    def _set_allocations_for_order(self, order_id, allocations):
+        with self._client.pipeline() as pipe:
+            pipe.hset(ORDER_ALLOCATIONS, order_id, pickle.dumps(allocations))
+            pipe.hincrby(VERSIONS, f'order:{order_id}', 1)
+            self._mark_changed(keys=CHANGE_LOG_KEYS,
+                               args=[f'order:{order_id}'], client=pipe)
+            pipe.execute()
+
+
+    def get_allocations_for_order_version(self, order_id: str) -> Optional[int]:
+        return self._get_version(f'order:{order_id}')
+
+
+    def _get_version(self, entity: str) -> Optional[int]:
+        # bumped in the same transaction as the entity is written
+        version = self._client.hget(VERSIONS, entity)
+        return None if version is None else int(version)
+
+
+    def change_available_to_promise(self, batch_ref: str, delta: int):
+        batch = self.get_batch(batch_ref)
+        self._change_sku_available_to_promise(batch.sku, batch.eta, delta)
+
+
+    def _change_sku_available_to_promise(self, sku: str, eta: Optional[date],
+                                         delta: int, new_batch: bool = False):
+        self._change_available_to_promise(
+            keys=[atp_free_key(sku), atp_key(sku), *CHANGE_LOG_KEYS,
+                  sku_batches_key(sku)],
+            args=[eta_ordinal(eta), delta, f'sku:{sku}', int(new_batch)],
+        )
+
+
+    def get_free_capacity(self, sku: str) -> Optional[int]:
+        return self._running_total(sku, '+inf')
+
+
+    def get_available_to_promise(self, sku: str, by: Optional[date] = None) -> int:
+        total = self._running_total(sku, '+inf' if by is None else eta_ordinal(by))
+        return total or 0
+
+
+    def _running_total(self, sku: str, max_eta) -> Optional[int]:
+        # the running total at the latest ETA not after `max_eta`
+        totals = self._client.zrevrangebyscore(
+            atp_key(sku), max_eta, '-inf', start=0, num=1,
+        )
+        if not totals:
+            return None
+
+        _, total = totals[0].split(b':')
+        return int(total)
+
+
+def eta_ordinal(eta: Optional[date]) -> int:
+    return IN_STOCK if eta is None else eta.toordinal()
+
+
+def line_key(order_id: str, sku: str) -> str:
+    return f'{order_id}--{sku}'
+
+
+def split_line_key(key: str) -> Tuple[str, str]:
+    order_id, _, sku = key.partition('--')
+    return order_id, sku
+
+
+def atp_free_key(sku: str) -> str:
+    return f'atp:{sku}:free'
+
+
+def atp_key(sku: str) -> str:
+    return f'atp:{sku}'
+
+
+def sku_batches_key(sku: str) -> str:
+    return f'sku_batches:{sku}'
+
+
+def sku_batches_member(ref: str, eta: Optional[date]) -> str:
+    # ordinals are zero-padded to the 7 digits of `date.max` for them to sort
+    # lexicographically
+    return f'{eta_ordinal(eta):07d}:{ref}'
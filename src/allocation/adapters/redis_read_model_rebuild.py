@@ -0,0 +1,414 @@
+"""Rebuild of the Redis read model from the write model, for when it was lost
+or drifted. Run with the `rebuild_read_model` management command."""
+import pickle
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import groupby, islice
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import redis
+from allocation.adapters.redis_query_repository import (
+    BATCHES, CHANGES, CHANGES_POSITION, LINE_ALLOCATIONS, ORDER_ALLOCATIONS,
+    REBUILDS, VERSIONS, atp_free_key, atp_key, eta_ordinal, line_key, sku_batches_key,
+    sku_batches_member,
+)
+from allocation.config import get_logger
+from allocation.domain import model as domain_
+from dddjango.alloc import models as orm
+
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# passes over the change log before giving up on it going quiet
+MAX_CATCH_UP_PASSES = 10
+
+# seconds a rebuild stays registered in the change log without progressing,
+# so that one killed midway doesn't keep writes recording their changes
+REGISTRATION_TTL = 600
+
+# Registers rebuild ARGV[1] in KEYS[1], for writes to record their changes,
+# from the current position of the change log (KEYS[2]), which is returned
+REGISTER = """
+local position = tonumber(redis.call('GET', KEYS[2]) or 0)
+redis.call('ZADD', KEYS[1], position, ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return position
+"""
+
+# Unregisters rebuild ARGV[1] from KEYS[1] and trims the change log (KEYS[2])
+# to the changes rebuilds still registered read, i.e. past their position
+UNREGISTER = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+if #oldest == 0 then
+    redis.call('UNLINK', KEYS[2])
+else
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', oldest[2])
+end
+"""
+
+# Renames the shadow (ARGV[1] prefixed) of each of KEYS over it, or deletes it
+# when it has none (e.g. a hash emptied while catching up). The live keys are
+# unlinked first, for Redis to free them in the background rather than while
+# the script blocks it.
+SWAP = """
+for _, key in ipairs(KEYS) do
+    redis.call('UNLINK', key)
+    if redis.call('EXISTS', ARGV[1] .. key) == 1 then
+        redis.call('RENAME', ARGV[1] .. key, key)
+    end
+end
+"""
+
+
+@dataclass
+class RebuildReport:
+    """What a rebuild wrote, per phase: rows read from the write model and
+    seconds taken."""
+    rows: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    seconds: Dict[str, float] = field(default_factory=lambda: defaultdict(float))
+    # entities still changing when catching up gave up
+    behind: int = 0
+
+
+    def throughput(self, phase: str) -> float:
+        return self.rows[phase] / self.seconds[phase] if self.seconds[phase] else 0.
+
+
+class ReadModelRebuild:
+    """Rebuilds the keys of `RedisQueryRepository` from the write model, while
+    the read model keeps being served and written to:
+
+    1. Every key is written again under a shadow prefix, from the write model
+       streamed `chunk_size` rows at a time, each chunk sent as one pipeline.
+    2. Entities recorded in the change log since the rebuild started are
+       rebuilt again in the shadow keys, pass after pass until none changed.
+    3. The shadow keys are renamed over the live ones. A script blocks
+       Redis while it runs, so the per SKU keys are swapped `chunk_size`
+       keys at a time, each SKU's keys together: readers see the keys of
+       every SKU either old or new. The hashes shared by all entities, which
+       are renamed whatever their size, are swapped last by a single
+       script.
+    4. Entities changed since the last pass are caught up the same way in the
+       live keys, which also undoes writes that were applied on top of data
+       that already held them.
+
+    Writes only record their changes in the change log while a rebuild is
+    registered there: from its start until it ends, when the log is trimmed.
+
+    Rebuilt entities get the version the rebuild started at, in microseconds
+    since the epoch, which is past any version bumped one change at a time:
+    ETags handed out before the rebuild never match."""
+
+    def __init__(self, client: redis.Redis, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 progress: Optional[Callable[[str], None]] = None) -> None:
+        self._client = client
+        self._chunk_size = chunk_size
+        self._progress = progress or (lambda message: None)
+        self._logger = get_logger(__name__)
+        self._version = time.time_ns() // 1000
+        self._shadow = f'rebuild:{self._version}:'
+        # SKUs whose keys were given a shadow
+        self._shadow_skus: Set[str] = set()
+        self._registered = False
+        self._swapped = False
+        self.report = RebuildReport()
+
+
+    def run(self) -> RebuildReport:
+        position = self._register()
+        try:
+            self._phase('batches', self._write_all_skus)
+            self._phase('orders', self._write_all_orders)
+            position = self._phase(
+                'catch_up_shadow', self._catch_up, position, self._shadow
+            )
+            self._phase('swap', self._swap)
+            self._phase('catch_up_live', self._catch_up, position, '')
+        finally:
+            if not self._swapped:
+                self._drop_shadow()
+            self._unregister()
+
+        return self.report
+
+
+    def repair(self, entities: Iterable[str]) -> None:
+        """Rebuilds only `entities` (`batch:<ref>`, `order:<id>` or
+        `sku:<sku>`, as in the change log), in place in the live keys."""
+        self._rebuild_entities(list(entities), '', 'repair')
+
+
+    def _phase(self, name: str, run: Callable, *args):
+        self._keep_registered(self._client)
+        start = time.perf_counter()
+        result = run(*args)
+        self.report.seconds[name] += time.perf_counter() - start
+
+        message = (f'{name}: {self.report.rows[name]} rows in '
+                   f'{self.report.seconds[name]:.1f}s '
+                   f'({self.report.throughput(name):.0f} rows/s)')
+        self._logger.info('Read model rebuild %s', message)
+        self._progress(message)
+        return result
+
+
+    def _change_log_position(self) -> int:
+        return int(self._client.get(CHANGES_POSITION) or 0)
+
+
+    def _register(self) -> int:
+        position = self._client.register_script(REGISTER)(
+            keys=[REBUILDS, CHANGES_POSITION],
+            args=[self._version, REGISTRATION_TTL],
+        )
+        self._registered = True
+        return int(position)
+
+
+    def _keep_registered(self, client) -> None:
+        if self._registered:
+            client.expire(REBUILDS, REGISTRATION_TTL)
+
+
+    def _unregister(self) -> None:
+        self._client.register_script(UNREGISTER)(keys=[REBUILDS, CHANGES],
+                                                 args=[self._version])
+        self._registered = False
+
+
+    # Full passes: the write model is streamed in key order, and each SKU or
+    # order is written as soon as all of its rows were read.
+
+    def _write_all_skus(self) -> None:
+        rows = orm.Batch.objects \
+                        .order_by('product_id') \
+                        .values_list('product_id', 'ref', 'qty', 'eta',
+                                     'allocated_qty') \
+                        .iterator(chunk_size=self._chunk_size)
+        self._write_skus(self._shadow, rows, (), 'batches')
+
+
+    def _write_all_orders(self) -> None:
+        rows = orm.Allocation.objects \
+                             .order_by('order_id', 'id') \
+                             .values_list('order_id', 'sku', 'batch_id', 'part') \
+                             .iterator(chunk_size=self._chunk_size)
+        self._write_orders(self._shadow, rows, (), {}, 'orders')
+
+
+    def _write_skus(self, prefix: str, rows: Iterable[Tuple],
+                    skus: Iterable[str], phase: str) -> None:
+        """Writes the batches and per SKU keys of the SKUs in `rows` (sorted
+        by SKU), and clears those of `skus` without any."""
+        live = prefix == ''
+        with self._client.pipeline(transaction=live) as pipe:
+            written = set()
+            for sku, batches in groupby(rows, key=itemgetter(0)):
+                batches = list(batches)
+                self._write_sku(pipe, prefix, sku, batches, live)
+                self.report.rows[phase] += len(batches)
+                written.add(sku)
+                self._flush(pipe)
+
+            for sku in set(skus) - written:
+                self._write_sku(pipe, prefix, sku, [], live)
+                self._flush(pipe)
+            pipe.execute()
+
+
+    def _write_sku(self, pipe, prefix: str, sku: str, batches: List[Tuple],
+                   live: bool) -> None:
+        free = defaultdict(int)
+        for _, ref, qty, eta, allocated_qty in batches:
+            free[eta_ordinal(eta)] += qty - allocated_qty
+
+        # same layout as `CHANGE_AVAILABLE_TO_PROMISE` keeps
+        totals, total = {}, 0
+        for ordinal in sorted(free):
+            total += free[ordinal]
+            totals[f'{ordinal}:{total}'] = ordinal
+
+        keys = [atp_free_key(sku), atp_key(sku), sku_batches_key(sku)]
+        pipe.delete(*(prefix + key for key in keys))
+        if not batches:
+            return
+
+        pipe.hset(prefix + atp_free_key(sku), mapping=free)
+        pipe.zadd(prefix + atp_key(sku), totals)
+        pipe.zadd(prefix + sku_batches_key(sku), {
+            sku_batches_member(ref, eta): 0 for _, ref, _, eta, _ in batches
+        })
+        pipe.hset(prefix + BATCHES, mapping={
+            ref: pickle.dumps(domain_.Batch(ref, sku, qty, eta))
+            for _, ref, qty, eta, _ in batches
+        })
+        self._write_versions(pipe, prefix, [
+            f'batch:{ref}' for _, ref, _, _, _ in batches
+        ], live)
+        if not live:
+            self._shadow_skus.add(sku)
+
+
+    def _write_orders(self, prefix: str, rows: Iterable[Tuple],
+                      order_ids: Iterable[str],
+                      previous: Dict[str, List[Dict[str, str]]],
+                      phase: str) -> None:
+        """Writes the allocations of the orders in `rows` (sorted by order),
+        and clears those of `order_ids` without any. The lines of the
+        `previous` allocations that are gone are cleared too."""
+        live = prefix == ''
+        with self._client.pipeline(transaction=live) as pipe:
+            written = set()
+            for order_id, parts in groupby(rows, key=itemgetter(0)):
+                parts = [part[1:] for part in parts]
+                self._write_order(pipe, prefix, order_id, parts,
+                                  previous.get(order_id, []), live)
+                self.report.rows[phase] += len(parts)
+                written.add(order_id)
+                self._flush(pipe)
+
+            for order_id in set(order_ids) - written:
+                self._write_order(pipe, prefix, order_id, [],
+                                  previous.get(order_id, []), live)
+                self._flush(pipe)
+            pipe.execute()
+
+
+    def _write_order(self, pipe, prefix: str, order_id: str,
+                     parts: List[Tuple[str, str, int]],
+                     previous: List[Dict[str, str]], live: bool) -> None:
+        """`parts` are the order's `(sku, batch_ref, part)` allocations, in
+        the order they were made."""
+        allocations = [{sku: batch_ref} for sku, batch_ref, _ in parts]
+        # a line maps to the batch holding its first part, as `add_allocation`
+        # and `add_split_allocation` do
+        lines = {line_key(order_id, sku): batch_ref
+                 for sku, batch_ref, part in parts if part == 0}
+
+        gone = {line_key(order_id, sku) for allocation in previous
+                for sku in allocation} - set(lines)
+        if gone:
+            pipe.hdel(prefix + LINE_ALLOCATIONS, *gone)
+
+        if not allocations:
+            pipe.hdel(prefix + ORDER_ALLOCATIONS, order_id)
+            pipe.hdel(prefix + VERSIONS, f'order:{order_id}')
+            return
+
+        pipe.hset(prefix + ORDER_ALLOCATIONS, order_id, pickle.dumps(allocations))
+        pipe.hset(prefix + LINE_ALLOCATIONS, mapping=lines)
+        self._write_versions(pipe, prefix, [f'order:{order_id}'], live)
+
+
+    def _write_versions(self, pipe, prefix: str, entities: List[str],
+                        live: bool) -> None:
+        if live:
+            for entity in entities:
+                pipe.hincrby(VERSIONS, entity, 1)
+        else:
+            pipe.hset(prefix + VERSIONS,
+                      mapping=dict.fromkeys(entities, self._version))
+
+
+    def _flush(self, pipe) -> None:
+        if len(pipe) >= self._chunk_size:
+            self._keep_registered(pipe)
+            pipe.execute()
+
+
+    # Catching up: entities in the change log past `position` are read again
+    # from the write model, `chunk_size` at a time.
+
+    def _catch_up(self, position: int, prefix: str) -> int:
+        phase = 'catch_up_live' if prefix == '' else 'catch_up_shadow'
+        for _ in range(MAX_CATCH_UP_PASSES):
+            # anything changed from here on is left to the next pass
+            pass_position = self._change_log_position()
+            changed = [
+                member.decode() for member in
+                self._client.zrangebyscore(CHANGES, f'({position}', '+inf')
+            ]
+            if not changed:
+                self.report.behind = 0
+                return position
+
+            self.report.behind = len(changed)
+            self._rebuild_entities(changed, prefix, phase)
+            position = pass_position
+
+        self._logger.warning('Read model rebuild gave up catching up with %d '
+                             'changing entities', self.report.behind)
+        return position
+
+
+    def _rebuild_entities(self, entities: List[str], prefix: str,
+                          phase: str) -> None:
+        by_kind = defaultdict(list)
+        for entity in entities:
+            kind, _, key = entity.partition(':')
+            by_kind[kind].append(key)
+
+        # a batch change rebuilds its SKU as a whole
+        skus = set(by_kind['sku'])
+        for chunk in _chunks(by_kind['batch'], self._chunk_size):
+            skus.update(orm.Batch.objects.filter(ref__in=chunk)
+                                         .values_list('product_id', flat=True))
+
+        for chunk in _chunks(sorted(skus), self._chunk_size):
+            rows = orm.Batch.objects \
+                            .filter(product_id__in=chunk) \
+                            .order_by('product_id') \
+                            .values_list('product_id', 'ref', 'qty', 'eta',
+                                         'allocated_qty')
+            self._write_skus(prefix, rows, chunk, phase)
+
+        for chunk in _chunks(sorted(by_kind['order']), self._chunk_size):
+            previous = {
+                order_id: pickle.loads(allocations)
+                for order_id, allocations in zip(
+                    chunk, self._client.hmget(prefix + ORDER_ALLOCATIONS, chunk)
+                )
+                if allocations is not None
+            }
+            rows = orm.Allocation.objects \
+                                 .filter(order_id__in=chunk) \
+                                 .order_by('order_id', 'id') \
+                                 .values_list('order_id', 'sku', 'batch_id', 'part')
+            self._write_orders(prefix, rows, chunk, previous, phase)
+
+
+    # Swapping
+
+    def _swap(self) -> None:
+        swap = self._client.register_script(SWAP)
+        skus_per_chunk = max(1, self._chunk_size // 3)
+        for skus in _chunks(sorted(self._shadow_skus), skus_per_chunk):
+            keys = [key for sku in skus
+                    for key in (atp_free_key(sku), atp_key(sku),
+                                sku_batches_key(sku))]
+            swap(keys=keys, args=[self._shadow])
+            self.report.rows['swap'] += len(keys)
+
+        # the hashes are swapped even if nothing was rebuilt into them
+        hashes = [BATCHES, LINE_ALLOCATIONS, ORDER_ALLOCATIONS, VERSIONS]
+        swap(keys=hashes, args=[self._shadow])
+        self._swapped = True
+        self.report.rows['swap'] += len(hashes)
+
+
+    def _drop_shadow(self) -> None:
+        for keys in _chunks(self._client.scan_iter(f'{self._shadow}*',
+                                                   count=self._chunk_size),
+                            self._chunk_size):
+            self._client.unlink(*keys)
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,397 @@
+"""Verification of the Redis read model against the write model, meant to run
+continuously in production. Run with the `verify_read_model` management
+command."""
+import pickle
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+import redis
+from django.db import connections
+from django.db.models import Q
+from allocation.adapters.metrics import NullMetrics
+from allocation.adapters.redis_query_repository import (
+    BATCHES, LINE_ALLOCATIONS, VERSIONS, atp_key, eta_ordinal, line_key,
+    split_line_key,
+)
+from allocation.adapters.redis_read_model_rebuild import ReadModelRebuild
+from allocation.config import get_logger
+from allocation.domain.ports import AbstractMetrics
+from dddjango.alloc import models as orm
+
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_KEYS_PER_SECOND = 2000
+
+# time for writes already committed to reach the read model, after which a
+# drift is checked again before being reported
+DEFAULT_GRACE_SECONDS = 1.0
+
+# drifts a report keeps, beyond which they are only counted
+MAX_REPORTED_DRIFTS = 1000
+
+# the read model hash holding each kind of entry, but the available to
+# promise totals, which are a sorted set per SKU
+HASHES = {'batch': BATCHES, 'line': LINE_ALLOCATIONS}
+KINDS = ('batch', 'line', 'atp')
+
+ATP_PREFIX = atp_key('')
+
+
+@dataclass(frozen=True)
+class Drift:
+    """An entry of the read model that differs from the write model. `expected`
+    is `None` for an entry the write model does not have, `actual` for one
+    missing from the read model."""
+    kind: str
+    # batch ref, `line_key` of the line, or SKU
+    key: str
+    # `(sku, qty, eta)` for batches, `(batch_ref,)` for lines and
+    # `((eta ordinal, free qty), ...)` for the available to promise of SKUs
+    expected: Optional[Tuple]
+    actual: Optional[Tuple]
+
+
+@dataclass
+class VerificationReport:
+    checked: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    drifted: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    drifts: List[Drift] = field(default_factory=list)
+    repaired: int = 0
+
+
+    @property
+    def consistent(self) -> bool:
+        return not any(self.drifted.values())
+
+
+class RateLimit:
+    """Spaces out `acquire` calls, across threads, to `rate` units a second."""
+
+    def __init__(self, rate: float) -> None:
+        self._interval = 1 / rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+
+    def acquire(self, units: int = 1) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + units * self._interval
+        time.sleep(start - now)
+
+
+class ReadModelVerifier:
+    """Compares the batches (SKU, quantity and ETA), the line to batch
+    mappings and the available to promise totals per SKU of
+    `RedisQueryRepository` with the write model.
+
+    Keys are checked `chunk_size` at a time, each chunk read from both sides.
+    Chunks come from keyset paginated SQL on the write model, which finds
+    entries missing from the read model, and from HSCAN (SCAN for the totals)
+    on the read model, which finds entries the write model does not have (and
+    only reports those, the others being the write model scans' to report).
+    These six scans run in parallel and share a budget of `keys_per_second`. `sample`
+    checks random chunks instead of every key.
+
+    Writes reach the read model after the write model commits them, so a
+    drift is only reported, and repaired if asked for, when it is still
+    there `grace` seconds later."""
+
+    def __init__(self, client: redis.Redis, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 keys_per_second: float = DEFAULT_KEYS_PER_SECOND,
+                 grace: float = DEFAULT_GRACE_SECONDS, repair: bool = False,
+                 metrics: Optional[AbstractMetrics] = None) -> None:
+        self._client = client
+        self._chunk_size = chunk_size
+        self._rate_limit = RateLimit(keys_per_second)
+        self._grace = grace
+        self._repair = repair
+        self._metrics = metrics or NullMetrics()
+        self._logger = get_logger(__name__)
+        self._lock = threading.Lock()
+        self.report = VerificationReport()
+
+
+    def verify(self) -> VerificationReport:
+        """Checks every key, on both sides."""
+        return self._run([
+            partial(scan, kind)
+            for kind in KINDS
+            for scan in (self._scan_write_model, self._scan_read_model)
+        ])
+
+
+    def sample(self, chunks: int) -> VerificationReport:
+        """Checks `chunks` chunks of each kind of key: random keys of the read
+        model, and the write model's keys following a random one of them."""
+        return self._run([
+            partial(self._sample, kind, chunks) for kind in KINDS
+        ])
+
+
+    def _run(self, scans: List[Callable[[], None]]) -> VerificationReport:
+        self.report = VerificationReport()
+        with ThreadPoolExecutor(max_workers=len(scans)) as executor:
+            futures = [executor.submit(self._in_thread, scan) for scan in scans]
+        for future in futures:
+            future.result()
+
+        return self.report
+
+
+    @staticmethod
+    def _in_thread(scan: Callable[[], None]) -> None:
+        try:
+            scan()
+        finally:
+            # each thread has its own database connections
+            connections.close_all()
+
+
+    # Scans
+
+    def _scan_write_model(self, kind: str) -> None:
+        after = None
+        while True:
+            keys, after = self._write_model_page(kind, after)
+            if not keys:
+                return
+            self._check(kind, keys)
+
+
+    def _scan_read_model(self, kind: str) -> None:
+        cursor = 0
+        while True:
+            if kind == 'atp':
+                cursor, keys = self._client.scan(
+                    cursor, match=f'{ATP_PREFIX}*', count=self._chunk_size,
+                    _type='zset',
+                )
+                keys = [key.decode()[len(ATP_PREFIX):] for key in keys]
+            else:
+                cursor, entries = self._client.hscan(
+                    HASHES[kind], cursor, count=self._chunk_size
+                )
+                keys = [key.decode() for key in entries]
+            if keys:
+                self._check(kind, keys, orphans_only=True)
+            if cursor == 0:
+                return
+
+
+    def _sample(self, kind: str, chunks: int) -> None:
+        for _ in range(chunks):
+            keys = self._random_keys(kind)
+            # from the start when the read model has no such keys at all
+            after = self._cursor(kind, random.choice(keys)) if keys else None
+            following, _ = self._write_model_page(kind, after)
+            if keys or following:
+                self._check(kind, keys + following)
+            if not keys:
+                return
+
+
+    def _random_keys(self, kind: str) -> List[str]:
+        if kind == 'atp':
+            # the SKUs of random batches
+            batches = self._client.hrandfield(BATCHES, self._chunk_size,
+                                              withvalues=True) or []
+            return list(dict.fromkeys(pickle.loads(batch).sku
+                                      for batch in batches[1::2]))
+
+        return [key.decode() for key in
+                self._client.hrandfield(HASHES[kind], self._chunk_size) or []]
+
+
+    def _write_model_page(self, kind: str, after) -> Tuple[List[str], object]:
+        """Returns the keys of the write model following the cursor `after`
+        (`None` to start from the first one), and the cursor of the last."""
+        if kind == 'atp':
+            skus = orm.Product.objects.order_by('sku') \
+                                      .values_list('sku', flat=True)
+            if after is not None:
+                skus = skus.filter(sku__gt=after)
+            skus = list(skus[:self._chunk_size])
+            return skus, skus[-1] if skus else None
+
+        if kind == 'batch':
+            refs = orm.Batch.objects.order_by('ref').values_list('ref', flat=True)
+            if after is not None:
+                refs = refs.filter(ref__gt=after)
+            refs = list(refs[:self._chunk_size])
+            return refs, refs[-1] if refs else None
+
+        # keyset on the `unique_order_line_part` index, over first parts: a
+        # line is mapped while its first part is allocated
+        lines = orm.Allocation.objects.filter(part=0) \
+                                      .order_by('order_id', 'sku') \
+                                      .values_list('order_id', 'sku')
+        if after is not None:
+            order_id, sku = after
+            lines = lines.filter(Q(order_id__gt=order_id)
+                                 | Q(order_id=order_id, sku__gt=sku))
+        lines = list(lines[:self._chunk_size])
+        return [line_key(*line) for line in lines], lines[-1] if lines else None
+
+
+    @staticmethod
+    def _cursor(kind: str, key: str):
+        return split_line_key(key) if kind == 'line' else key
+
+
+    # Checks
+
+    def _check(self, kind: str, keys: List[str],
+               orphans_only: bool = False) -> None:
+        keys = list(dict.fromkeys(keys))
+        self._rate_limit.acquire(len(keys))
+
+        drifts = self._compare(kind, keys, orphans_only)
+        if drifts and self._grace:
+            time.sleep(self._grace)
+            drifts = self._compare(kind, [drift.key for drift in drifts],
+                                   orphans_only)
+
+        self._record(kind, len(keys), drifts)
+        if drifts and self._repair:
+            self._repair_drifts(kind, drifts)
+
+
+    def _compare(self, kind: str, keys: List[str],
+                 orphans_only: bool = False) -> List[Drift]:
+        if kind == 'batch':
+            expected, actual = self._batches(keys)
+        elif kind == 'line':
+            expected, actual = self._lines(keys)
+        else:
+            expected, actual = self._available_to_promise(keys)
+
+        return [
+            Drift(kind, key, expected.get(key), actual.get(key))
+            for key in keys
+            if expected.get(key) != actual.get(key)
+            and not (orphans_only and key in expected)
+        ]
+
+
+    def _batches(self, refs: List[str]) -> Tuple[Dict, Dict]:
+        expected = {
+            ref: (sku, qty, eta)
+            for ref, sku, qty, eta in orm.Batch.objects
+                                         .filter(ref__in=refs)
+                                         .values_list('ref', 'product_id',
+                                                      'qty', 'eta')
+        }
+        actual = {}
+        for ref, value in zip(refs, self._client.hmget(BATCHES, refs)):
+            if value is not None:
+                batch = pickle.loads(value)
+                actual[ref] = (batch.sku, batch.qty, batch.eta)
+
+        return expected, actual
+
+
+    def _lines(self, keys: List[str]) -> Tuple[Dict, Dict]:
+        lines = {split_line_key(key) for key in keys}
+        expected = {}
+        # a line maps to the batch holding its first part
+        for order_id, sku, batch_ref in orm.Allocation.objects \
+                .filter(order_id__in={order_id for order_id, _ in lines}, part=0) \
+                .values_list('order_id', 'sku', 'batch_id'):
+            if (order_id, sku) in lines:
+                expected[line_key(order_id, sku)] = (batch_ref,)
+
+        actual = {
+            key: (value.decode(),)
+            for key, value in zip(keys, self._client.hmget(LINE_ALLOCATIONS, keys))
+            if value is not None
+        }
+        return expected, actual
+
+
+    def _available_to_promise(self, skus: List[str]) -> Tuple[Dict, Dict]:
+        # the free quantity by ETA, for SKUs with batches, without the ETAs
+        # with nothing free, which the read model may or may not hold
+        free = defaultdict(lambda: defaultdict(int))
+        for sku, qty, eta, allocated_qty in orm.Batch.objects \
+                .filter(product_id__in=skus) \
+                .values_list('product_id', 'qty', 'eta', 'allocated_qty'):
+            free[sku][eta_ordinal(eta)] += qty - allocated_qty
+        expected = {
+            sku: tuple(sorted((ordinal, qty) for ordinal, qty in by_eta.items()
+                              if qty))
+            for sku, by_eta in free.items()
+        }
+
+        with self._client.pipeline(transaction=False) as pipe:
+            for sku in skus:
+                pipe.zrange(atp_key(sku), 0, -1)
+            totals = pipe.execute()
+
+        actual = {}
+        for sku, members in zip(skus, totals):
+            if not members:
+                continue
+            # running totals, `<eta ordinal>:<total>`, back to free quantities
+            previous, by_eta = 0, []
+            for ordinal, total in sorted(
+                    tuple(map(int, member.split(b':'))) for member in members
+            ):
+                if total != previous:
+                    by_eta.append((ordinal, total - previous))
+                previous = total
+            actual[sku] = tuple(by_eta)
+
+        return expected, actual
+
+
+    def _record(self, kind: str, checked: int, drifts: List[Drift]) -> None:
+        with self._lock:
+            self.report.checked[kind] += checked
+            self.report.drifted[kind] += len(drifts)
+            room = MAX_REPORTED_DRIFTS - len(self.report.drifts)
+            self.report.drifts.extend(drifts[:max(room, 0)])
+
+        self._metrics.increment('read_model_checked_total', checked,
+                                tags={'kind': kind})
+        if drifts:
+            self._metrics.increment('read_model_drift_total', len(drifts),
+                                    tags={'kind': kind})
+            for drift in drifts[:10]:
+                self._logger.warning('Read model drift: %s', drift)
+
+
+    def _repair_drifts(self, kind: str, drifts: List[Drift]) -> None:
+        # entries the write model does not have are deleted, the others are
+        # rebuilt from it along with what depends on them
+        orphans = [drift.key for drift in drifts if drift.expected is None]
+        if orphans and kind in HASHES:
+            self._client.hdel(HASHES[kind], *orphans)
+            if kind == 'batch':
+                self._client.hdel(VERSIONS, *(f'batch:{ref}' for ref in orphans))
+
+        if kind == 'atp':
+            # rebuilding the SKU rewrites its totals, or clears them
+            entities = [f'sku:{drift.key}' for drift in drifts]
+        elif kind == 'batch':
+            entities = [f'batch:{drift.key}' for drift in drifts
+                        if drift.expected is not None]
+            # for the SKU's per SKU keys to drop the orphans
+            entities += [f'sku:{drift.actual[0]}' for drift in drifts
+                         if drift.expected is None]
+        else:
+            entities = [f'order:{split_line_key(drift.key)[0]}'
+                        for drift in drifts]
+
+        ReadModelRebuild(self._client, self._chunk_size).repair(entities)
+
+        with self._lock:
+            self.report.repaired += len(drifts)
+        self._metrics.increment('read_model_repaired_total', len(drifts),
+                                tags={'kind': kind})
@@ -1,6 +1,13 @@
-import inspect
+import atexit
+import json
 import logging
 import os
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
 
 
 def get_redis_config():
@@ -10,19 +17,163 @@ def get_redis_config():
     )
 
 
-def get_logger():
-    caller_frame = inspect.stack()[1]
-    caller_module = caller_frame.frame.f_globals["__name__"]
-    logger = logging.getLogger(caller_module)
+def get_metrics_config():
+    """Returns the metrics sink (`null`, `prometheus` or `statsd`) and the
+    StatsD address."""
+    return (
+        os.getenv('METRICS_SINK', 'null'),
+        os.getenv('STATSD_HOST', 'localhost'),
+        os.getenv('STATSD_PORT', 8125),
+    )
+
+
+def get_profiling_config() -> bool:
+    """Whether SQL queries and Redis commands are profiled per bus message and
+    per HTTP request (`ALLOCATION_PROFILING=1`)."""
+    return os.getenv('ALLOCATION_PROFILING', '').lower() not in ('', '0', 'false')
+
+
+LOGGER_NAMESPACE = 'allocation'
+
+_logging_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+
+
+def get_logging_config():
+    """Returns the log file, the log level and the fraction of DEBUG records
+    that are kept."""
+    return (
+        os.getenv('LOG_FILE', os.path.join(os.getcwd(), 'logs.log')),
+        os.getenv('LOG_LEVEL', 'DEBUG'),
+        float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0)),
+    )
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats each record as a single-line JSON object."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """Keeps only a `rate` fraction of the DEBUG records; other levels pass."""
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self._rate = rate
+
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.DEBUG or self._rate >= 1:
+            return True
+        return random.random() < self._rate
+
+
+class _InProcessQueueHandler(QueueHandler):
+    """Enqueues records untouched: the queue never leaves the process, so the
+    message formatting `QueueHandler.prepare` does can be left to the
+    listener's thread instead of the caller's."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def configure_logging(
+        filename: Optional[str] = None,
+        level: Optional[str] = None,
+        debug_sample_rate: Optional[float] = None,
+) -> None:
+    """Sets up, once per process, the non-blocking logging pipeline: loggers
+    under the `allocation` namespace put records on a queue which a background
+    `QueueListener` writes to the log file as JSON lines."""
+    global _listener, _queue_handler
+
+    with _logging_lock:
+        if _listener is not None:
+            return
+
+        default_filename, default_level, default_rate = get_logging_config()
+        file_handler = logging.FileHandler(filename or default_filename, mode='a')
+        file_handler.setFormatter(JSONFormatter())
+
+        log_queue = queue.SimpleQueue()
+        _queue_handler = _InProcessQueueHandler(log_queue)
+        _queue_handler.addFilter(DebugSampler(
+            default_rate if debug_sample_rate is None else debug_sample_rate
+        ))
+
+        logger = logging.getLogger(LOGGER_NAMESPACE)
+        logger.addHandler(_queue_handler)
+        logger.setLevel(level or default_level)
+
+        _listener = QueueListener(log_queue, file_handler)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flushes pending records and tears the pipeline down."""
+    global _listener, _queue_handler
+
+    with _logging_lock:
+        if _listener is None:
+            return
+
+        logging.getLogger(LOGGER_NAMESPACE).removeHandler(_queue_handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = _queue_handler = None
+
+
+def _restart_logging_in_child() -> None:
+    """The listener's thread does not survive a fork, so a child of a process
+    that logged (e.g. a worker forked by a server that preloads the app)
+    starts a pipeline of its own."""
+    global _listener, _queue_handler, _logging_lock
+
+    # the parent may have forked while holding the lock
+    _logging_lock = threading.Lock()
+    if _listener is None:
+        return
+
+    # same file, level and sampling as the parent's
+    [file_handler] = _listener.handlers
+    [sampler] = _queue_handler.filters
+    logger = logging.getLogger(LOGGER_NAMESPACE)
+
+    logger.removeHandler(_queue_handler)
+    file_handler.close()
+    _listener = _queue_handler = None
+    configure_logging(file_handler.baseFilename,
+                      logging.getLevelName(logger.level),
+                      sampler._rate)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_logging_in_child)
+
+
+def get_logger(name: Optional[str] = None) -> logging.Logger:
+    """Returns a logger under the `allocation` namespace, configuring the
+    logging pipeline on first use. `name` defaults to the caller's module."""
+    if _listener is None:
+        configure_logging()
+
+    if name is None:
+        name = sys._getframe(1).f_globals['__name__']
 
-    if logger.hasHandlers():
-        logger.handlers.clear()
+    if name != LOGGER_NAMESPACE and not name.startswith(LOGGER_NAMESPACE + '.'):
+        name = f'{LOGGER_NAMESPACE}.{name}'
 
-    filename = os.path.join(os.getcwd(), 'logs.log')
-    file_handler = logging.FileHandler(filename, mode='a')
-    formatter = logging.Formatter('%(asctime)s -- %(levelname)s: %(message)s',
-                                "%Y-%m-%d %H:%M:%S")
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-    logger.setLevel(logging.DEBUG)
-    return logger
+    return logging.getLogger(name)
@@ -0,0 +1,66 @@
+"""Index over the free quantity of a product's batches, see
+`Product.allocate_split`."""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from allocation.domain.model import Batch
+
+
+class FreeCapacityIndex:
+    """Fenwick tree over the available quantity of batches, in the order given
+    (ETA order for `Product`).
+
+    Both the total free quantity and the number of leading batches needed to
+    cover a quantity are found in O(log batches), and so is recording the new
+    available quantity of a batch."""
+
+    def __init__(self, batches: List[Batch]) -> None:
+        self._positions: Dict[Batch, int] = {
+            batch: i for i, batch in enumerate(batches)
+        }
+        self._free = [batch.available_qty for batch in batches]
+        self._tree = [0] + self._free
+
+        # O(n) build: each node passes its sum on to its parent
+        for i in range(1, len(self._tree)):
+            parent = i + (i & -i)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[i]
+
+
+    def total(self) -> int:
+        total, i = 0, len(self._free)
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+
+    def update(self, batch: Batch) -> None:
+        position = self._positions[batch]
+        delta = batch.available_qty - self._free[position]
+        self._free[position] += delta
+
+        i = position + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+
+    def covering(self, qty: int) -> Optional[int]:
+        """Returns how many leading batches hold `qty` between them, `None` if
+        all of them together hold less."""
+        if self.total() < qty:
+            return None
+
+        # descend to the longest prefix holding less than `qty`
+        position, step = 0, 1 << len(self._free).bit_length()
+        while step:
+            if position + step < len(self._tree) \
+                    and self._tree[position + step] < qty:
+                position += step
+                qty -= self._tree[position]
+            step >>= 1
+
+        return position + 1
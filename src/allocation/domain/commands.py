@@ -1,8 +1,10 @@
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional
+from typing import Optional, Tuple
 
-from allocation.domain.validators import ValidQtyAndETAMixin, ValidQtyMixin
+from allocation.domain.validators import (
+    ValidLinesMixin, ValidQtyAndETAMixin, ValidQtyMixin, ValidStrategyMixin
+)
 
 
 class Command:
@@ -24,6 +26,13 @@ class Allocate(Command, ValidQtyMixin):
     qty: int
 
 
+@dataclass(frozen=True)
+class AllocateSplit(Command, ValidQtyMixin):
+    order_id: str
+    sku: str
+    qty: int
+
+
 @dataclass(frozen=True)
 class Deallocate(Command, ValidQtyMixin):
     order_id: str
@@ -42,3 +51,18 @@ class Reallocate(Command, ValidQtyMixin):
     order_id: str
     sku: str
     qty: int
+    # the part of a split line, see `OrderLine.part`
+    part: int = 0
+
+
+@dataclass(frozen=True)
+class AllocateWave(Command, ValidLinesMixin):
+    sku: str
+    # (order_id, qty) per line
+    lines: Tuple[Tuple[str, int], ...]
+
+
+@dataclass(frozen=True)
+class ChangeAllocationStrategy(Command, ValidStrategyMixin):
+    sku: str
+    strategy: str
@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional
+from typing import Optional, Tuple
 
 
 class Event:
@@ -10,6 +10,8 @@ class Event:
 @dataclass(frozen=True)
 class OutOfStock(Event):
     sku: str
+    # the line that could not be allocated
+    order_id: Optional[str] = None
 
 
 @dataclass(frozen=True)
@@ -32,6 +34,17 @@ class LineAllocated(Event):
     sku: str
     qty: int
     batch_ref: str
+    # see `OrderLine.part`
+    part: int = 0
+
+
+@dataclass(frozen=True)
+class LineSplitAllocated(Event):
+    order_id: str
+    sku: str
+    qty: int
+    # (batch_ref, qty) per part, in ETA order: the index is the part number
+    allocations: Tuple[Tuple[str, int], ...]
 
 
 @dataclass(frozen=True)
@@ -40,3 +53,11 @@ class LineDeallocated(Event):
     sku: str
     qty: int
     batch_ref: str
+    # see `OrderLine.part`
+    part: int = 0
+
+
+@dataclass(frozen=True)
+class AllocationStrategyChanged(Event):
+    sku: str
+    strategy: str
@@ -37,6 +37,34 @@ class LineIsNotAllocatedError(DomainException):
         else:
             self.msg = msg
         super().__init__(self.msg)
+
+
+
+class LineIsAlreadyAllocatedError(DomainException):
+    """Error raised when trying to allocate an order line that is already
+    allocated to a batch.
+
+    Args:
+        msg (str, optional): The error message to be displayed. If not provided,
+            a default message will be used.
+        line_info (Tuple[str, str], optional): A tuple containing the `order_id`
+          and `sku`.
+            If provided, a detailed error message will be constructed using this
+              information.
+
+    Attributes:
+        msg (str): The error message to be displayed.
+    """
+    def __init__(self, msg=None, line_info=None):
+        if msg is None and line_info is None:
+            self.msg = 'This line is already allocated to a batch.'
+        elif line_info is not None:
+            order_id, sku = line_info
+            self.msg = f"Line with SKU '{sku}' for order '{order_id}'" \
+                 " is already allocated to a batch."
+        else:
+            self.msg = msg
+        super().__init__(self.msg)
         
         
 class OrderHasNoAllocations(DomainException):
@@ -165,3 +193,118 @@ class InvalidETAFormat(ValidationError):
     def __init__(self, msg='ETA must follow the ISO 8601 format'):
         self.msg = msg
         super().__init__(self.msg)
+
+
+class InvalidAllocationStrategy(ValidationError):
+    """Error raised when trying to set an allocation strategy that does not
+    exist.
+
+    Args:
+        msg (str, optional): The error message to be displayed. If not provided,
+            a default message will be used.
+        strategy (str, optional): The name of the strategy. If provided, a
+            detailed error message will be constructed using this information.
+
+    Attributes:
+        msg (str): The error message to be displayed.
+    """
+    def __init__(self, msg=None, strategy=None):
+        if msg is None and strategy is None:
+            self.msg = 'Invalid allocation strategy.'
+        elif strategy is not None:
+            self.msg = f"Allocation strategy '{strategy}' does not exist."
+        else:
+            self.msg = msg
+        super().__init__(self.msg)
+
+
+class InvalidQueryKeys(ValidationError):
+    """Error raised when a multi-get query is not given a list of keys, or is
+    given more than it accepts.
+
+    Args:
+        msg (str, optional): The error message to be displayed. If not provided,
+            a default message will be used.
+        max_keys (int, optional): The most keys a query accepts. If provided, a
+            detailed error message will be constructed using this information.
+
+    Attributes:
+        msg (str): The error message to be displayed.
+    """
+    def __init__(self, msg=None, max_keys=None):
+        if msg is None and max_keys is None:
+            self.msg = 'Query keys must be a list of strings.'
+        elif max_keys is not None:
+            self.msg = f'Query keys must be a list of at most {max_keys} strings.'
+        else:
+            self.msg = msg
+        super().__init__(self.msg)
+
+
+class InvalidPageSize(ValidationError):
+    """Error raised when a paginated query is asked for a page that is not a
+    positive integer of at most the largest page size.
+
+    Args:
+        msg (str, optional): The error message to be displayed. If not provided,
+            a default message will be used.
+        max_size (int, optional): The largest page size. If provided, a
+            detailed error message will be constructed using this information.
+
+    Attributes:
+        msg (str): The error message to be displayed.
+    """
+    def __init__(self, msg=None, max_size=None):
+        if msg is None and max_size is None:
+            self.msg = 'Page size must be a positive integer.'
+        elif max_size is not None:
+            self.msg = f'Page size must be a positive integer of at most {max_size}.'
+        else:
+            self.msg = msg
+        super().__init__(self.msg)
+
+
+class InvalidExportFormat(ValidationError):
+    """Error raised when an export is asked for in a format it is not
+    available in.
+
+    Args:
+        msg (str, optional): The error message to be displayed. If not provided,
+            a default message will be used.
+        formats (Iterable[str], optional): The available formats. If provided,
+            a detailed error message will be constructed using this information.
+
+    Attributes:
+        msg (str): The error message to be displayed.
+    """
+    def __init__(self, msg=None, formats=None):
+        if msg is None and formats is None:
+            self.msg = 'Export format is not available.'
+        elif formats is not None:
+            self.msg = f'Export format must be one of: {", ".join(formats)}.'
+        else:
+            self.msg = msg
+        super().__init__(self.msg)
+
+
+class InvalidRequestField(ValidationError):
+    """Error raised when a request field is missing or invalid, and no more
+    specific error covers it.
+
+    Args:
+        msg (str, optional): The error message to be displayed. If not provided,
+            a default message will be used.
+        field (str, optional): The name of the field. If provided, a detailed
+            error message will be constructed using this information.
+
+    Attributes:
+        msg (str): The error message to be displayed.
+    """
+    def __init__(self, msg=None, field=None):
+        if msg is None and field is None:
+            self.msg = 'Invalid request.'
+        elif field is not None:
+            self.msg = f"Field '{field}' is missing or invalid."
+        else:
+            self.msg = msg
+        super().__init__(self.msg)
@@ -1,29 +1,117 @@
-from dataclasses import dataclass, astuple
+from dataclasses import dataclass
 from datetime import date
-from allocation.domain import commands, events
+from allocation.domain import commands, events, strategies
+from allocation.domain.capacity import FreeCapacityIndex
 from allocation.domain.exceptions import (
     CannotOverallocateError, InvalidSKU, LineIsNotAllocatedError,
     OutOfStock, SKUsDontMatchError
 )
-from typing import List, Optional, Set, Union
+from typing import Callable, Iterable, List, Optional, Sequence, Set, Tuple, Union
 
 
-@dataclass(frozen=True)
+# batches hold one line per allocation, so keep them small: no `__dict__`, and
+# `sku` shares the string of the product the line belongs to
+@dataclass(frozen=True, slots=True)
 class OrderLine:
     order_id: str
     sku: str
     qty: int
+    # a line split across batches is held as parts numbered from 0, see
+    # `Product.allocate_split`. A line that isn't split is its own part 0.
+    part: int = 0
 
 
 class Batch:
 
+    __slots__ = ('ref', 'sku', '_qty', 'eta', '_allocations', '_allocated_qty',
+                 '_load_allocations', '_pending_allocations')
+
     def __init__(self, ref: str, sku: str, qty: int,
                  eta: Optional[date] = None ) -> None:
         self.ref = ref
         self.sku = sku
         self._qty = qty
         self.eta = eta
-        self._allocations: Set[OrderLine] = set()
+        self._allocations: Optional[Set[OrderLine]] = set()
+        self._allocated_qty = 0
+        # lazy mode only, see `with_lazy_allocations`
+        self._load_allocations: Optional[Callable[[], Iterable[OrderLine]]] = None
+        self._pending_allocations: Set[OrderLine] = set()
+
+
+    @classmethod
+    def with_lazy_allocations(
+            cls,
+            ref: str,
+            sku: str,
+            qty: int,
+            eta: Optional[date],
+            allocated_qty: int,
+            load_allocations: Callable[[], Iterable[OrderLine]],
+    ) -> 'Batch':
+        """Returns a batch holding only the total qty of its allocations. The
+        lines themselves are fetched with `load_allocations` the first time they
+        are needed, i.e. by `deallocate`, `deallocate_one` or `allocations`.
+        
+        Like `rehydrate`, it trusts its arguments."""
+        return cls._new(ref, sku, qty, eta, None, allocated_qty, load_allocations)
+
+
+    @classmethod
+    def rehydrate(
+            cls,
+            ref: str,
+            sku: str,
+            qty: int,
+            eta: Optional[date],
+            allocations: Iterable[OrderLine],
+    ) -> 'Batch':
+        """Trusted constructor for persisted state, which was valid when it was
+        stored: none of `allocate`'s checks are run on the lines."""
+        allocations = set(allocations)
+        allocated_qty = sum(line.qty for line in allocations)
+        return cls._new(ref, sku, qty, eta, allocations, allocated_qty, None)
+
+
+    @classmethod
+    def _new(cls, ref, sku, qty, eta, allocations, allocated_qty,
+             load_allocations) -> 'Batch':
+        batch = cls.__new__(cls)
+        batch.ref = ref
+        batch.sku = sku
+        batch._qty = qty
+        batch.eta = eta
+        batch._allocations = allocations
+        batch._allocated_qty = allocated_qty
+        batch._load_allocations = load_allocations
+        batch._pending_allocations = set()
+        return batch
+
+
+    def __getstate__(self) -> dict:
+        # same shape as the `__dict__` batches were pickled with before
+        # `__slots__`. The loader can't be pickled, so lines are loaded first.
+        return {
+            'ref': self.ref,
+            'sku': self.sku,
+            '_qty': self._qty,
+            'eta': self.eta,
+            '_allocations': self._loaded_allocations(),
+        }
+
+
+    def __setstate__(self, state: dict) -> None:
+        # also restores batches pickled before `__slots__`, e.g. those stored
+        # by `RedisQueryRepository`
+        allocations = set(state['_allocations'])
+        self.ref = state['ref']
+        self.sku = state['sku']
+        self._qty = state['_qty']
+        self.eta = state['eta']
+        self._allocations = allocations
+        self._allocated_qty = sum(line.qty for line in allocations)
+        self._load_allocations = None
+        self._pending_allocations = set()
 
     
     def __repr__(self) -> str:
@@ -42,7 +130,7 @@ class Batch:
 
     @property
     def allocated_qty(self):
-        return sum(line.qty for line in self._allocations)
+        return self._allocated_qty
     
 
     @property
@@ -62,7 +150,14 @@ class Batch:
     
     def allocate(self, line: OrderLine) -> None:
         self._can_allocate(line)
-        self._allocations.add(line)
+        # while the lines are not loaded, allocating a line the batch already
+        # holds can't be told apart here and is left for the store to reject
+        allocations = self._pending_allocations if self._allocations is None \
+                      else self._allocations
+        
+        if line not in allocations:
+            allocations.add(line)
+            self._allocated_qty += line.qty
 
 
     def _can_allocate(self, line: OrderLine) -> None:
@@ -83,22 +178,48 @@ class Batch:
 
 
     def deallocate(self, line: OrderLine) -> None:
-        if line not in self._allocations:
+        allocations = self._loaded_allocations()
+        if line not in allocations:
             raise LineIsNotAllocatedError(line_info=(line.order_id, line.sku))
         
-        self._allocations.remove(line)
+        allocations.remove(line)
+        self._allocated_qty -= line.qty
 
 
     def deallocate_one(self) -> OrderLine:
-        if self._allocations:
-            return self._allocations.pop()
+        allocations = self._loaded_allocations()
+        if allocations:
+            line = allocations.pop()
+            self._allocated_qty -= line.qty
+            return line
         
         return None
         
     
     @property
     def allocations(self) -> List[OrderLine]:
-        return list(self._allocations)
+        return list(self._loaded_allocations())
+    
+
+    @property
+    def allocations_loaded(self) -> bool:
+        return self._allocations is not None
+    
+
+    @property
+    def pending_allocations(self) -> List[OrderLine]:
+        """Lines allocated to a lazy batch before its lines were loaded."""
+        return list(self._pending_allocations)
+    
+
+    def _loaded_allocations(self) -> Set[OrderLine]:
+        if self._allocations is None:
+            self._allocations = set(self._load_allocations())
+            self._allocations |= self._pending_allocations
+            self._pending_allocations = set()
+            self._allocated_qty = sum(line.qty for line in self._allocations)
+        
+        return self._allocations
     
 
     @property
@@ -114,17 +235,50 @@ class Batch:
 class Product:
     """Aggregate for batches."""
 
-    def __init__(self, sku: str, batches: Optional[List[Batch]] = None) -> None:
+    __slots__ = ('_sku', '_batches', '_messages', '_strategy', '_batches_by_eta',
+                 '_free_capacity')
+
+    def __init__(
+            self,
+            sku: str,
+            batches: Optional[List[Batch]] = None,
+            allocation_strategy: str = strategies.DEFAULT_STRATEGY,
+    ) -> None:
         self._sku = sku
         self._batches: List[Batch] = []
         self._messages: List[Union[commands.Command, events.Event]] = []
+        self._strategy = strategies.create(allocation_strategy)
+        # ETAs never change, so batches are sorted once rather than per line
+        self._batches_by_eta: Optional[List[Batch]] = None
+        # built on the first split allocation, see `allocate_split`
+        self._free_capacity: Optional[FreeCapacityIndex] = None
 
         if batches:
             for batch in batches:
                 self.validate_sku(batch.sku)
+                batch.sku = self._sku
                 self._batches.append(batch)
 
 
+    @classmethod
+    def rehydrate(
+            cls,
+            sku: str,
+            batches: List[Batch],
+            allocation_strategy: str = strategies.DEFAULT_STRATEGY,
+    ) -> 'Product':
+        """Trusted constructor for persisted state: `batches` are taken as
+        they are, without validating their SKUs."""
+        product = cls.__new__(cls)
+        product._sku = sku
+        product._batches = batches
+        product._messages = []
+        product._strategy = strategies.create(allocation_strategy)
+        product._batches_by_eta = None
+        product._free_capacity = None
+        return product
+
+
     @property
     def sku(self) -> str:
         return self._sku
@@ -140,56 +294,209 @@ class Product:
         return self._messages
     
 
+    @property
+    def allocation_strategy(self) -> str:
+        return self._strategy.name
+    
+
+    def change_allocation_strategy(self, name: str) -> None:
+        self._strategy = strategies.create(name)
+        self._messages.append(events.AllocationStrategyChanged(self._sku, name))
+    
+
     def add_batch(self, ref: str, sku: str, qty: int,
                   eta: Optional[date] = None
     ):
         self.validate_sku(sku)
-        self._batches.append(Batch(ref, sku, qty, eta))
+        self._batches.append(Batch(ref, self._sku, qty, eta))
+        self._batches_by_eta = None
+        self._free_capacity = None
+        self._strategy.reset()
         self._messages.append(events.BatchCreated(ref, sku, qty, eta))
 
 
-    def allocate(self, order_id: str, sku: str, qty: int) -> str:
-
+    def allocate(self, order_id: str, sku: str, qty: int, part: int = 0) -> str:
+        """Allocates the line, or the `part` of a split line being
+        reallocated, to a single batch."""
         self.validate_sku(sku)
-        line = OrderLine(order_id, sku, qty)
+        line = OrderLine(order_id, self._sku, qty, part)
         
         try:
             batch = self._get_suitable_batch_or_raise_error(line)
         except OutOfStock:
-            self._messages.append(events.OutOfStock(sku))
+            self._messages.append(events.OutOfStock(sku, order_id))
             raise
         
-        batch.allocate(line)
-        self._messages.append(events.LineAllocated(*astuple(line), batch.ref))
+        self._allocate_to(batch, line)
         return batch.ref
 
 
-    def _get_suitable_batch_or_raise_error(self, line: OrderLine) -> Batch:
+    def allocate_split(self, order_id: str, sku: str, qty: int
+    ) -> List[Tuple[str, int]]:
+        """Allocates the line to a single batch, exactly as `allocate` does,
+        when one fits it. Otherwise the line is split across batches in ETA
+        order, as long as they hold enough between them, and a single
+        `LineSplitAllocated` is emitted. Returns `(batch_ref, qty)` per part."""
+        self.validate_sku(sku)
+        line = OrderLine(order_id, self._sku, qty)
+        batches = self._eta_ordered_batches()
+        batch = self._strategy.select(batches, line)
+        
+        if batch is not None:
+            self._allocate_to(batch, line)
+            return [(batch.ref, qty)]
+        
+        n_batches = self._free_capacity_index().covering(qty)
+        if n_batches is None:
+            self._messages.append(events.OutOfStock(sku, order_id))
+            raise OutOfStock(sku=sku)
+        
+        parts = []
+        for batch in batches[:n_batches]:
+            part_qty = min(batch.available_qty, qty - sum(q for _, q in parts))
+            if part_qty > 0:
+                batch.allocate(OrderLine(order_id, self._sku, part_qty, len(parts)))
+                self._batch_changed(batch)
+                parts.append((batch.ref, part_qty))
+        
+        self._messages.append(
+            events.LineSplitAllocated(order_id, self._sku, qty, tuple(parts))
+        )
+        return parts
+
+
+    def _allocate_to(self, batch: Batch, line: OrderLine) -> None:
+        batch.allocate(line)
+        self._batch_changed(batch)
+        self._messages.append(
+            events.LineAllocated(line.order_id, line.sku, line.qty, batch.ref,
+                                 line.part)
+        )
+
+
+    def _batch_changed(self, batch: Batch) -> None:
+        # keeps the indexes over the batches' available qty up to date
+        self._strategy.batch_changed(batch)
+        if self._free_capacity is not None:
+            self._free_capacity.update(batch)
+
+
+    def _free_capacity_index(self) -> FreeCapacityIndex:
+        if self._free_capacity is None:
+            self._free_capacity = FreeCapacityIndex(self._eta_ordered_batches())
+        
+        return self._free_capacity
+
+
+    def allocate_wave(
+            self,
+            sku: str,
+            lines: Sequence[Tuple[str, int]],
+    ) -> List[Optional[str]]:
+        """Allocates `(order_id, qty)` lines in one go, exactly as calling
+        `allocate` for each of them in turn and carrying on past `OutOfStock`
+        would: the same batches are picked and the same events emitted, in the
+        same order. Returns the batch ref per line, `None` if out of stock.
+        
+        Lines are expected not to be allocated yet."""
+        self.validate_sku(sku)
+        
+        if not isinstance(self._strategy, strategies.EarliestETA):
+            # the planner is exact for earliest-ETA first-fit only
+            return [self._allocate_or_none(order_id, qty) for order_id, qty in lines]
+        
+        # NumPy is only imported by the processes that plan waves
+        from allocation.domain.planner import first_fit
+        
+        batches = self._eta_ordered_batches()
+        targets = first_fit([batch.available_qty for batch in batches],
+                            [qty for _, qty in lines])
+        batch_refs = []
+        
+        for (order_id, qty), target in zip(lines, targets.tolist()):
+            if target < 0:
+                self._messages.append(events.OutOfStock(self._sku, order_id))
+                batch_refs.append(None)
+                continue
+            
+            batch = batches[target]
+            self._allocate_to(batch, OrderLine(order_id, self._sku, qty))
+            batch_refs.append(batch.ref)
+        
+        return batch_refs
+
+
+    def _allocate_or_none(self, order_id: str, qty: int) -> Optional[str]:
         try:
-            return next(batch 
-                         for batch in sorted(self._batches)
-                         if batch.can_allocate(line))
-        except StopIteration:
+            return self.allocate(order_id, self._sku, qty)
+        except OutOfStock:
+            return None
+
+
+    def _get_suitable_batch_or_raise_error(self, line: OrderLine) -> Batch:
+        batch = self._strategy.select(self._eta_ordered_batches(), line)
+        
+        if batch is None:
             raise OutOfStock(sku=line.sku)
+        
+        return batch
+
+
+    def _eta_ordered_batches(self) -> List[Batch]:
+        if self._batches_by_eta is None:
+            self._batches_by_eta = sorted(self._batches)
+        
+        return self._batches_by_eta
 
 
     def deallocate(self, order_id: str, sku: str, qty: int) -> str:
         
         self.validate_sku(sku)
-        line = OrderLine(order_id, sku, qty)
-        batch = self._get_batch_with_allocated_line_or_raise_error(line)
-        batch.deallocate(line)
-        self._messages.append(events.LineDeallocated(*astuple(line), batch.ref))
-        return batch.ref
+        line = OrderLine(order_id, self._sku, qty)
+        
+        try:
+            parts = [(self._get_batch_with_allocated_line_or_raise_error(line), line)]
+        except LineIsNotAllocatedError:
+            # lines allocated with `allocate_split` may be held in parts
+            parts = self._get_line_parts_or_raise_error(line)
+        
+        for batch, part in parts:
+            batch.deallocate(part)
+            self._batch_changed(batch)
+            self._messages.append(
+                events.LineDeallocated(part.order_id, part.sku, part.qty,
+                                       batch.ref, part.part)
+            )
+        
+        return parts[0][0].ref
 
 
     def _get_batch_with_allocated_line_or_raise_error(self, line: OrderLine) -> Batch:
         try:
             return next(batch
                         for batch in self._batches
-                        if line in batch.allocations)
+                        # cheap check first, so lazy batches that can't hold
+                        # the line never load theirs
+                        if batch.allocated_qty >= line.qty
+                        and line in batch.allocations)
         except StopIteration:
             raise LineIsNotAllocatedError(line_info=(line.order_id, line.sku))
+
+
+    def _get_line_parts_or_raise_error(self, line: OrderLine
+    ) -> List[Tuple[Batch, OrderLine]]:
+        parts = [
+            (batch, part)
+            for batch in self._eta_ordered_batches()
+            if batch.allocated_qty
+            for part in batch.allocations
+            if part.order_id == line.order_id and part.sku == line.sku
+        ]
+        
+        if len(parts) < 2 or sum(part.qty for _, part in parts) != line.qty:
+            raise LineIsNotAllocatedError(line_info=(line.order_id, line.sku))
+        
+        return parts
         
 
     def validate_sku(self, sku):
@@ -203,7 +510,14 @@ class Product:
 
         while batch.allocated_qty > batch._qty:
             line = batch.deallocate_one()
-            self._messages.append(events.LineDeallocated(*astuple(line), batch.ref))
-            self._messages.append(commands.Reallocate(*astuple(line)))
+            self._messages.append(
+                events.LineDeallocated(line.order_id, line.sku, line.qty,
+                                       batch.ref, line.part)
+            )
+            # a part of a split line is reallocated on its own, as that part
+            self._messages.append(
+                commands.Reallocate(line.order_id, line.sku, line.qty, line.part)
+            )
         
+        self._batch_changed(batch)
         self._messages.append(events.BatchQuantityChanged(ref, qty))
@@ -0,0 +1,38 @@
+"""Planning of bulk allocations (e.g. wave picking) with NumPy, see
+`Product.allocate_wave`."""
+from typing import Sequence
+import numpy as np
+
+
+def first_fit(available: Sequence[int], qtys: Sequence[int]) -> np.ndarray:
+    """Returns, for each line in `qtys`, the index into `available` of the batch
+    it goes to when the lines are allocated one after the other, each to the
+    first batch with enough quantity left, or -1 when no batch has.
+
+    Consecutive lines of equal qty are planned together: batch `i` takes
+    `available[i] // qty` of them before the next batch gets any, so the
+    cumulative sum of those capacities and `searchsorted` place the whole run
+    at once. Waves, where most lines share a handful of quantities, are then
+    planned in a few vectorized steps rather than one Python step per line.
+    """
+    remaining = np.array(available, dtype=np.int64)
+    qtys = np.asarray(qtys, dtype=np.int64)
+    targets = np.full(len(qtys), -1, dtype=np.intp)
+
+    if not len(qtys) or not len(remaining):
+        return targets
+
+    run_starts = np.flatnonzero(np.r_[True, qtys[1:] != qtys[:-1]])
+    run_ends = np.r_[run_starts[1:], len(qtys)]
+
+    for start, end in zip(run_starts, run_ends):
+        qty = qtys[start]
+        capacity = np.cumsum(remaining // qty)
+        # the k-th line of the run lands in the first batch whose cumulative
+        # capacity exceeds k
+        run = np.searchsorted(capacity, np.arange(end - start), side='right')
+        placed = run < len(remaining)
+        targets[start:end] = np.where(placed, run, -1)
+        remaining -= np.bincount(run[placed], minlength=len(remaining)) * qty
+
+    return targets
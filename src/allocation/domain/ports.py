@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from datetime import date
-from typing import List, Optional, Set
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 from allocation.domain.model import Batch, Product
 
@@ -70,6 +70,13 @@ class AbstractWriteRepository(ABC):
         raise NotImplementedError()
 
 
+    @abstractmethod
+    def get_allocations_for_order(self, order_id: str) -> List[Dict[str, str]]:
+        """Returns a list of mappings `sku: batch_ref` for a given `order_id`,
+        as committed, without loading any product."""
+        raise NotImplementedError()
+
+
 class AbstractQueryRepository(ABC):
 
     @abstractmethod
@@ -116,7 +123,76 @@ class AbstractQueryRepository(ABC):
 
 
     @abstractmethod
-    def remove_allocation_for_order(self, order_id, sku):
+    def remove_allocation_for_order(self, order_id, sku, batch_ref):
+        """Removes one `sku: batch_ref` mapping of `order_id`: a line split
+        across batches has one per part, possibly several in the same batch."""
+        raise NotImplementedError
+
+
+    @abstractmethod
+    def get_batches(self, refs: Iterable[str]) -> Dict[str, Batch]:
+        """Returns the existing batches among `refs`, by ref."""
+        raise NotImplementedError
+
+
+    @abstractmethod
+    def get_allocations_for_orders(
+            self, order_ids: Iterable[str]
+    ) -> Dict[str, List[Dict[str, str]]]:
+        """Returns the allocations of the orders among `order_ids`, by order
+        id, leaving out those `get_allocations_for_order` raises for."""
+        raise NotImplementedError
+
+
+    @abstractmethod
+    def get_batches_for_sku(
+            self, sku: str, after: Optional[str], limit: int
+    ) -> Tuple[List[Batch], Optional[str]]:
+        """Returns up to `limit` batches of `sku` in ETA order, following the
+        batch the cursor `after` points at (from the start if `None`), and the
+        cursor to pass for the next page, `None` on the last one.
+
+        Cursors are opaque and stay valid as batches are added."""
+        raise NotImplementedError
+
+
+    @abstractmethod
+    def get_batch_version(self, ref: str) -> Optional[int]:
+        """Returns the version of the batch, bumped on each change to it, or
+        `None` if there is no such batch."""
+        raise NotImplementedError
+
+
+    @abstractmethod
+    def get_allocations_for_order_version(self, order_id: str) -> Optional[int]:
+        """Returns the version of the order's allocations, bumped on each
+        change to them, or `None` if the order has none."""
+        raise NotImplementedError
+
+
+    @abstractmethod
+    def change_available_to_promise(self, batch_ref: str, delta: int):
+        """Adds `delta` to the free quantity of the batch's SKU arriving at
+        the batch's ETA, when lines are allocated to or deallocated from it.
+
+        `add_batch` and `update_batch_quantity` keep the free quantity in step
+        with the batch's own quantity."""
+        raise NotImplementedError
+
+
+    @abstractmethod
+    def get_free_capacity(self, sku: str) -> Optional[int]:
+        """Returns the free quantity of `sku` across all of its batches, or
+        `None` if the read model does not track `sku`. The total can be
+        negative for a moment, while a batch's quantity drops below what it
+        has allocated and before its lines are deallocated."""
+        raise NotImplementedError
+
+
+    @abstractmethod
+    def get_available_to_promise(self, sku: str, by: Optional[date] = None) -> int:
+        """Returns the free quantity of `sku` in stock or arriving by `by`,
+        or arriving at all if `by` is `None`."""
         raise NotImplementedError
 
 
@@ -125,3 +201,19 @@ class AbstractPublisher(ABC):
     @abstractmethod
     def publish_event():
         raise NotImplementedError
+
+
+class AbstractMetrics(ABC):
+
+    @abstractmethod
+    def increment(self, name: str, value: int = 1,
+                  tags: Optional[Dict[str, str]] = None) -> None:
+        """Increments the counter `name` by `value`."""
+        raise NotImplementedError
+
+
+    @abstractmethod
+    def observe(self, name: str, value: float,
+                tags: Optional[Dict[str, str]] = None) -> None:
+        """Records `value` in the histogram `name` (latencies in seconds)."""
+        raise NotImplementedError
@@ -1,4 +1,9 @@
 from dataclasses import dataclass
+from datetime import date
+from typing import Optional, Tuple
+from allocation.domain.validators import (
+    DEFAULT_PAGE_SIZE, ValidPageSizeMixin, ValidQueryKeysMixin
+)
 
 
 class Query:
@@ -10,6 +15,25 @@ class BatchByRef(Query):
     batch_ref: str
 
 
+@dataclass(frozen=True)
+class BatchesByRefs(Query, ValidQueryKeysMixin):
+    batch_refs: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class BatchesForSku(Query, ValidPageSizeMixin):
+    """A page of the SKU's batches in ETA order, starting after the `after`
+    cursor returned with the previous page."""
+    sku: str
+    after: Optional[str] = None
+    limit: int = DEFAULT_PAGE_SIZE
+
+
+@dataclass(frozen=True)
+class BatchVersion(Query):
+    batch_ref: str
+
+
 @dataclass(frozen=True)
 class AllocationForLine(Query):
     order_id: str
@@ -19,3 +43,26 @@ class AllocationForLine(Query):
 @dataclass(frozen=True)
 class AllocationsForOrder(Query):
     order_id: str
+
+
+@dataclass(frozen=True)
+class CommittedAllocationsForOrder(Query):
+    """The order's allocations as committed to the write model, which the
+    read model answering `AllocationsForOrder` may lag behind."""
+    order_id: str
+
+
+@dataclass(frozen=True)
+class AllocationsForOrders(Query, ValidQueryKeysMixin):
+    order_ids: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class AllocationsForOrderVersion(Query):
+    order_id: str
+
+
+@dataclass(frozen=True)
+class AvailableToPromise(Query):
+    sku: str
+    by: Optional[date] = None
@@ -0,0 +1,110 @@
+"""Strategies picking the batch an order line is allocated to, set per product
+(see `Product.change_allocation_strategy`)."""
+from __future__ import annotations
+import bisect
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Type
+from allocation.domain.exceptions import InvalidAllocationStrategy
+
+if TYPE_CHECKING:
+    from allocation.domain.model import Batch, OrderLine
+
+
+class AllocationStrategy(ABC):
+    """Picks, out of a product's batches, the one to allocate a line to.
+
+    Batches are passed in ETA order, which `Product` keeps between calls. A
+    strategy may keep its own index over them as well: `Product` reports every
+    batch whose available quantity changed through `batch_changed`, and calls
+    `reset` when batches are added."""
+
+    name: str
+
+    @abstractmethod
+    def select(self, batches: List[Batch], line: OrderLine) -> Optional[Batch]:
+        raise NotImplementedError()
+
+
+    def batch_changed(self, batch: Batch) -> None:
+        pass
+
+
+    def reset(self) -> None:
+        pass
+
+
+class EarliestETA(AllocationStrategy):
+    """First batch, in ETA order, with enough quantity left: stock before
+    shipments, earlier shipments before later ones."""
+
+    name = 'earliest_eta'
+
+    def select(self, batches, line):
+        return next((batch for batch in batches if batch.can_allocate(line)),
+                    None)
+
+
+class BestFit(AllocationStrategy):
+    """Batch with the least quantity left that still fits the line, the
+    earliest one among equals. Large batches are kept whole for large lines
+    instead of being chipped away by small ones.
+
+    Batches are indexed by `(available_qty, position in ETA order)` in a
+    sorted list: picking is a bisection, and a change moves one entry."""
+
+    name = 'best_fit'
+
+    def __init__(self) -> None:
+        self._keys: Optional[List[Tuple[int, int]]] = None
+        self._batches: List[Batch] = []
+        self._positions: Dict[Batch, int] = {}
+        # available qty per batch as currently keyed
+        self._qtys: List[int] = []
+
+
+    def select(self, batches, line):
+        if self._keys is None:
+            self._index(batches)
+
+        i = bisect.bisect_left(self._keys, (line.qty, -1))
+        if i == len(self._keys):
+            return None
+
+        return self._batches[self._keys[i][1]]
+
+
+    def batch_changed(self, batch):
+        if self._keys is None:
+            return
+
+        position = self._positions[batch]
+        key = (self._qtys[position], position)
+        del self._keys[bisect.bisect_left(self._keys, key)]
+        self._qtys[position] = batch.available_qty
+        bisect.insort(self._keys, (self._qtys[position], position))
+
+
+    def reset(self):
+        self._keys = None
+
+
+    def _index(self, batches: List[Batch]) -> None:
+        self._batches = list(batches)
+        self._positions = {batch: i for i, batch in enumerate(self._batches)}
+        self._qtys = [batch.available_qty for batch in self._batches]
+        self._keys = sorted((qty, i) for i, qty in enumerate(self._qtys))
+
+
+STRATEGIES: Dict[str, Type[AllocationStrategy]] = {
+    EarliestETA.name: EarliestETA,
+    BestFit.name: BestFit,
+}
+
+DEFAULT_STRATEGY = EarliestETA.name
+
+
+def create(name: str) -> AllocationStrategy:
+    try:
+        return STRATEGIES[name]()
+    except KeyError:
+        raise InvalidAllocationStrategy(strategy=name)
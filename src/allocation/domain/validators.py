@@ -1,10 +1,20 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from datetime import date
+from allocation.domain import strategies
 from allocation.domain.exceptions import (
-    InvalidETAFormat, InvalidQuantity, PastETANotAllowed, InvalidTypeForQuantity
+    InvalidAllocationStrategy, InvalidETAFormat, InvalidQuantity,
+    InvalidPageSize, InvalidQueryKeys, PastETANotAllowed, InvalidTypeForQuantity
 )
 
 
+# keys a multi-get query may ask for at once
+MAX_QUERY_KEYS = 1000
+
+# entities a paginated query returns per page, by default and at most
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
 @dataclass(frozen=True)
 class ValidQtyMixin:
     def __post_init__(self):
@@ -15,6 +25,17 @@ class ValidQtyMixin:
             raise InvalidQuantity()
 
 
+@dataclass(frozen=True)
+class ValidLinesMixin:
+    def __post_init__(self):
+        for _, qty in self.lines:
+            if not isinstance(qty, int):
+                raise InvalidTypeForQuantity()
+            
+            if qty < 1:
+                raise InvalidQuantity()
+
+
 @dataclass(frozen=True)
 class ValidQtyAndETAMixin(ValidQtyMixin):
     def __post_init__(self):
@@ -28,8 +49,36 @@ class ValidQtyAndETAMixin(ValidQtyMixin):
                 eta = date.fromisoformat(self.eta)
             except (ValueError, TypeError):
                 raise InvalidETAFormat()
+            # commands from the Redis consumer carry ISO strings: handlers,
+            # events and the read model only ever see dates
+            object.__setattr__(self, 'eta', eta)
         else:
             eta = self.eta
         
         if eta < date.today():
             raise PastETANotAllowed()
+
+
+@dataclass(frozen=True)
+class ValidStrategyMixin:
+    def __post_init__(self):
+        if self.strategy not in strategies.STRATEGIES:
+            raise InvalidAllocationStrategy(strategy=self.strategy)
+
+
+@dataclass(frozen=True)
+class ValidQueryKeysMixin:
+    """For multi-get queries, whose only field holds the keys."""
+    def __post_init__(self):
+        [keys_field] = fields(self)
+        keys = getattr(self, keys_field.name)
+        
+        if len(keys) > MAX_QUERY_KEYS:
+            raise InvalidQueryKeys(max_keys=MAX_QUERY_KEYS)
+
+
+@dataclass(frozen=True)
+class ValidPageSizeMixin:
+    def __post_init__(self):
+        if not isinstance(self.limit, int) or not 0 < self.limit <= MAX_PAGE_SIZE:
+            raise InvalidPageSize(max_size=MAX_PAGE_SIZE)
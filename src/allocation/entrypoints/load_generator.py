@@ -0,0 +1,493 @@
+"""Synthetic load generator for the allocation service.
+
+Replays batch creation followed by bursts of `Allocate`, `Deallocate` and
+`ChangeBatchQuantity` on Zipf-distributed SKUs against either the Ninja HTTP
+API or the Redis command channels, and reports throughput, latency percentiles
+and the OutOfStock rate.
+
+Usage:
+    python -m allocation.entrypoints.load_generator --target http \\
+        --url http://localhost:8000/api --requests 10000 --concurrency 8
+
+    python -m allocation.entrypoints.load_generator --target redis \\
+        --requests 10000
+"""
+import argparse
+import bisect
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from allocation.adapters.redis_channels import RedisChannels
+from allocation.config import get_redis_config
+
+
+CREATE_BATCH = 'create_batch'
+ALLOCATE = 'allocate'
+DEALLOCATE = 'deallocate'
+CHANGE_BATCH_QUANTITY = 'change_batch_quantity'
+
+OK = 'ok'
+OUT_OF_STOCK = 'out_of_stock'
+ERROR = 'error'
+TIMEOUT = 'timeout'
+# a deallocation of a line a reallocation left unallocated, which is not sent
+LOST = 'lost'
+
+
+@dataclass(frozen=True)
+class Operation:
+    kind: str
+    payload: Dict
+
+
+@dataclass
+class LoadProfile:
+    skus: int = 100
+    batches_per_sku: int = 3
+    batch_qty: int = 100
+    requests: int = 1_000
+    zipf_s: float = 1.1
+    burst_size: int = 20
+    line_qty: Tuple[int, int] = (1, 10)
+    mix: Dict[str, float] = field(default_factory=lambda: {
+        ALLOCATE: 0.7,
+        DEALLOCATE: 0.2,
+        CHANGE_BATCH_QUANTITY: 0.1,
+    })
+    seed: Optional[int] = None
+    # prefixes the SKUs, batch refs and order ids, so that runs against the
+    # same stack don't collide
+    run_id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+
+
+class ZipfSampler:
+    """Samples ranks `0..n-1` with probability proportional to `1 / (rank+1)**s`."""
+
+    def __init__(self, n: int, s: float, rng: random.Random) -> None:
+        self._rng = rng
+        self._cum_weights = list(
+            itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1))
+        )
+
+
+    def sample(self) -> int:
+        x = self._rng.random() * self._cum_weights[-1]
+        return bisect.bisect_right(self._cum_weights, x)
+
+
+class TrafficGenerator:
+    """Produces the operations to be replayed.
+
+    Deallocations are drawn from the lines that were actually allocated, as
+    reported back by the runner through `record_allocation`."""
+
+    def __init__(self, profile: LoadProfile) -> None:
+        self._profile = profile
+        self._rng = random.Random(profile.seed)
+        self._skus = [f'load-{profile.run_id}-sku-{i}'
+                      for i in range(profile.skus)]
+        self._sampler = ZipfSampler(profile.skus, profile.zipf_s, self._rng)
+        self._order_ids = (f'load-{profile.run_id}-order-{i}'
+                           for i in itertools.count())
+        self._allocated: Dict[str, Deque[Dict]] = defaultdict(deque)
+        self._lock = threading.Lock()
+
+
+    def setup_operations(self) -> List[Operation]:
+        return [
+            Operation(CREATE_BATCH, {
+                'ref': self._batch_ref(sku, i),
+                'sku': sku,
+                'qty': self._profile.batch_qty,
+                'eta': None,
+            })
+            for sku in self._skus
+            for i in range(self._profile.batches_per_sku)
+        ]
+
+
+    def traffic(self) -> Iterator[Operation]:
+        kinds = list(self._profile.mix)
+        weights = list(self._profile.mix.values())
+        emitted = 0
+
+        while emitted < self._profile.requests:
+            kind = self._rng.choices(kinds, weights)[0]
+            sku = self._skus[self._sampler.sample()]
+            size = 1 if kind == CHANGE_BATCH_QUANTITY else self._profile.burst_size
+            size = min(size, self._profile.requests - emitted)
+
+            for _ in range(size):
+                yield self._operation(kind, sku)
+            emitted += size
+
+
+    def record_allocation(self, line: Dict) -> None:
+        with self._lock:
+            self._allocated[line['sku']].append(line)
+
+
+    def _operation(self, kind: str, sku: str) -> Operation:
+        if kind == DEALLOCATE:
+            with self._lock:
+                if self._allocated[sku]:
+                    return Operation(DEALLOCATE, self._allocated[sku].popleft())
+            kind = ALLOCATE
+
+        if kind == ALLOCATE:
+            return Operation(ALLOCATE, {
+                'order_id': next(self._order_ids),
+                'sku': sku,
+                'qty': self._rng.randint(*self._profile.line_qty),
+            })
+
+        batch = self._rng.randrange(self._profile.batches_per_sku)
+        qty = self._rng.randint(1, self._profile.batch_qty)
+        return Operation(CHANGE_BATCH_QUANTITY,
+                         {'ref': self._batch_ref(sku, batch), 'qty': qty})
+
+
+    @staticmethod
+    def _batch_ref(sku: str, i: int) -> str:
+        return f'{sku}-batch-{i}'
+
+
+class LoadReport:
+    """Outcomes of the traffic phase. Batch creation is timed and counted
+    apart, in `setup`, so that it doesn't skew the throughput."""
+
+    def __init__(self) -> None:
+        self._latencies: Dict[str, List[float]] = defaultdict(list)
+        self._outcomes: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: defaultdict(int)
+        )
+        self._lock = threading.Lock()
+        self.elapsed = 0.0
+        self.setup: Optional[LoadReport] = None
+
+
+    def record(self, kind: str, outcome: str, latency: float) -> None:
+        with self._lock:
+            self._outcomes[kind][outcome] += 1
+            # only operations answered for have a latency
+            if outcome not in (TIMEOUT, LOST):
+                self._latencies[kind].append(latency)
+
+
+    @property
+    def total(self) -> int:
+        return sum(sum(o.values()) for o in self._outcomes.values())
+
+
+    @property
+    def throughput(self) -> float:
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+
+    def count(self, kind: str, outcome: str) -> int:
+        return self._outcomes[kind][outcome]
+
+
+    def out_of_stock_rate(self) -> float:
+        allocations = sum(self._outcomes[ALLOCATE].values())
+        if not allocations:
+            return 0.0
+        return self._outcomes[ALLOCATE][OUT_OF_STOCK] / allocations
+
+
+    def percentile(self, kind: str, p: float) -> float:
+        return percentile(self._latencies[kind], p)
+
+
+    def render(self) -> str:
+        lines = [
+            f'requests: {self.total} in {self.elapsed:.2f}s '
+            f'({self.throughput:.1f} req/s)',
+            f'out of stock rate: {self.out_of_stock_rate():.2%}',
+            f'{"operation":<24}{"count":>8}{"errors":>8}{"timeouts":>10}'
+            f'{"lost":>8}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}',
+        ]
+        lines.extend(self._render_rows())
+        if self.setup is not None:
+            lines.append(f'setup: {self.setup.total} in '
+                         f'{self.setup.elapsed:.2f}s')
+            lines.extend(self.setup._render_rows())
+        return '\n'.join(lines)
+
+
+    def _render_rows(self) -> List[str]:
+        rows = []
+        for kind in sorted(self._outcomes):
+            outcomes = self._outcomes[kind]
+            rows.append(
+                f'{kind:<24}{sum(outcomes.values()):>8}'
+                f'{outcomes[ERROR]:>8}{outcomes[TIMEOUT]:>10}{outcomes[LOST]:>8}'
+                + ''.join(f'{self.percentile(kind, p) * 1000:>10.2f}'
+                          for p in (50, 90, 99))
+            )
+        return rows
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile, `0.0` for an empty sample."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, round(p / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class AbstractTarget(ABC):
+
+    @abstractmethod
+    def send(self, operation: Operation) -> str:
+        """Sends the operation and returns its outcome."""
+        raise NotImplementedError
+
+
+    def close(self) -> None:
+        pass
+
+
+class HttpTarget(AbstractTarget):
+    """Sends operations to the Ninja API. `ChangeBatchQuantity` is not exposed
+    over HTTP, so it must be left out of the profile's mix."""
+
+    PATHS = {
+        CREATE_BATCH: 'batches',
+        ALLOCATE: 'allocate',
+        DEALLOCATE: 'deallocate',
+    }
+
+    def __init__(self, base_url: str, timeout: float = 10) -> None:
+        self._base_url = base_url.rstrip('/')
+        self._timeout = timeout
+
+
+    def send(self, operation: Operation) -> str:
+        request = urllib.request.Request(
+            f'{self._base_url}/{self.PATHS[operation.kind]}',
+            data=json.dumps(operation.payload).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST',
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self._timeout):
+                return OK
+        except urllib.error.HTTPError as e:
+            message = json.loads(e.read() or b'{}').get('message', '')
+            return OUT_OF_STOCK if message.startswith('Out of stock') else ERROR
+        except (urllib.error.URLError, TimeoutError):
+            return TIMEOUT
+
+
+class RedisTarget(AbstractTarget):
+    """Publishes commands to the consumer's channels and waits for the events
+    they trigger. Pub/sub messages carry no correlation id, so replies are
+    matched by `(order_id, sku)`, OutOfStock included, or by batch ref.
+
+    An OutOfStock for a line no allocation is pending for comes from a
+    reallocation, after a `ChangeBatchQuantity`: the line is no longer
+    allocated, and deallocating it, which emits nothing to wait for, is
+    answered `LOST` without sending it."""
+
+    CHANNELS = {
+        CREATE_BATCH: RedisChannels.CREATE_BATCH,
+        ALLOCATE: RedisChannels.ALLOCATE_LINE,
+        DEALLOCATE: RedisChannels.DEALLOCATE_LINE,
+        CHANGE_BATCH_QUANTITY: RedisChannels.CHANGE_BATCH_QUANTITY,
+    }
+
+    def __init__(self, redis_host, redis_port, timeout: float = 10) -> None:
+        import redis
+        self._client = redis.Redis(redis_host, redis_port, decode_responses=True)
+        self._timeout = timeout
+        self._pending: Dict[Tuple, Tuple[threading.Event, List[str]]] = {}
+        # `(order_id, sku)` of the lines reallocations left unallocated
+        self._lost: Set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+        self._subscriber = self._client.pubsub(ignore_subscribe_messages=True)
+        self._subscriber.subscribe(**{
+            RedisChannels.BATCH_CREATED: self._on_batch_event,
+            RedisChannels.BATCH_QUANTITY_CHANGED: self._on_batch_event,
+            RedisChannels.LINE_ALLOCATED: self._on_line_event,
+            RedisChannels.LINE_DEALLOCATED: self._on_line_event,
+            RedisChannels.OUT_OF_STOCK: self._on_out_of_stock,
+        })
+        self._listener = self._subscriber.run_in_thread(sleep_time=0.01,
+                                                        daemon=True)
+
+
+    def send(self, operation: Operation) -> str:
+        key = self._key(operation)
+        done, outcome = threading.Event(), []
+
+        with self._lock:
+            if operation.kind == DEALLOCATE and key[1:] in self._lost:
+                self._lost.remove(key[1:])
+                return LOST
+            self._pending[key] = (done, outcome)
+
+        self._client.publish(self.CHANNELS[operation.kind],
+                             json.dumps(operation.payload))
+
+        if not done.wait(self._timeout):
+            with self._lock:
+                self._pending.pop(key, None)
+            return TIMEOUT
+        return outcome[0]
+
+
+    def close(self) -> None:
+        self._listener.stop()
+        self._subscriber.close()
+
+
+    @staticmethod
+    def _key(operation: Operation) -> Tuple:
+        if operation.kind in (CREATE_BATCH, CHANGE_BATCH_QUANTITY):
+            return (operation.kind, operation.payload['ref'])
+        return (operation.kind, operation.payload['order_id'],
+                operation.payload['sku'])
+
+
+    def _resolve(self, key: Tuple, outcome: str) -> None:
+        with self._lock:
+            pending = self._pending.pop(key, None)
+        if pending is not None:
+            done, result = pending
+            result.append(outcome)
+            done.set()
+
+
+    def _on_batch_event(self, message) -> None:
+        ref = json.loads(message['data'])['ref']
+        kind = CREATE_BATCH if message['channel'] == RedisChannels.BATCH_CREATED \
+               else CHANGE_BATCH_QUANTITY
+        self._resolve((kind, ref), OK)
+
+
+    def _on_line_event(self, message) -> None:
+        data = json.loads(message['data'])
+        kind = ALLOCATE if message['channel'] == RedisChannels.LINE_ALLOCATED \
+               else DEALLOCATE
+        self._resolve((kind, data['order_id'], data['sku']), OK)
+
+
+    def _on_out_of_stock(self, message) -> None:
+        data = json.loads(message['data'])
+        key = (ALLOCATE, data.get('order_id'), data['sku'])
+        with self._lock:
+            if key not in self._pending and key[1] is not None:
+                self._lost.add(key[1:])
+        self._resolve(key, OUT_OF_STOCK)
+
+
+class LoadRunner:
+
+    def __init__(self, target: AbstractTarget, generator: TrafficGenerator,
+                 concurrency: int = 1) -> None:
+        self._target = target
+        self._generator = generator
+        self._concurrency = concurrency
+
+
+    def run(self) -> LoadReport:
+        report = LoadReport()
+        report.setup = LoadReport()
+
+        start = time.perf_counter()
+        for operation in self._generator.setup_operations():
+            self._send(operation, report.setup)
+        report.setup.elapsed = time.perf_counter() - start
+
+        # bound the operations in flight so that the generator only runs ahead
+        # of the workers by `concurrency` and deallocations can pick the lines
+        # allocated so far
+        in_flight = threading.BoundedSemaphore(self._concurrency)
+
+        def send_and_release(operation):
+            try:
+                self._send(operation, report)
+            finally:
+                in_flight.release()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            for operation in self._generator.traffic():
+                in_flight.acquire()
+                executor.submit(send_and_release, operation)
+        report.elapsed = time.perf_counter() - start
+        return report
+
+
+    def _send(self, operation: Operation, report: LoadReport) -> None:
+        start = time.perf_counter()
+        try:
+            outcome = self._target.send(operation)
+        except Exception:
+            outcome = ERROR
+        report.record(operation.kind, outcome, time.perf_counter() - start)
+
+        if operation.kind == ALLOCATE and outcome == OK:
+            self._generator.record_allocation(operation.payload)
+
+
+def main(argv: Optional[List[str]] = None) -> LoadReport:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=('http', 'redis'), default='http')
+    parser.add_argument('--url', default='http://localhost:8000/api')
+    parser.add_argument('--requests', type=int, default=LoadProfile.requests)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--skus', type=int, default=LoadProfile.skus)
+    parser.add_argument('--batches-per-sku', type=int,
+                        default=LoadProfile.batches_per_sku)
+    parser.add_argument('--batch-qty', type=int, default=LoadProfile.batch_qty)
+    parser.add_argument('--zipf-s', type=float, default=LoadProfile.zipf_s)
+    parser.add_argument('--burst-size', type=int, default=LoadProfile.burst_size)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--run-id', default=None,
+                        help='prefix of the generated ids, random by default')
+    args = parser.parse_args(argv)
+
+    profile = LoadProfile(
+        skus=args.skus,
+        batches_per_sku=args.batches_per_sku,
+        batch_qty=args.batch_qty,
+        requests=args.requests,
+        zipf_s=args.zipf_s,
+        burst_size=args.burst_size,
+        seed=args.seed,
+    )
+    if args.run_id is not None:
+        profile.run_id = args.run_id
+
+    if args.target == 'http':
+        profile.mix.pop(CHANGE_BATCH_QUANTITY)
+        target = HttpTarget(args.url)
+    else:
+        target = RedisTarget(*get_redis_config())
+
+    try:
+        report = LoadRunner(target, TrafficGenerator(profile),
+                            args.concurrency).run()
+    finally:
+        target.close()
+
+    print(report.render())
+    return report
+
+
+if __name__ == '__main__':
+    main()
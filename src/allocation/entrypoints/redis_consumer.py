@@ -1,29 +1,20 @@
-import django
-import os
+"""Subscribes to the command channels and handles each command on a bus.
+
+Importing this module has no side effects: Django is set up, the Redis
+connection opened and logging configured by `main` (see `setup`), so that
+startup can be measured and kept short.
+"""
 import json
-import redis
+import os
+import time
 from typing import Dict
-from django.core.management import call_command
+import django
+import redis
 from allocation.config import get_logger, get_redis_config
 from allocation.adapters.redis_channels import RedisChannels
 from allocation.domain.exceptions import DomainException, ValidationError
 from allocation.domain import commands
 
-# Initialize Django to load apps into the registry for successful import
-django.setup()
-from allocation.orchestration import bootstrapper  # noqa: E402
-
-
-# Ensure tests run correctly by migrating the in-memory database used by the
-# `Consumer` when 'DJANGO_TEST_DATABASE' is set to True.
-if os.getenv('DJANGO_TEST_DATABASE'):
-    call_command('migrate')
-
-
-logger = get_logger()
-redis_config = get_redis_config()
-redis_client = redis.Redis(redis_config[0], redis_config[1], decode_responses=True)
-
 
 CHANNEL_COMMAND_MAP: Dict[str, commands.Command] = {
         RedisChannels.CREATE_BATCH          : commands.CreateBatch,
@@ -33,17 +24,42 @@ CHANNEL_COMMAND_MAP: Dict[str, commands.Command] = {
     }
 
 
+def setup():
+    """Sets Django up, with the consumer's settings unless others are given,
+    and returns the bus every message is handled with."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                          'dddjango.dddjango.consumer_settings')
+    django.setup()
+
+    # Ensure tests run correctly by migrating the in-memory database used by
+    # the `Consumer` when 'DJANGO_TEST_DATABASE' is set to True.
+    if os.getenv('DJANGO_TEST_DATABASE'):
+        from django.core.management import call_command
+        call_command('migrate')
+
+    # needs the app registry populated by `django.setup()`
+    from allocation.orchestration import bootstrapper
+    return bootstrapper.bootstrap()
+
+
 def main():
+    start = time.perf_counter()
+    bus = setup()
+    redis_client = redis.Redis(*get_redis_config(), decode_responses=True)
+    
     subscriber = redis_client.pubsub(ignore_subscribe_messages=True)
     subscriber.subscribe(RedisChannels.CONSUMER_PING)
     
     for channel in CHANNEL_COMMAND_MAP:
         subscriber.subscribe(channel)
     
-    event_listener(subscriber)
+    get_logger(__name__).info('Consumer ready in %.3fs',
+                              time.perf_counter() - start)
+    event_listener(subscriber, redis_client, bus)
 
 
-def event_listener(subscriber):
+def event_listener(subscriber, redis_client, bus):
+    logger = get_logger(__name__)
     
     for msg in subscriber.listen():
         
@@ -52,7 +68,6 @@ def event_listener(subscriber):
             continue
 
         data = json.loads(msg['data'])
-        bus = bootstrapper.bootstrap()
         try:
             bus.handle(CHANNEL_COMMAND_MAP[msg['channel']](**data))
         except DomainException:
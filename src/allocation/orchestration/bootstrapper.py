@@ -1,10 +1,12 @@
+import functools
 import inspect
 from typing import Callable, Dict, List, Type
-from allocation.adapters.redis_publisher import RedisEventPublisher
-from allocation.adapters.redis_query_repository import RedisQueryRepository
-from allocation.config import get_redis_config
+from allocation.adapters.metrics import NullMetrics, PrometheusMetrics, StatsDMetrics
+from allocation.config import get_metrics_config, get_redis_config
 from allocation.domain import commands, events, queries
-from allocation.domain.ports import AbstractPublisher, AbstractQueryRepository
+from allocation.domain.ports import (
+    AbstractMetrics, AbstractPublisher, AbstractQueryRepository
+)
 from allocation.orchestration import handlers, query_handlers
 from allocation.orchestration.message_bus import MessageBus
 from allocation.orchestration.uow import AbstractUnitOfWork, DjangoUoW
@@ -13,9 +15,13 @@ from allocation.orchestration.uow import AbstractUnitOfWork, DjangoUoW
 COMMAND_HANDLERS: Dict[Type[commands.Command], Callable] = {
         commands.CreateBatch            : handlers.add_batch,
         commands.Allocate               : handlers.allocate,
+        commands.AllocateSplit          : handlers.allocate_split,
+        commands.AllocateWave           : handlers.allocate_wave,
         commands.Deallocate             : handlers.deallocate,
         commands.ChangeBatchQuantity    : handlers.change_batch_quantity,
         commands.Reallocate             : handlers.reallocate,
+        commands.ChangeAllocationStrategy
+                                        : handlers.change_allocation_strategy,
     }
 
 
@@ -32,27 +38,46 @@ EVENT_HANDLERS: Dict[Type[events.Event], List[Callable]] = {
             handlers.publish_event,
             query_handlers.add_allocation,
             query_handlers.add_order_allocation,
+            query_handlers.remove_allocated_available_to_promise,
+        ],
+        events.LineSplitAllocated: [
+            handlers.publish_event,
+            query_handlers.add_split_allocation,
+            query_handlers.add_split_order_allocation,
+            query_handlers.remove_split_allocated_available_to_promise,
         ],
         events.LineDeallocated : [
             handlers.publish_event,
             query_handlers.remove_allocation,
             query_handlers.remove_allocations_for_order,
+            query_handlers.add_deallocated_available_to_promise,
         ],
         events.OutOfStock : [handlers.publish_event],
+        events.AllocationStrategyChanged : [handlers.publish_event],
     }
 
 
 QUERY_HANDLERS: Dict[Type[queries.Query], Callable] = {
     queries.BatchByRef          : query_handlers.get_batch,
+    queries.BatchesByRefs       : query_handlers.get_batches,
+    queries.BatchesForSku       : query_handlers.get_batches_for_sku,
+    queries.BatchVersion        : query_handlers.get_batch_version,
     queries.AllocationForLine   : query_handlers.get_allocation_for_line,
     queries.AllocationsForOrder : query_handlers.get_allocations_for_order,
+    queries.CommittedAllocationsForOrder
+                                : query_handlers.get_committed_allocations_for_order,
+    queries.AllocationsForOrders: query_handlers.get_allocations_for_orders,
+    queries.AllocationsForOrderVersion
+                                : query_handlers.get_allocations_for_order_version,
+    queries.AvailableToPromise  : query_handlers.get_available_to_promise,
 }
 
 
 def bootstrap(
         uow: AbstractUnitOfWork = None,
         publisher: AbstractPublisher = None,
-        query_repository: AbstractQueryRepository = None
+        query_repository: AbstractQueryRepository = None,
+        metrics: AbstractMetrics = None,
 ) -> MessageBus:
     """
     Initializes and returns a MessageBus instance with all dependencies injected
@@ -60,18 +85,20 @@ def bootstrap(
     default dependencies (see code for details).
     """
     
-    redis_host, redis_port = get_redis_config()
+    metrics = metrics if metrics is not None else default_metrics()
 
     dependencies = {
         'uow': uow if uow is not None else DjangoUoW(),
         
         'publisher': publisher if publisher is not None
-                     else RedisEventPublisher(redis_host, redis_port),
+                     else default_publisher(),
         
         'query_repository': query_repository if query_repository is not None
-                            else RedisQueryRepository(redis_host, redis_port)
+                            else default_query_repository()
     }
 
+    dependencies['uow'].metrics = metrics
+
     injected_command_handlers = {
         command: inject_dependencies(dependencies, command_handler)
         for command, command_handler in COMMAND_HANDLERS.items()
@@ -96,9 +123,42 @@ def bootstrap(
         command_handlers = injected_command_handlers,
         event_handlers = injected_event_handlers,
         query_handlers = injected_query_handlers,
+        metrics = metrics,
     )
 
 
+# The Redis adapters are imported on first use, so that importing this module
+# (e.g. to bootstrap a bus with other adapters) does not import the client.
+
+def default_publisher() -> AbstractPublisher:
+    from allocation.adapters.redis_publisher import RedisEventPublisher
+    return RedisEventPublisher(*get_redis_config())
+
+
+def default_query_repository() -> AbstractQueryRepository:
+    from allocation.adapters.redis_query_repository import RedisQueryRepository
+    return RedisQueryRepository(*get_redis_config())
+
+
+@functools.lru_cache(maxsize=None)
+def default_metrics() -> AbstractMetrics:
+    """Returns the process-wide metrics sink selected by `METRICS_SINK`.
+
+    It is shared by every bus bootstrapped in the process so that counters
+    outlive a single request."""
+    sink, statsd_host, statsd_port = get_metrics_config()
+
+    if sink == 'prometheus':
+        return PrometheusMetrics(
+            buckets={'bus_queue_depth': (1, 2, 5, 10, 25, 50, 100)}
+        )
+    
+    if sink == 'statsd':
+        return StatsDMetrics(statsd_host, statsd_port)
+    
+    return NullMetrics()
+
+
 def inject_dependencies(dependencies, handler):
 
     handler_parameters = inspect.signature(handler).parameters
@@ -109,4 +169,8 @@ def inject_dependencies(dependencies, handler):
         if name in handler_parameters
     }
     
-    return lambda message: handler(message, **dependencies_to_inject)
+    # keep the handler's name on the injected callable for logs and metrics
+    return functools.update_wrapper(
+        lambda message: handler(message, **dependencies_to_inject),
+        handler
+    )
@@ -1,16 +1,31 @@
 from dataclasses import astuple
 from allocation.domain import events, commands, model as domain_
 from allocation.domain.exceptions import InexistentProduct, OutOfStock
-from allocation.domain.ports import AbstractPublisher
+from allocation.domain.ports import AbstractPublisher, AbstractQueryRepository
 from allocation.orchestration.uow import AbstractUnitOfWork
 
 
-def allocate(line: commands.Allocate, uow: AbstractUnitOfWork):
+def allocate(
+        line: commands.Allocate,
+        uow: AbstractUnitOfWork,
+        query_repository: AbstractQueryRepository
+):
+    return _allocate(line, uow, query_repository)
+
+
+def _allocate(
+        line: commands.Allocate,
+        uow: AbstractUnitOfWork,
+        query_repository: AbstractQueryRepository,
+        part: int = 0,
+):
+    reject_if_out_of_stock(line, uow, query_repository)
+    
     with uow:
         product = uow.products.get(line.sku)
 
         try:
-            batch_ref = product.allocate(line.order_id, line.sku, line.qty)
+            batch_ref = product.allocate(line.order_id, line.sku, line.qty, part)
         except OutOfStock:
             uow.rollback()
             raise
@@ -19,8 +34,67 @@ def allocate(line: commands.Allocate, uow: AbstractUnitOfWork):
     return batch_ref
 
 
-def reallocate(line: commands.Reallocate, uow: AbstractUnitOfWork):
-    return allocate(line, uow)
+def allocate_split(
+        line: commands.AllocateSplit,
+        uow: AbstractUnitOfWork,
+        query_repository: AbstractQueryRepository
+):
+    reject_if_out_of_stock(line, uow, query_repository)
+    
+    with uow:
+        product = uow.products.get(line.sku)
+
+        try:
+            parts = product.allocate_split(line.order_id, line.sku, line.qty)
+        except OutOfStock:
+            uow.rollback()
+            raise
+
+        uow.commit()
+    return parts
+
+
+def allocate_wave(wave: commands.AllocateWave, uow: AbstractUnitOfWork):
+    # lines out of stock only emit `OutOfStock`, the rest of the wave commits
+    with uow:
+        product = uow.products.get(wave.sku)
+        batch_refs = product.allocate_wave(wave.sku, wave.lines)
+        uow.commit()
+    return batch_refs
+
+
+def reallocate(
+        line: commands.Reallocate,
+        uow: AbstractUnitOfWork,
+        query_repository: AbstractQueryRepository
+):
+    # the part of a split line keeps its number in whichever batch it lands
+    return _allocate(line, uow, query_repository, line.part)
+
+
+def reject_if_out_of_stock(
+        line: commands.Allocate,
+        uow: AbstractUnitOfWork,
+        query_repository: AbstractQueryRepository
+):
+    """Raises `OutOfStock`, as the product would, when the read model shows
+    less free quantity for the SKU than the line needs, without opening a
+    transaction or loading the product.
+
+    The read model can only lag behind the database by the events still being
+    handled. Those that free quantity (new batches, deallocations) come before
+    any command they lead to, so a line rejected here would have been rejected
+    by the product as well, at worst a moment earlier. A SKU the read model
+    does not track, or shows a negative total for, takes the full path."""
+    free_capacity = query_repository.get_free_capacity(line.sku)
+    
+    if free_capacity is None or free_capacity < 0 \
+            or free_capacity >= line.qty:
+        return
+
+    uow.metrics.increment('allocate_fast_rejections_total')
+    uow.add_message(events.OutOfStock(line.sku, line.order_id))
+    raise OutOfStock(sku=line.sku)
 
 
 def deallocate(line: commands.Deallocate, uow: AbstractUnitOfWork):
@@ -58,3 +132,15 @@ def change_batch_quantity(
         uow.commit()
 
     return ref_and_qty.ref, ref_and_qty.qty
+
+
+def change_allocation_strategy(
+        sku_and_strategy: commands.ChangeAllocationStrategy,
+        uow: AbstractUnitOfWork
+):
+    with uow:
+        product = uow.products.get(sku_and_strategy.sku)
+        product.change_allocation_strategy(sku_and_strategy.strategy)
+        uow.commit()
+
+    return sku_and_strategy.sku, sku_and_strategy.strategy
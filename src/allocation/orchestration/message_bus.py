@@ -1,7 +1,12 @@
+import time
+from contextlib import contextmanager, nullcontext
 from typing import Callable, Dict, List, Type, Union
+from allocation import profiling
+from allocation.adapters.metrics import NullMetrics
 from allocation.config import get_logger
 from allocation.domain import events, commands, queries
 from allocation.domain import exceptions
+from allocation.domain.ports import AbstractMetrics
 from allocation.orchestration.uow import AbstractUnitOfWork
 
 
@@ -14,34 +19,47 @@ class MessageBus:
             uow: AbstractUnitOfWork,
             command_handlers: Dict[Type[commands.Command], Callable],
             event_handlers: Dict[Type[events.Event], List[Callable]],
-            query_handlers: Dict[Type[queries.Query], Callable]
+            query_handlers: Dict[Type[queries.Query], Callable],
+            metrics: AbstractMetrics = None,
+            profile: bool = None,
     ) -> None:
         
         self._uow = uow
         self._command_handlers = command_handlers
         self._event_handlers = event_handlers
         self._query_handlers = query_handlers
-        self._logger = get_logger()
+        self._metrics = metrics if metrics is not None else NullMetrics()
+        self._profile = profile if profile is not None \
+                        else profiling.profiling_enabled()
+        self._logger = get_logger(__name__)
 
     
     def handle(self, message: Message):
         self._queue = [message]
         results = []
+        max_queue_depth = 1
         
-        while self._queue:
-            message = self._queue.pop(0)
-
-            if isinstance(message, commands.Command):
-                results.append(self.handle_command(message))
-            
-            elif isinstance(message, events.Event):
-                self.handle_event(message)
-            
-            elif isinstance(message, queries.Query):
-                return self.handle_query(message)
-            
-            else:
-                raise TypeError(f'{message} is neither a command nor an event.')
+        try:
+            while self._queue:
+                max_queue_depth = max(max_queue_depth, len(self._queue))
+                message = self._queue.pop(0)
+                self._metrics.increment('bus_messages_total',
+                                        tags={'message': type(message).__name__})
+
+                with self._profiled(message):
+                    if isinstance(message, commands.Command):
+                        results.append(self.handle_command(message))
+                    
+                    elif isinstance(message, events.Event):
+                        self.handle_event(message)
+                    
+                    elif isinstance(message, queries.Query):
+                        return self.handle_query(message)
+                    
+                    else:
+                        raise TypeError(f'{message} is neither a command nor an event.')
+        finally:
+            self._metrics.observe('bus_queue_depth', max_queue_depth)
             
         return results
 
@@ -50,7 +68,7 @@ class MessageBus:
         command_handler = self._command_handlers[type(command)]
         self.log_debug(command, command_handler)
         try:
-            result = command_handler(command)
+            result = self._timed(command, command_handler)
         
         except exceptions.OutOfStock:
             # Collect OutOfStock event from UoW, process remaining queue events,
@@ -71,7 +89,7 @@ class MessageBus:
         for handler in self._event_handlers[type(event)]:
             self.log_debug(event, handler)
             try:
-                handler(event)
+                self._timed(event, handler)
             except Exception as e:
                 self.log_error(event, handler, e)
                 raise
@@ -83,19 +101,58 @@ class MessageBus:
         query_handler = self._query_handlers[type(query)]
         self.log_debug(query, query_handler)
         try:
-            return query_handler(query)
+            return self._timed(query, query_handler)
         except exceptions.DomainException as e:
             self.log_error(query, query_handler, e)
             raise
 
 
+    def _timed(self, message: Message, handler: Callable):
+        """Runs the handler, recording its latency and outcome per message
+        type and handler."""
+        tags = {
+            'message': type(message).__name__,
+            'handler': handler_name(handler),
+        }
+        start = time.perf_counter()
+        try:
+            return handler(message)
+        except Exception as e:
+            self._metrics.increment('bus_handler_errors_total',
+                                    tags={**tags, 'error': type(e).__name__})
+            raise
+        finally:
+            self._metrics.observe('bus_handler_seconds',
+                                  time.perf_counter() - start, tags)
+
+
+    def _profiled(self, message: Message):
+        if not self._profile:
+            return nullcontext()
+        return self._log_profile(message)
+
+
+    @contextmanager
+    def _log_profile(self, message: Message):
+        with profiling.profile() as current:
+            try:
+                yield
+            finally:
+                self._logger.info('Profile for %s: %s', message, current)
+
+
     def log_debug(self, message: Message, handler):
-        self._logger.debug(f'Handling {message} with {handler}')
+        # lazy %-formatting: sampled-out records never build the string
+        self._logger.debug('Handling %s with %s', message, handler)
 
 
     def log_error(self, message: Message, handler, err: Exception):
-        self._logger.error(
-            f'Exception handling {message} with {handler}: ' \
-            f'{type(err).__name__}'
-        )
+        self._logger.error('Exception handling %s with %s: %s',
+                           message, handler, type(err).__name__)
+
 
+def handler_name(handler: Callable) -> str:
+    """Returns `module.function` for a (possibly dependency-injected) handler,
+    e.g. `query_handlers.add_batch`."""
+    module = getattr(handler, '__module__', None) or ''
+    return f"{module.rsplit('.', 1)[-1]}.{getattr(handler, '__name__', handler)}"
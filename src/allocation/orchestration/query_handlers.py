@@ -1,5 +1,6 @@
 from allocation.domain import events, queries
 from allocation.domain.ports import AbstractQueryRepository
+from allocation.orchestration.uow import AbstractUnitOfWork
 
 
 def add_batch(
@@ -13,7 +14,10 @@ def add_allocation(
     line: events.LineAllocated,
     query_repository: AbstractQueryRepository
 ):
-    query_repository.add_allocation_for_line(line.order_id, line.sku, line.batch_ref)
+    # a line maps to the batch holding its first part
+    if line.part == 0:
+        query_repository.add_allocation_for_line(line.order_id, line.sku,
+                                                 line.batch_ref)
 
 
 def add_order_allocation(
@@ -23,18 +27,60 @@ def add_order_allocation(
     query_repository.add_allocation_for_order(line.order_id, line.sku, line.batch_ref)
 
 
+def add_split_allocation(
+    line: events.LineSplitAllocated,
+    query_repository: AbstractQueryRepository
+):
+    # a line maps to a single batch: the one holding its first part, the
+    # earliest one it was split across
+    batch_ref, _ = line.allocations[0]
+    query_repository.add_allocation_for_line(line.order_id, line.sku, batch_ref)
+
+
+def add_split_order_allocation(
+    line: events.LineSplitAllocated,
+    query_repository: AbstractQueryRepository
+):
+    for batch_ref, _ in line.allocations:
+        query_repository.add_allocation_for_order(line.order_id, line.sku, batch_ref)
+
+
 def remove_allocation(
     line: events.LineDeallocated,
     query_repository: AbstractQueryRepository
 ):
-    query_repository.remove_allocation_for_line(line.order_id, line.sku)
+    if line.part == 0:
+        query_repository.remove_allocation_for_line(line.order_id, line.sku)
 
 
 def remove_allocations_for_order(
     line: events.LineDeallocated,
     query_repository: AbstractQueryRepository
 ):
-    query_repository.remove_allocation_for_order(line.order_id, line.sku)
+    query_repository.remove_allocation_for_order(line.order_id, line.sku,
+                                                 line.batch_ref)
+
+
+def remove_allocated_available_to_promise(
+    line: events.LineAllocated,
+    query_repository: AbstractQueryRepository
+):
+    query_repository.change_available_to_promise(line.batch_ref, -line.qty)
+
+
+def remove_split_allocated_available_to_promise(
+    line: events.LineSplitAllocated,
+    query_repository: AbstractQueryRepository
+):
+    for batch_ref, qty in line.allocations:
+        query_repository.change_available_to_promise(batch_ref, -qty)
+
+
+def add_deallocated_available_to_promise(
+    line: events.LineDeallocated,
+    query_repository: AbstractQueryRepository
+):
+    query_repository.change_available_to_promise(line.batch_ref, line.qty)
 
 
 def update_batch_quantity(
@@ -51,6 +97,27 @@ def get_batch(
     return query_repository.get_batch(query.batch_ref)
 
 
+def get_batches(
+        query: queries.BatchesByRefs,
+        query_repository: AbstractQueryRepository
+):
+    return query_repository.get_batches(query.batch_refs)
+
+
+def get_batches_for_sku(
+        query: queries.BatchesForSku,
+        query_repository: AbstractQueryRepository
+):
+    return query_repository.get_batches_for_sku(query.sku, query.after, query.limit)
+
+
+def get_batch_version(
+        query: queries.BatchVersion,
+        query_repository: AbstractQueryRepository
+):
+    return query_repository.get_batch_version(query.batch_ref)
+
+
 def get_allocation_for_line(
         query: queries.AllocationForLine,
         query_repository: AbstractQueryRepository
@@ -63,3 +130,33 @@ def get_allocations_for_order(
         query_repository: AbstractQueryRepository
 ):
     return query_repository.get_allocations_for_order(query.order_id)
+
+
+def get_committed_allocations_for_order(
+        query: queries.CommittedAllocationsForOrder,
+        uow: AbstractUnitOfWork
+):
+    # an indexed lookup on the write model, no product is loaded
+    with uow:
+        return uow.products.get_allocations_for_order(query.order_id)
+
+
+def get_allocations_for_orders(
+        query: queries.AllocationsForOrders,
+        query_repository: AbstractQueryRepository
+):
+    return query_repository.get_allocations_for_orders(query.order_ids)
+
+
+def get_allocations_for_order_version(
+        query: queries.AllocationsForOrderVersion,
+        query_repository: AbstractQueryRepository
+):
+    return query_repository.get_allocations_for_order_version(query.order_id)
+
+
+def get_available_to_promise(
+        query: queries.AvailableToPromise,
+        query_repository: AbstractQueryRepository
+):
+    return query_repository.get_available_to_promise(query.sku, query.by)
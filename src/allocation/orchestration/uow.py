@@ -1,11 +1,21 @@
+import time
 from abc import ABC, abstractmethod
-from allocation.domain.ports import AbstractWriteRepository
+from typing import Iterable, Optional
+from allocation.domain.ports import AbstractMetrics, AbstractWriteRepository
 from allocation.adapters.django_repository import DjangoRepository
+from allocation.adapters.in_memory_repository import InMemoryRepository
+from allocation.adapters.metrics import NullMetrics
+from allocation.domain.model import Product
 from django.db import transaction
 
 
 class AbstractUnitOfWork(ABC):
     products: AbstractWriteRepository
+    metrics: AbstractMetrics = NullMetrics()
+
+
+    def __init__(self) -> None:
+        self._messages = []
 
 
     def __exit__(self, *args):
@@ -17,10 +27,21 @@ class AbstractUnitOfWork(ABC):
 
 
     def commit(self):
+        start = time.perf_counter()
         self._commit()
+        self.metrics.observe('uow_commit_seconds', time.perf_counter() - start)
+
+
+    def add_message(self, message):
+        """Queues a message raised outside of any product, e.g. by a handler
+        rejecting a command before loading the product."""
+        self._messages.append(message)
 
 
     def collect_new_messages(self):
+        while self._messages:
+            yield self._messages.pop(0)
+
         for product in self.products.seen:
             while product.messages:
                 yield product.messages.pop(0)
@@ -37,31 +58,80 @@ class AbstractUnitOfWork(ABC):
 
 
 class DjangoUoW(AbstractUnitOfWork):
+    """Unit of work over an `atomic` block, which leaves the connection's
+    autocommit mode alone: persistent and pooled connections are handed back
+    in the state Django expects, and a unit of work opened within an outer
+    `atomic` block becomes a savepoint instead of failing."""
 
     def __init__(self) -> None:
+        super().__init__()
         self._products = DjangoRepository()
+        self._transaction = None
         
     
     def __enter__(self):
-        transaction.set_autocommit(False)
+        # products seen in a previous block may hold changes that were already
+        # committed (or rolled back), so each block starts from the database
+        self._products = DjangoRepository()
+        self._transaction = transaction.atomic()
+        self._transaction.__enter__()
         return super().__enter__()
     
 
     @property
     def products(self) -> DjangoRepository:
         return self._products
-    
-    
-    def __exit__(self, *args):
-        super().__exit__(*args)
-        transaction.set_autocommit(True)
 
 
     def _commit(self):
         for product in self.products.seen:
             self.products.update(product)
-        transaction.commit()
+        self._end_transaction()
+
+
+    def rollback(self):
+        if self._transaction is not None:
+            transaction.set_rollback(True)
+            self._end_transaction()
+
+
+    def _end_transaction(self):
+        # commits, unless marked for rollback
+        atomic, self._transaction = self._transaction, None
+        atomic.__exit__(None, None, None)
+
+
+class InMemoryUoW(AbstractUnitOfWork):
+    """Unit of work over an `InMemoryRepository`, for simulations and
+    benchmarks of the domain without a database: bootstrap the bus with
+    `uow=InMemoryUoW(products)`.
+
+    Products seen are stored on commit, and dropped on rollback or when the
+    next block starts, the way `DjangoUoW` starts each block from the
+    database. `uow.products.snapshot()` and `uow.products.restore(snapshot)`
+    save and bring back everything committed so far."""
+
+    def __init__(self, products: Optional[Iterable[Product]] = None) -> None:
+        super().__init__()
+        self._products = InMemoryRepository(products)
+
+
+    def __enter__(self):
+        self._products.seen.clear()
+        return super().__enter__()
+
+
+    @property
+    def products(self) -> InMemoryRepository:
+        return self._products
+
+
+    def _commit(self):
+        for product in self.products.seen:
+            self.products.update(product)
 
 
     def rollback(self):
-        transaction.rollback()
+        # nothing was stored yet: the products seen, with their messages, are
+        # only dropped when the next block starts
+        pass
@@ -0,0 +1,96 @@
+"""Counts SQL queries and Redis commands, and the time spent on them, while a
+`profile()` block is active.
+
+Profiles nest: a query issued inside the per-message profile of the bus is
+also counted by the per-request profile of the HTTP middleware around it.
+"""
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator, Optional, Tuple
+from allocation.config import get_profiling_config
+
+
+@dataclass
+class Profile:
+    sql_queries: int = 0
+    sql_seconds: float = 0.0
+    redis_commands: int = 0
+    redis_seconds: float = 0.0
+
+
+    def __str__(self) -> str:
+        return (
+            f'{self.sql_queries} SQL queries ({self.sql_seconds * 1000:.2f} ms), '
+            f'{self.redis_commands} Redis commands '
+            f'({self.redis_seconds * 1000:.2f} ms)'
+        )
+
+
+_active_profiles: ContextVar[Tuple[Profile, ...]] = ContextVar(
+    'active_profiles', default=()
+)
+
+
+def profiling_enabled() -> bool:
+    return get_profiling_config()
+
+
+def is_profiling() -> bool:
+    return bool(_active_profiles.get())
+
+
+@contextmanager
+def profile() -> Iterator[Profile]:
+    from django.db import connection
+
+    current = Profile()
+    outer = _active_profiles.get()
+    token = _active_profiles.set(outer + (current,))
+    # only the outermost profile hooks into the connection; the hook already
+    # reports every query to all the active profiles
+    hook = connection.execute_wrapper(_sql_wrapper) if not outer else nullcontext()
+    try:
+        with hook:
+            yield current
+    finally:
+        _active_profiles.reset(token)
+
+
+def record_redis_commands(count: int, seconds: float) -> None:
+    for active in _active_profiles.get():
+        active.redis_commands += count
+        active.redis_seconds += seconds
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        for active in _active_profiles.get():
+            active.sql_queries += 1
+            active.sql_seconds += elapsed
+
+
+@contextmanager
+def assert_query_budget(
+        sql: Optional[int] = None,
+        redis: Optional[int] = None
+) -> Iterator[Profile]:
+    """Fails if the block issues more than `sql` SQL queries or `redis`
+    Redis commands."""
+    with profile() as current:
+        yield current
+
+    if sql is not None and current.sql_queries > sql:
+        raise AssertionError(
+            f'Expected at most {sql} SQL queries, got {current.sql_queries}.'
+        )
+    if redis is not None and current.redis_commands > redis:
+        raise AssertionError(
+            f'Expected at most {redis} Redis commands, '
+            f'got {current.redis_commands}.'
+        )
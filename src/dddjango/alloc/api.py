@@ -1,26 +1,147 @@
+import threading
+from datetime import date
+from typing import Optional
 import ninja
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
+from ninja.decorators import decorate_view
+from allocation.adapters.metrics import PrometheusMetrics
 from allocation.domain import commands, queries
 from allocation.domain import exceptions
+from allocation.domain.validators import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from allocation.orchestration import bootstrapper
+from allocation.orchestration.message_bus import MessageBus
+from dddjango.alloc import exports
 from dddjango.alloc.schemas import (
-    AllocationsForOrder, BatchIn, BatchOut, BatchRef, ErrorMessage, OrderLineIn
+    AllocationsForOrder, AllocationsForOrdersOut, AllocationStrategyIn,
+    AvailableToPromise, BatchesOut, BatchIn, BatchOut, BatchPage, BatchRef,
+    BatchRefsIn, ErrorMessage, OrderIdsIn, OrderLineIn, SplitAllocation
 )
 
 
 api = ninja.NinjaAPI()
+_local = threading.local()
+
+
+def get_bus() -> MessageBus:
+    """Returns the calling thread's bus, bootstrapped on its first request.
+    Its Redis connection pools and unit of work are reused by the thread's
+    later requests, while a bus is never shared between threads as it
+    keeps per-message state."""
+    try:
+        return _local.bus
+    except AttributeError:
+        _local.bus = bootstrapper.bootstrap()
+        return _local.bus
+
+
+def etag(version: Optional[int]) -> Optional[str]:
+    return None if version is None else str(version)
+
+
+# Entity versions are read from the read model before the view runs: a request
+# whose `If-None-Match` holds the current one gets a 304 without the entity
+# being read at all. Otherwise the version becomes the response's ETag, which
+# is never newer than the content read after it.
+
+def batch_etag(request, batch_ref: str) -> Optional[str]:
+    return etag(get_bus().handle(queries.BatchVersion(batch_ref)))
+
+
+def allocations_for_order_etag(request, order_id: str) -> Optional[str]:
+    # versions are the read model's, which committed allocations bypass
+    if request.GET.get('committed') in ('true', '1'):
+        return None
+    return etag(get_bus().handle(queries.AllocationsForOrderVersion(order_id)))
 
 
 @api.get('batches/{batch_ref}', response=BatchOut)
+@decorate_view(condition(etag_func=batch_etag))
 def get_batch_by_ref(request, batch_ref: str):
-    bus = bootstrapper.bootstrap()
+    bus = get_bus()
     batch = bus.handle(queries.BatchByRef(batch_ref))
     return 200, batch
 
 
+@api.get('skus/{sku}/batches', response={200: BatchPage, 400: ErrorMessage})
+def list_batches_for_sku(request, sku: str, after: Optional[str] = None,
+                         limit: int = DEFAULT_PAGE_SIZE):
+    batches, next_cursor = get_bus().handle(
+        queries.BatchesForSku(sku, after, limit)
+    )
+    return 200, {'batches': batches, 'next': next_cursor}
+
+
+@api.get('skus/{sku}/batches/stream')
+def stream_batches_for_sku(request, sku: str):
+    return StreamingHttpResponse(
+        stream_batches(sku), content_type='application/json'
+    )
+
+
+def stream_batches(sku: str):
+    """Yields all of the SKU's batches as a JSON array, one chunk per page of
+    the read model, so that neither the server nor Redis ever holds more than
+    a page of them."""
+    yield '['
+    after, separator = None, ''
+    while True:
+        batches, after = get_bus().handle(
+            queries.BatchesForSku(sku, after, MAX_PAGE_SIZE)
+        )
+        if batches:
+            yield separator + ','.join(
+                BatchOut.from_orm(batch).model_dump_json() for batch in batches
+            )
+            separator = ','
+        if after is None:
+            break
+    yield ']'
+
+
+@api.get('exports/allocations', response={400: ErrorMessage})
+def export_allocations(request, format: str = 'ndjson'):
+    # read from the write model as the response is sent, not through the bus
+    chunks = exports.export_allocations(format)
+    _, content_type = exports.FORMATS[format]
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = \
+        f'attachment; filename="allocations.{format}"'
+    return response
+
+
+# Multi-get queries: one request and one read model round trip for many
+# entities. POST, so that the keys fit in the body rather than the URL.
+
+@api.post('bulk/batches', response={200: BatchesOut, 400: ErrorMessage})
+def query_batches_by_refs(request, payload: BatchRefsIn):
+    batches = get_bus().handle(queries.BatchesByRefs(tuple(payload.batch_refs)))
+    return 200, {
+        'batches': list(batches.values()),
+        'missing': missing(payload.batch_refs, batches),
+    }
+
+
+@api.post('bulk/allocations', response={200: AllocationsForOrdersOut,
+                                        400: ErrorMessage})
+def query_allocations_for_orders(request, payload: OrderIdsIn):
+    allocations = get_bus().handle(
+        queries.AllocationsForOrders(tuple(payload.order_ids))
+    )
+    return 200, {
+        'allocations': allocations,
+        'missing': missing(payload.order_ids, allocations),
+    }
+
+
+def missing(keys, found):
+    return [key for key in dict.fromkeys(keys) if key not in found]
+
+
 @api.post('allocate', response = {201: BatchRef, 400: ErrorMessage})
 def allocate(request, payload: OrderLineIn):
     line = payload.dict()
-    bus = bootstrapper.bootstrap()
+    bus = get_bus()
     results = bus.handle(
         commands.Allocate(line['order_id'], line['sku'], line['qty'])
     )
@@ -28,10 +149,21 @@ def allocate(request, payload: OrderLineIn):
     return 201, {'batch_ref': batch_ref}
 
 
+@api.post('allocate/split', response = {201: SplitAllocation, 400: ErrorMessage})
+def allocate_split(request, payload: OrderLineIn):
+    line = payload.dict()
+    bus = get_bus()
+    results = bus.handle(
+        commands.AllocateSplit(line['order_id'], line['sku'], line['qty'])
+    )
+    parts = [{'batch_ref': batch_ref, 'qty': qty} for batch_ref, qty in results[-1]]
+    return 201, {'allocations': parts}
+
+
 @api.post('deallocate', response = {200: BatchRef, 400: ErrorMessage})
 def deallocate(request, payload: OrderLineIn):
     line = payload.dict()
-    bus = bootstrapper.bootstrap()
+    bus = get_bus()
     results = bus.handle(
         commands.Deallocate(line['order_id'], line['sku'], line['qty'])
     )
@@ -43,7 +175,7 @@ def deallocate(request, payload: OrderLineIn):
 @api.post('batches', response={201: BatchOut})
 def add_batch(request, payload: BatchIn):
     batch = payload.model_dump()
-    bus = bootstrapper.bootstrap()
+    bus = get_bus()
     bus.handle(commands.CreateBatch(**batch))
     
     added_batch = next(
@@ -53,21 +185,51 @@ def add_batch(request, payload: BatchIn):
     return 201, added_batch
 
 
+@api.put('products/{sku}/allocation_strategy',
+         response={200: AllocationStrategyIn, 400: ErrorMessage})
+def change_allocation_strategy(request, sku: str, payload: AllocationStrategyIn):
+    bus = get_bus()
+    bus.handle(commands.ChangeAllocationStrategy(sku, payload.strategy))
+    return 200, {'strategy': payload.strategy}
+
+
 @api.get('allocations/{order_id}/{sku}', response={200: BatchRef, 400: ErrorMessage})
 def query_allocation_for_line(request, order_id, sku):
-    bus = bootstrapper.bootstrap()
+    bus = get_bus()
     batch_ref = bus.handle(queries.AllocationForLine(order_id, sku))
     return 200, {'batch_ref': batch_ref}
 
 
 @api.get('allocations/{order_id}', response = { 200: AllocationsForOrder,
                                                 400: ErrorMessage})
-def query_allocations_for_order(request, order_id):
-    bus = bootstrapper.bootstrap()
-    allocations = bus.handle(queries.AllocationsForOrder(order_id))
+@decorate_view(condition(etag_func=allocations_for_order_etag))
+def query_allocations_for_order(request, order_id, committed: bool = False):
+    bus = get_bus()
+    query = queries.CommittedAllocationsForOrder if committed \
+        else queries.AllocationsForOrder
+    allocations = bus.handle(query(order_id))
     return 200, {'allocations': allocations}
 
 
+@api.get('available/{sku}', response={200: AvailableToPromise})
+def query_available_to_promise(request, sku: str, by: Optional[date] = None):
+    bus = get_bus()
+    qty = bus.handle(queries.AvailableToPromise(sku, by))
+    return 200, {'sku': sku, 'by': by, 'qty': qty}
+
+
+@api.get('metrics')
+def metrics(request):
+    """Prometheus scrape endpoint, available when `METRICS_SINK=prometheus`."""
+    sink = bootstrapper.default_metrics()
+    
+    if not isinstance(sink, PrometheusMetrics):
+        return HttpResponse(status=404)
+    
+    return HttpResponse(sink.render(),
+                        content_type='text/plain; version=0.0.4')
+
+
 @api.exception_handler(exceptions.DomainException)
 def domain_error(request, exc):
     return api.create_response(
@@ -88,12 +250,24 @@ def validation_error(request, exc):
 
 @api.exception_handler(ninja.errors.ValidationError)
 def ninja_validation_errors(request, exc):
-    errors = [error['loc'][2] for error in exc.errors]
+    # field names anywhere in the locations: body fields sit under the
+    # payload, query parameters right under `query`
+    errors = {field for error in exc.errors for field in error['loc']}
     
     if 'qty' in errors:
         error = exceptions.InvalidTypeForQuantity()
-    elif 'eta' in errors:
+    elif 'eta' in errors or 'by' in errors:
         error = exceptions.InvalidETAFormat()
+    elif 'batch_refs' in errors or 'order_ids' in errors:
+        error = exceptions.InvalidQueryKeys()
+    elif 'limit' in errors:
+        error = exceptions.InvalidPageSize(max_size=MAX_PAGE_SIZE)
+    elif 'strategy' in errors:
+        error = exceptions.InvalidAllocationStrategy()
+    else:
+        error = exceptions.InvalidRequestField(
+            field=exc.errors[0]['loc'][-1] if exc.errors else None
+        )
     
     return api.create_response(
         request,
@@ -0,0 +1,66 @@
+"""Streaming exports of the write model, served by `GET /api/exports/...` and
+the `export_allocations` management command."""
+import csv
+import itertools
+import json
+from typing import Iterable, Iterator, Sequence
+from allocation.adapters.django_repository import DjangoRepository
+from allocation.domain.exceptions import InvalidExportFormat
+
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """File-like object `csv.writer` writes a row to, handing the line back."""
+
+    def write(self, line: str) -> str:
+        return line
+
+
+def ndjson_lines(fields: Sequence[str], rows: Iterable[Sequence]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row))) + '\n'
+
+
+def csv_lines(fields: Sequence[str], rows: Iterable[Sequence]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+# format: (lines writer, content type)
+FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
+
+
+def export_allocations(
+        format: str, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[str]:
+    """Returns every allocation in `format`, in chunks of `chunk_size` lines
+    read in as many rows from the database: a chunk at a time is ever held in
+    memory.
+
+    Raises `InvalidExportFormat` right away, before anything is read."""
+    try:
+        lines, _ = FORMATS[format]
+    except KeyError:
+        raise InvalidExportFormat(formats=FORMATS)
+
+    return _chunks(
+        lines(DjangoRepository.ALLOCATION_FIELDS,
+              DjangoRepository.iter_allocations(chunk_size)),
+        chunk_size,
+    )
+
+
+def _chunks(lines: Iterator[str], size: int) -> Iterator[str]:
+    # one write per chunk rather than per line, to the response or the file
+    while True:
+        chunk = ''.join(itertools.islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
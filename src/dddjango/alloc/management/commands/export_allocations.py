@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from dddjango.alloc import exports
+
+
+class Command(BaseCommand):
+    help = ('Writes every allocation as NDJSON or CSV, streamed from the '
+            'database in chunks (e.g. for the nightly finance reconciliation).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=exports.FORMATS,
+                            default='ndjson')
+        parser.add_argument('--chunk-size', type=int,
+                            default=exports.DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--output', '-o',
+                            help='file to write to instead of stdout')
+
+
+    def handle(self, *args, format, chunk_size, output, **options):
+        chunks = exports.export_allocations(format, chunk_size)
+
+        if output is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        # lines carry their own endings (`\r\n` for CSV)
+        with open(output, 'w', newline='') as file:
+            file.writelines(chunks)
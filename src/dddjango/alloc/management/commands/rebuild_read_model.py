@@ -0,0 +1,30 @@
+import redis
+from django.core.management.base import BaseCommand
+from allocation.adapters.redis_read_model_rebuild import (
+    DEFAULT_CHUNK_SIZE, ReadModelRebuild
+)
+from allocation.config import get_redis_config
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the Redis read model from the write model and swaps it '
+            'in, while the service keeps running.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='rows read and commands pipelined at a time')
+
+
+    def handle(self, *args, chunk_size, **options):
+        rebuild = ReadModelRebuild(
+            redis.Redis(*get_redis_config()),
+            chunk_size=chunk_size,
+            progress=self.stdout.write,
+        )
+        report = rebuild.run()
+
+        if report.behind:
+            self.stderr.write(f'{report.behind} entities were still changing: '
+                              'run the rebuild again once traffic is lower.')
+        else:
+            self.stdout.write(self.style.SUCCESS('Read model rebuilt.'))
@@ -0,0 +1,64 @@
+import time
+import redis
+from django.core.management.base import BaseCommand, CommandError
+from allocation.adapters.redis_read_model_verifier import (
+    DEFAULT_CHUNK_SIZE, DEFAULT_GRACE_SECONDS, DEFAULT_KEYS_PER_SECOND,
+    ReadModelVerifier
+)
+from allocation.config import get_redis_config
+from allocation.orchestration.bootstrapper import default_metrics
+
+
+# drifts listed in the output, all of them are counted
+LISTED_DRIFTS = 20
+
+
+class Command(BaseCommand):
+    help = ('Compares the Redis read model with the write model, reports the '
+            'drift and optionally repairs it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--rate', type=float, default=DEFAULT_KEYS_PER_SECOND,
+                            help='keys checked per second at most')
+        parser.add_argument('--grace', type=float, default=DEFAULT_GRACE_SECONDS,
+                            help='seconds to wait before checking a drift again')
+        parser.add_argument('--sample', type=int, default=0,
+                            help='check this many random chunks of each kind '
+                                 'of key rather than every key')
+        parser.add_argument('--repair', action='store_true')
+        parser.add_argument('--interval', type=float,
+                            help='run again every this many seconds, for good')
+
+
+    def handle(self, *args, chunk_size, rate, grace, sample, repair, interval,
+               **options):
+        verifier = ReadModelVerifier(
+            redis.Redis(*get_redis_config()),
+            chunk_size=chunk_size,
+            keys_per_second=rate,
+            grace=grace,
+            repair=repair,
+            metrics=default_metrics(),
+        )
+
+        while True:
+            report = verifier.sample(sample) if sample else verifier.verify()
+            self._write_report(report)
+            if interval is None:
+                break
+            time.sleep(interval)
+
+        if not report.consistent and not repair:
+            raise CommandError('The read model drifted from the write model.')
+
+
+    def _write_report(self, report):
+        for kind, checked in sorted(report.checked.items()):
+            self.stdout.write(f'{kind}: {checked} checked, '
+                              f'{report.drifted[kind]} drifted')
+        for drift in report.drifts[:LISTED_DRIFTS]:
+            self.stdout.write(f'  {drift.kind} {drift.key}: expected '
+                              f'{drift.expected}, found {drift.actual}')
+        if report.repaired:
+            self.stdout.write(f'{report.repaired} repaired')
@@ -0,0 +1,28 @@
+from django.core.exceptions import MiddlewareNotUsed
+from allocation import profiling
+from allocation.config import get_logger
+
+
+class QueryProfilingMiddleware:
+    """Reports the SQL queries and Redis commands issued by each request in
+    the logs and in `X-*` response headers. Only active when
+    `ALLOCATION_PROFILING` is set."""
+
+    def __init__(self, get_response):
+        if not profiling.profiling_enabled():
+            raise MiddlewareNotUsed()
+        
+        self.get_response = get_response
+        self._logger = get_logger(__name__)
+
+
+    def __call__(self, request):
+        with profiling.profile() as current:
+            response = self.get_response(request)
+
+        response['X-SQL-Queries'] = current.sql_queries
+        response['X-SQL-Time-Ms'] = f'{current.sql_seconds * 1000:.2f}'
+        response['X-Redis-Commands'] = current.redis_commands
+        response['X-Redis-Time-Ms'] = f'{current.redis_seconds * 1000:.2f}'
+        self._logger.info('Profile for %s %s: %s', request.method, request.path, current)
+        return response
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.3 on 2026-10-19 13:13
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def drop_duplicate_lines(apps, schema_editor):
+    # a line allocated more than once, which nothing prevented so far, keeps
+    # its first allocation only
+    Allocation = apps.get_model('alloc', 'Allocation')
+    duplicated = Allocation.objects.order_by() \
+                                   .values('order_id', 'sku') \
+                                   .annotate(rows=Count('id'), first=Min('id')) \
+                                   .filter(rows__gt=1)
+    for line in duplicated.iterator():
+        Allocation.objects.filter(order_id=line['order_id'], sku=line['sku']) \
+                          .exclude(id=line['first']) \
+                          .delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alloc', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='allocation',
+            index=models.Index(fields=['batch', 'order_id', 'sku'], name='alloc_batch_order_sku_idx'),
+        ),
+        migrations.RunPython(drop_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='allocation',
+            constraint=models.UniqueConstraint(fields=('order_id', 'sku'), name='unique_order_line'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-19 13:15
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_allocated_qty(apps, schema_editor):
+    Batch = apps.get_model('alloc', 'Batch')
+    Allocation = apps.get_model('alloc', 'Allocation')
+    totals = Allocation.objects.filter(batch=OuterRef('pk')) \
+                               .order_by() \
+                               .values('batch') \
+                               .annotate(total=Sum('qty')) \
+                               .values('total')
+    Batch.objects.update(allocated_qty=Coalesce(Subquery(totals), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alloc', '0002_allocation_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='allocated_qty',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_allocated_qty, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-19 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alloc', '0003_batch_allocated_qty'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='allocation_strategy',
+            field=models.CharField(choices=[('earliest_eta', 'earliest_eta'), ('best_fit', 'best_fit')], default='earliest_eta', max_length=32),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.3 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alloc', '0004_product_allocation_strategy'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='allocation',
+            name='unique_order_line',
+        ),
+        migrations.AddConstraint(
+            model_name='allocation',
+            constraint=models.UniqueConstraint(fields=('order_id', 'sku', 'batch'), name='unique_order_line_batch'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.3 on 2026-10-19 18:10
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def number_split_parts(apps, schema_editor):
+    # the parts of a line split so far all hold part 0: they are numbered in
+    # the order they were allocated, which is ETA order
+    Allocation = apps.get_model('alloc', 'Allocation')
+    split_lines = Allocation.objects.order_by() \
+                                    .values('order_id', 'sku') \
+                                    .annotate(parts=Count('id')) \
+                                    .filter(parts__gt=1)
+    for line in split_lines.iterator():
+        ids = Allocation.objects.filter(order_id=line['order_id'],
+                                        sku=line['sku']) \
+                                .order_by('id') \
+                                .values_list('id', flat=True)
+        for part, id_ in enumerate(ids):
+            Allocation.objects.filter(id=id_).update(part=part)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alloc', '0005_allocation_unique_order_line_batch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='allocation',
+            name='part',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(number_split_parts, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='allocation',
+            name='unique_order_line_batch',
+        ),
+        migrations.AddConstraint(
+            model_name='allocation',
+            constraint=models.UniqueConstraint(fields=('order_id', 'sku', 'part'), name='unique_order_line_part'),
+        ),
+    ]
@@ -1,19 +1,38 @@
-from typing import Set
+from functools import partial
+from typing import Callable, Iterable, Optional, Set
 from django.db import models
-from allocation.domain import model as domain_
+from allocation.domain import model as domain_, strategies
+
+
+# takes a batch ref and the sku to build its lines with, returns the lines
+LinesLoader = Callable[[str, str], Iterable[domain_.OrderLine]]
 
 
 class Product(models.Model):
     sku = models.CharField(max_length=255, primary_key=True)
+    allocation_strategy = models.CharField(
+        max_length=32,
+        choices=[(name, name) for name in strategies.STRATEGIES],
+        default=strategies.DEFAULT_STRATEGY,
+    )
 
     class Meta:
         app_label = 'alloc'
     
     
-    def to_domain(self) -> domain_.Product:
-        return domain_.Product(
+    def to_domain(
+            self,
+            load_allocations: Optional[LinesLoader] = None,
+    ) -> domain_.Product:
+        # prefetch `batches` (and `batches__allocations` unless loading them
+        # lazily) to hydrate in a constant number of queries, see
+        # `DjangoRepository`. Every batch and line shares this product's `sku`
+        # string instead of holding its own copy from the row it was read from.
+        return domain_.Product.rehydrate(
             self.sku,
-            [batch.to_domain() for batch in self.batches.all()]
+            [batch.to_domain(load_allocations, self.sku)
+             for batch in self.batches.all()],
+            self.allocation_strategy,
         )
 
 
@@ -22,20 +41,30 @@ class Batch(models.Model):
     product = models.ForeignKey(to=Product, on_delete=models.CASCADE, related_name='batches')
     qty = models.IntegerField()
     eta = models.DateField(blank=True, null=True)
+    # sum of the allocations' qty, kept in step by `DjangoRepository`
+    allocated_qty = models.IntegerField(default=0)
 
     class Meta:
         app_label = 'alloc'
 
     
-    def to_domain(self) -> domain_.Batch:
-
-        domain_batch = domain_.Batch(
-            self.ref, self.product.sku, self.qty, self.eta
+    def to_domain(
+            self,
+            load_allocations: Optional[LinesLoader] = None,
+            sku: Optional[str] = None,
+    ) -> domain_.Batch:
+        sku = self.product_id if sku is None else sku
+        
+        if load_allocations is not None:
+            return domain_.Batch.with_lazy_allocations(
+                self.ref, sku, self.qty, self.eta,
+                self.allocated_qty, partial(load_allocations, self.ref, sku),
+            )
+        
+        return domain_.Batch.rehydrate(
+            self.ref, sku, self.qty, self.eta,
+            Allocation.allocations_to_domain(self, sku),
         )
-        for line in Allocation.allocations_to_domain(self):
-            domain_batch.allocate(line)
-
-        return domain_batch
 
 
 class Allocation(models.Model):
@@ -43,14 +72,31 @@ class Allocation(models.Model):
     order_id = models.CharField(max_length=255)
     sku = models.CharField(max_length=255)
     qty = models.IntegerField()
+    # a line split across batches has a row per part, see `OrderLine.part`
+    part = models.PositiveSmallIntegerField(default=0)
 
     class Meta:
         app_label = 'alloc'
+        constraints = [
+            # a line (each of its parts) is allocated once, whatever the
+            # batch. Also serves as the index for "allocations for order"
+            # lookups.
+            models.UniqueConstraint(fields=['order_id', 'sku', 'part'],
+                                    name='unique_order_line_part'),
+        ]
+        indexes = [
+            models.Index(fields=['batch', 'order_id', 'sku'],
+                         name='alloc_batch_order_sku_idx'),
+        ]
 
 
     @staticmethod
-    def allocations_to_domain(Batch) -> Set[domain_.OrderLine]:
+    def allocations_to_domain(Batch, sku: Optional[str] = None
+    ) -> Set[domain_.OrderLine]:
         return {
-            domain_.OrderLine(line.order_id, line.sku, line.qty)
+            domain_.OrderLine(line.order_id,
+                              line.sku if sku is None else sku,
+                              line.qty,
+                              line.part)
             for line in Batch.allocations.all()
         }
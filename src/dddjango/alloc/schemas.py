@@ -17,6 +17,20 @@ class BatchOut(Schema):
     eta: Union[date, None]
 
 
+class BatchPage(Schema):
+    batches: List[BatchOut]
+    next: Optional[str]
+
+
+class BatchRefsIn(Schema):
+    batch_refs: List[str]
+
+
+class BatchesOut(Schema):
+    batches: List[BatchOut]
+    missing: List[str]
+
+
 class OrderLineIn(Schema):
     order_id: str
     sku: str
@@ -27,9 +41,37 @@ class BatchRef(Schema):
     batch_ref: str
 
 
+class AllocationPart(Schema):
+    batch_ref: str
+    qty: int
+
+
+class SplitAllocation(Schema):
+    allocations: List[AllocationPart]
+
+
 class ErrorMessage(Schema):
     message: str
 
 
 class AllocationsForOrder(Schema):
     allocations: List[Dict[str, str]]
+
+
+class OrderIdsIn(Schema):
+    order_ids: List[str]
+
+
+class AllocationsForOrdersOut(Schema):
+    allocations: Dict[str, List[Dict[str, str]]]
+    missing: List[str]
+
+
+class AllocationStrategyIn(Schema):
+    strategy: str
+
+
+class AvailableToPromise(Schema):
+    sku: str
+    by: Optional[date] = None
+    qty: int
@@ -0,0 +1,14 @@
+"""
+Django settings for the Redis consumer (`allocation.entrypoints.redis_consumer`).
+
+The consumer only uses the allocation app's models, so it leaves out the admin,
+auth, sessions and the other apps the API serves: `django.setup()` then has
+fewer apps and models to import, which shortens its cold start.
+"""
+
+from dddjango.dddjango.settings import *  # noqa: F401,F403
+
+
+INSTALLED_APPS = [
+    'dddjango.alloc',
+]
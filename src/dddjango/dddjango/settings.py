@@ -56,6 +56,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'dddjango.alloc.middleware.QueryProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'dddjango.dddjango.urls'
@@ -82,6 +83,31 @@ WSGI_APPLICATION = 'dddjango.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Under the sync (WSGI) profile, connections are kept open across requests
+# for `POSTGRES_CONN_MAX_AGE` seconds (0 closes them after each request, as
+# Django does by default), and checked before being reused. Under the ASGI
+# profile (`SERVER_INTERFACE=asgi`, see gunicorn.conf.py) requests run sync
+# code in short-lived executor threads, each of which would keep its own
+# connection open until it expires, so they are closed after each request.
+# With `POSTGRES_POOL=1` each process draws them from a psycopg pool instead,
+# under either profile; Django does not combine it with persistent
+# connections.
+SERVER_INTERFACE = getenv('SERVER_INTERFACE', 'wsgi')
+
+POSTGRES_POOL = getenv('POSTGRES_POOL', '').lower() not in ('', '0', 'false')
+
+POSTGRES_CONN_MAX_AGE = (
+    int(getenv('POSTGRES_CONN_MAX_AGE', 60))
+    if SERVER_INTERFACE == 'wsgi' and not POSTGRES_POOL else 0
+)
+
+POSTGRES_POOL_OPTIONS = {
+    'min_size': int(getenv('POSTGRES_POOL_MIN_SIZE', 2)),
+    'max_size': int(getenv('POSTGRES_POOL_MAX_SIZE', 10)),
+    # seconds to wait for a free connection before failing the request
+    'timeout': float(getenv('POSTGRES_POOL_TIMEOUT', 10)),
+}
+
 DATABASES = {
 
     'default': {
@@ -91,10 +117,20 @@ DATABASES = {
         'PASSWORD': getenv('POSTGRES_PASSWORD'),
         'HOST': getenv('POSTGRES_HOST', 'localhost'),
         'PORT': getenv('POSTGRES_PORT', 5432),
+        'CONN_MAX_AGE': POSTGRES_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pool': POSTGRES_POOL_OPTIONS if POSTGRES_POOL else False,
+        },
     },
 }
 
-if 'test' in sys.argv or 'pytest' in sys.modules or getenv('DJANGO_TEST_DATABASE'):
+# Tests use an in-memory SQLite unless `DJANGO_TEST_POSTGRES` is set, in which
+# case they (and the benchmarks) run against the Postgres configured above.
+RUNNING_TESTS = 'test' in sys.argv or 'pytest' in sys.modules \
+                or getenv('DJANGO_TEST_DATABASE')
+
+if RUNNING_TESTS and not getenv('DJANGO_TEST_POSTGRES'):
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
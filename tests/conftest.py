@@ -50,6 +50,7 @@ def redis_client(redis_host, redis_port):
 def consumer_process(redis_client):
     env = os.environ.copy()
     env['DJANGO_TEST_DATABASE'] = '1'
+    env['DJANGO_SETTINGS_MODULE'] = 'dddjango.dddjango.consumer_settings'
     consumer_relative_path = os.path.relpath(redis_consumer.__file__, os.getcwd())
     consumer_process = subprocess.Popen(['python', consumer_relative_path], env=env)
     wait_for_consumer(redis_client)
@@ -1,6 +1,8 @@
+import json
 from django.test import Client
 import pytest
 from allocation.domain import exceptions
+from allocation.domain.validators import MAX_PAGE_SIZE, MAX_QUERY_KEYS
 
 
 @pytest.fixture(scope="function")
@@ -29,6 +31,7 @@ class TestBatch:
             (('batch', 'sku', -1), exceptions.InvalidQuantity().msg),
             (('batch', 'sku', 1, 'aaaaa'), exceptions.InvalidETAFormat().msg),
             (('batch', 'sku', 1, '1900-01-01'), exceptions.PastETANotAllowed().msg),
+            (('batch', None, 1), exceptions.InvalidRequestField(field='sku').msg),
         ]
     )
     def test_invalid_values_return_error_message(self, values, error_msg):
@@ -71,6 +74,24 @@ class TestAllocate:
         assert response.json()['message'] == error_message
 
 
+@pytest.mark.django_db(transaction=True)
+class TestAllocateSplit:
+
+    def test_api_returns_parts_of_split_line(self, today, tomorrow):
+        post_to_create_batch('today', 'skew', 3, today)
+        post_to_create_batch('tomorrow', 'skew', 3, tomorrow)
+        response = Client().post(
+            path = '/api/allocate/split',
+            data = {'order_id': 'o1', 'sku': 'skew', 'qty': 5},
+            content_type = "application/json"
+        )
+        assert response.status_code == 201
+        assert response.json()['allocations'] == [
+            {'batch_ref': 'today', 'qty': 3},
+            {'batch_ref': 'tomorrow', 'qty': 2},
+        ]
+
+
 @pytest.mark.django_db(transaction=True)
 class TestDeallocate:
 
@@ -104,6 +125,48 @@ class TestDeallocate:
         assert response.json()['message'] == error_message
 
 
+@pytest.mark.django_db(transaction=True)
+class TestAllocationStrategy:
+
+    def test_api_changes_allocation_strategy(self):
+        post_to_create_batch('big', 'skew', 10)
+        post_to_create_batch('small', 'skew', 5)
+        response = Client().put(
+            path = '/api/products/skew/allocation_strategy',
+            data = {'strategy': 'best_fit'},
+            content_type = "application/json"
+        )
+        assert response.status_code == 200
+        
+        response = post_to_allocate_line('o1', 'skew', 3)
+        assert response.json()['batch_ref'] == 'small'
+
+
+    def test_inexistent_strategy_returns_error_message(self):
+        post_to_create_batch('batch', 'skew', 10)
+        response = Client().put(
+            path = '/api/products/skew/allocation_strategy',
+            data = {'strategy': 'fefo'},
+            content_type = "application/json"
+        )
+        assert response.status_code == 400
+        assert response.json()['message'] == \
+            exceptions.InvalidAllocationStrategy(strategy='fefo').msg
+
+
+    @pytest.mark.parametrize('payload', [{}, {'strategy': 1}, {'strategy': None}])
+    def test_missing_or_invalid_strategy_returns_error_message(self, payload):
+        post_to_create_batch('batch', 'skew', 10)
+        response = Client().put(
+            path = '/api/products/skew/allocation_strategy',
+            data = payload,
+            content_type = "application/json"
+        )
+        assert response.status_code == 400
+        assert response.json()['message'] == \
+            exceptions.InvalidAllocationStrategy().msg
+
+
 @pytest.mark.usefixtures('clear_redis')
 @pytest.mark.django_db(transaction=True)
 class TestQueries:
@@ -124,6 +187,31 @@ class TestQueries:
             exceptions.BatchDoesNotExist(ref='foo').msg
     
 
+    def test_batch_info_is_not_resent_while_unchanged(self):
+        post_to_create_batch('ref', 'skew', 10)
+        etag = retrieve_batch_from_server('ref')['ETag']
+        
+        response = Client().get('/api/batches/ref', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+
+
+    def test_order_allocations_are_resent_once_changed(self):
+        post_to_create_batch('batch1', 'sku1', 10)
+        post_to_create_batch('batch2', 'sku2', 10)
+        post_to_allocate_line('o1', 'sku1', 1)
+        etag = Client().get('/api/allocations/o1')['ETag']
+        
+        response = Client().get('/api/allocations/o1', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        
+        post_to_allocate_line('o1', 'sku2', 1)
+        response = Client().get('/api/allocations/o1', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+        assert len(response.json()['allocations']) == 2
+
+
     def test_query_allocation_for_line(self):
         batch = ('batch', 'sku', 10)
         post_to_create_batch(*batch)
@@ -167,6 +255,23 @@ class TestQueries:
         ]}
     
 
+    def test_query_committed_allocations_for_order(self, redis_client):
+        post_to_create_batch('batch1', 'sku1', 10)
+        post_to_allocate_line('o1', 'sku1', 1)
+        # the read model lags behind
+        redis_client.flushall()
+        
+        response = Client().get('/api/allocations/o1?committed=true')
+        assert response.status_code == 200
+        assert response.json() == {'allocations': [{'sku1': 'batch1'}]}
+        assert not response.has_header('ETag')
+        
+        response = Client().get('/api/allocations/o2?committed=true')
+        assert response.status_code == 400
+        assert response.json()['message'] == \
+            exceptions.OrderHasNoAllocations(order_id='o2').msg
+
+
     def test_query_returns_400_error_message_for_order_with_no_allocations(self):
         response = Client().get(
             f"/api/allocations/{'o1'}"
@@ -174,6 +279,124 @@ class TestQueries:
         assert response.status_code == 400
         assert response.json()['message'] == \
             exceptions.OrderHasNoAllocations(order_id='o1').msg
+
+
+    def test_query_available_to_promise(self, today, later):
+        post_to_create_batch('in-stock', 'sku', 10)
+        post_to_create_batch('later', 'sku', 20, later.isoformat())
+        post_to_allocate_line('o1', 'sku', 3)
+        
+        response = Client().get(f'/api/available/sku?by={today.isoformat()}')
+        assert response.status_code == 200
+        assert response.json() == {'sku': 'sku', 'by': today.isoformat(), 'qty': 7}
+        
+        response = Client().get('/api/available/sku')
+        assert response.json() == {'sku': 'sku', 'by': None, 'qty': 27}
+
+
+    def test_query_available_to_promise_by_an_invalid_date(self):
+        response = Client().get('/api/available/sku?by=garbage')
+        
+        assert response.status_code == 400
+        assert response.json()['message'] == exceptions.InvalidETAFormat().msg
+
+
+    def test_page_through_batches_for_sku(self, today):
+        post_to_create_batch('in-stock', 'sku', 10)
+        post_to_create_batch('shipment', 'sku', 20, today.isoformat())
+        
+        response = Client().get('/api/skus/sku/batches?limit=1')
+        assert response.status_code == 200
+        page = response.json()
+        assert [batch['ref'] for batch in page['batches']] == ['in-stock']
+        
+        response = Client().get(
+            '/api/skus/sku/batches', {'after': page['next'], 'limit': 1}
+        )
+        assert response.json() == {
+            'batches': [{'ref': 'shipment', 'sku': 'sku', 'qty': 20,
+                         'eta': today.isoformat()}],
+            'next': None,
+        }
+
+
+    def test_invalid_page_size_returns_error_message(self):
+        response = Client().get('/api/skus/sku/batches?limit=0')
+        assert response.status_code == 400
+        assert response.json()['message'] == \
+            exceptions.InvalidPageSize(max_size=MAX_PAGE_SIZE).msg
+
+
+    def test_stream_batches_for_sku(self):
+        post_to_create_batch('batch1', 'sku', 10)
+        post_to_create_batch('batch2', 'sku', 20)
+        
+        response = Client().get('/api/skus/sku/batches/stream')
+        assert response.status_code == 200
+        assert response.streaming
+        batches = json.loads(b''.join(response.streaming_content))
+        assert [batch['ref'] for batch in batches] == ['batch1', 'batch2']
+
+
+    def test_export_allocations(self):
+        post_to_create_batch('batch', 'sku', 10)
+        post_to_allocate_line('o1', 'sku', 1)
+        post_to_allocate_line('o2', 'sku', 2)
+        
+        response = Client().get('/api/exports/allocations')
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/x-ndjson'
+        lines = b''.join(response.streaming_content).splitlines()
+        assert [json.loads(line) for line in lines] == [
+            {'order_id': 'o1', 'sku': 'sku', 'qty': 1, 'batch_ref': 'batch'},
+            {'order_id': 'o2', 'sku': 'sku', 'qty': 2, 'batch_ref': 'batch'},
+        ]
+        
+        response = Client().get('/api/exports/allocations?format=xml')
+        assert response.status_code == 400
+
+
+    def test_query_many_batches_at_once(self):
+        post_to_create_batch('batch1', 'sku', 10)
+        post_to_create_batch('batch2', 'sku', 20)
+        
+        response = Client().post(
+            path = '/api/bulk/batches',
+            data = {'batch_refs': ['batch2', 'nope', 'batch1']},
+            content_type = "application/json"
+        )
+        assert response.status_code == 200
+        assert [batch['ref'] for batch in response.json()['batches']] == \
+            ['batch2', 'batch1']
+        assert response.json()['missing'] == ['nope']
+
+
+    def test_query_allocations_for_many_orders_at_once(self):
+        post_to_create_batch('batch', 'sku', 10)
+        post_to_allocate_line('o1', 'sku', 1)
+        post_to_allocate_line('o2', 'sku', 1)
+        
+        response = Client().post(
+            path = '/api/bulk/allocations',
+            data = {'order_ids': ['o1', 'o2', 'o3']},
+            content_type = "application/json"
+        )
+        assert response.status_code == 200
+        assert response.json() == {
+            'allocations': {'o1': [{'sku': 'batch'}], 'o2': [{'sku': 'batch'}]},
+            'missing': ['o3'],
+        }
+
+
+    def test_too_many_keys_return_error_message(self):
+        response = Client().post(
+            path = '/api/bulk/batches',
+            data = {'batch_refs': [str(i) for i in range(MAX_QUERY_KEYS + 1)]},
+            content_type = "application/json"
+        )
+        assert response.status_code == 400
+        assert response.json()['message'] == \
+            exceptions.InvalidQueryKeys(max_keys=MAX_QUERY_KEYS).msg
         
 
 def post_to_create_batch(ref, sku, qty, eta=None, assert_ok=True):
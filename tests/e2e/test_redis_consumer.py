@@ -4,6 +4,8 @@ from time import sleep
 from uuid import uuid4
 import pytest
 from allocation.adapters.redis_channels import RedisChannels
+from allocation.adapters.redis_query_repository import RedisQueryRepository
+from allocation.entrypoints import load_generator as lg
 
 
 @pytest.fixture(autouse=True)
@@ -105,6 +107,20 @@ def test_can_change_batch_quantity_via_redis(batch, line, subscriber, redis_clie
     assert json.loads(message['data'])['sku'] == line['sku']
 
 
+def test_batch_with_an_eta_reaches_the_read_model(
+        batch, subscriber, redis_client, redis_host, redis_port, today
+):
+    subscriber.subscribe(RedisChannels.CONSUMER_PONG)
+    redis_client.publish(RedisChannels.CREATE_BATCH, json.dumps(batch))
+    # messages are handled in order, so the batch is done with on the pong
+    redis_client.publish(RedisChannels.CONSUMER_PING, 'done?')
+    assert receive_message(subscriber) is not None
+    
+    query_repository = RedisQueryRepository(redis_host, redis_port)
+    assert query_repository.get_batch(batch['ref']).eta == today
+    assert query_repository.get_available_to_promise(batch['sku']) == batch['qty']
+
+
 def test_consumer_keeps_breathing_after_exception(subscriber, redis_client, line):
     redis_client.publish(RedisChannels.ALLOCATE_LINE, json.dumps(line))
     subscriber.subscribe(RedisChannels.CONSUMER_PONG)
@@ -118,6 +134,31 @@ def assert_line_fields_match(line, data):
     assert data['qty'] == line['qty']
 
 
+def test_load_generator_matches_replies_to_their_lines(
+        batch, sku, subscriber, redis_client, redis_host, redis_port
+):
+    target = lg.RedisTarget(redis_host, redis_port, timeout=2)
+    try:
+        assert target.send(lg.Operation(lg.CREATE_BATCH, batch)) == lg.OK
+        line = {'order_id': 'o1', 'sku': sku, 'qty': 10}
+        assert target.send(lg.Operation(lg.ALLOCATE, line)) == lg.OK
+        assert target.send(lg.Operation(lg.ALLOCATE, {**line, 'order_id': 'o2',
+                                                      'qty': 1})) \
+            == lg.OUT_OF_STOCK
+        
+        # o1 no longer fits and fails to be reallocated
+        subscriber.subscribe(RedisChannels.CONSUMER_PONG)
+        assert target.send(lg.Operation(lg.CHANGE_BATCH_QUANTITY,
+                                        {'ref': batch['ref'], 'qty': 5})) == lg.OK
+        redis_client.publish(RedisChannels.CONSUMER_PING, 'done?')
+        assert receive_message(subscriber) is not None
+        sleep(0.1)
+        
+        assert target.send(lg.Operation(lg.DEALLOCATE, line)) == lg.LOST
+    finally:
+        target.close()
+
+
 def receive_message(subscriber):
     retries = 5
     while retries:
@@ -0,0 +1,71 @@
+"""Checks that Postgres uses the allocation indexes on a realistically sized
+table. Runs only against Postgres (`DJANGO_TEST_POSTGRES=1`); the table size
+defaults to 10M rows and can be lowered with `EXPLAIN_TEST_ROWS`."""
+import os
+import pytest
+from django.db import connection
+
+
+ROWS = int(os.getenv('EXPLAIN_TEST_ROWS', 10_000_000))
+BATCHES = 1_000
+
+
+@pytest.fixture(scope='module')
+def allocations_table(django_db_setup, django_db_blocker):
+    with django_db_blocker.unblock():
+        if connection.vendor != 'postgresql':
+            pytest.skip('EXPLAIN checks need Postgres')
+        
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO alloc_product (sku) VALUES ('sku')"
+            )
+            cursor.execute(
+                """
+                INSERT INTO alloc_batch (ref, product_id, qty, eta)
+                SELECT 'batch' || i, 'sku', %s, NULL
+                FROM generate_series(1, %s) AS i
+                """,
+                [ROWS, BATCHES]
+            )
+            cursor.execute(
+                """
+                INSERT INTO alloc_allocation (batch_id, order_id, sku, qty)
+                SELECT 'batch' || (i %% %s + 1), 'order' || i, 'sku', 1
+                FROM generate_series(1, %s) AS i
+                """,
+                [BATCHES, ROWS]
+            )
+            cursor.execute('ANALYZE alloc_allocation')
+        
+        yield
+        
+        with connection.cursor() as cursor:
+            cursor.execute('TRUNCATE alloc_allocation, alloc_batch, alloc_product')
+
+
+def explain(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN {sql}', params)
+        return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+@pytest.mark.django_db
+def test_allocations_for_order_use_unique_order_line_part_index(allocations_table):
+    plan = explain(
+        'SELECT sku, batch_id FROM alloc_allocation WHERE order_id = %s '
+        'ORDER BY id',
+        ['order42']
+    )
+    assert 'unique_order_line_part' in plan
+    assert 'Seq Scan' not in plan
+
+
+@pytest.mark.django_db
+def test_removing_lines_from_batch_uses_composite_index(allocations_table):
+    plan = explain(
+        'DELETE FROM alloc_allocation WHERE batch_id = %s AND order_id IN (%s)',
+        ['batch43', 'order42']
+    )
+    assert 'alloc_batch_order_sku_idx' in plan or 'unique_order_line_part' in plan
+    assert 'Seq Scan' not in plan
@@ -1,6 +1,8 @@
 from allocation.adapters.django_repository import DjangoRepository
 from allocation.domain import model as domain_
-from allocation.domain.exceptions import InexistentProduct
+from allocation.domain.exceptions import (
+    InexistentProduct, LineIsAlreadyAllocatedError, OrderHasNoAllocations
+)
 from dddjango.alloc import models as orm
 import pytest
 
@@ -102,3 +104,148 @@ def test_can_return_list_of_products(repo):
     products = repo.list()
 
     assert {'sku1', 'sku2', 'sku3'} == {p.sku for p in products}
+
+
+@pytest.mark.django_db
+def test_can_update_batch_quantity(repo, domain_product):
+    repo.add(domain_product)
+    domain_product.change_batch_quantity('batch', 20)
+    repo.update(domain_product)
+    
+    assert orm.Batch.objects.get(ref='batch').qty == 20
+
+
+@pytest.mark.django_db
+def test_can_get_allocations_for_order(repo):
+    product = domain_.Product('sku', [domain_.Batch('b1', 'sku', 10),
+                                      domain_.Batch('b2', 'sku', 10)])
+    repo.add(product)
+    other_product = domain_.Product('other', [domain_.Batch('b3', 'other', 10)])
+    repo.add(other_product)
+    product.allocate('o1', 'sku', 10)
+    other_product.allocate('o1', 'other', 1)
+    repo.update(product)
+    repo.update(other_product)
+    
+    assert repo.get_allocations_for_order('o1') == [{'sku': 'b1'}, {'other': 'b3'}]
+
+
+@pytest.mark.django_db
+def test_get_allocations_for_order_raises_error_for_order_without_allocations(repo):
+    with pytest.raises(OrderHasNoAllocations):
+        repo.get_allocations_for_order('nope')
+
+
+@pytest.mark.django_db
+def test_cannot_allocate_the_same_line_to_two_batches(repo):
+    product = domain_.Product('sku', [domain_.Batch('b1', 'sku', 10),
+                                      domain_.Batch('b2', 'sku', 10)])
+    product.batches[0].allocate(domain_.OrderLine('o1', 'sku', 1))
+    product.batches[1].allocate(domain_.OrderLine('o1', 'sku', 1))
+    
+    with pytest.raises(LineIsAlreadyAllocatedError):
+        repo.add(product)
+
+
+@pytest.mark.django_db
+def test_a_batch_can_hold_several_parts_of_a_line(repo):
+    product = domain_.Product('sku', [domain_.Batch('b1', 'sku', 10)])
+    repo.add(product)
+    product.batches[0].allocate(domain_.OrderLine('o1', 'sku', 3, part=0))
+    product.batches[0].allocate(domain_.OrderLine('o1', 'sku', 3, part=1))
+    repo.update(product)
+    
+    product.batches[0].deallocate(domain_.OrderLine('o1', 'sku', 3, part=1))
+    repo.update(product)
+    
+    assert repo._get('sku').batches[0].allocations == [
+        domain_.OrderLine('o1', 'sku', 3, part=0)
+    ]
+    assert orm.Batch.objects.get(ref='b1').allocated_qty == 3
+
+
+@pytest.mark.django_db
+def test_cannot_allocate_the_same_line_twice_to_a_batch(repo):
+    product = domain_.Product('sku', [domain_.Batch('b1', 'sku', 10)])
+    product.batches[0].allocate(domain_.OrderLine('o1', 'sku', 1))
+    product.batches[0].allocate(domain_.OrderLine('o1', 'sku', 2))
+    
+    with pytest.raises(LineIsAlreadyAllocatedError):
+        repo.add(product)
+
+
+@pytest.mark.django_db
+def test_keeps_batch_allocated_qty_in_step_with_allocations(repo, domain_product, lines):
+    repo.add(domain_product)
+    assert orm.Batch.objects.get(ref='batch').allocated_qty == 6
+    
+    domain_product.allocate('new_line', domain_product.sku, 4)
+    repo.update(domain_product)
+    assert orm.Batch.objects.get(ref='batch').allocated_qty == 10
+    
+    domain_product.deallocate(lines[1].order_id, lines[1].sku, lines[1].qty)
+    domain_product.deallocate(lines[2].order_id, lines[2].sku, lines[2].qty)
+    repo.update(domain_product)
+    assert orm.Batch.objects.get(ref='batch').allocated_qty == 5
+
+
+@pytest.mark.django_db
+def test_hydrates_batches_without_their_lines(repo, domain_product, lines):
+    repo.add(domain_product)
+    batch = DjangoRepository().get(domain_product.sku).batches[0]
+    
+    assert not batch.allocations_loaded
+    assert batch.allocated_qty == 6
+    assert set(batch.allocations) == set(lines)
+
+
+@pytest.mark.django_db
+def test_can_update_product_allocated_without_loading_lines(repo, domain_product, lines):
+    repo.add(domain_product)
+    product = DjangoRepository().get(domain_product.sku)
+    product.allocate('new_line', domain_product.sku, 4)
+    repo.update(product)
+    batch = DjangoRepository().get(domain_product.sku).batches[0]
+    
+    assert not product.batches[0].allocations_loaded
+    assert set(batch.allocations) == set(lines) | {
+        domain_.OrderLine('new_line', domain_product.sku, 4)
+    }
+    assert orm.Batch.objects.get(ref='batch').allocated_qty == 10
+
+
+@pytest.mark.django_db
+def test_persists_allocation_strategy(repo):
+    repo.add(domain_.Product('sku', allocation_strategy='best_fit'))
+    assert DjangoRepository().get('sku').allocation_strategy == 'best_fit'
+    
+    product = DjangoRepository().get('sku')
+    product.change_allocation_strategy('earliest_eta')
+    repo.update(product)
+    assert orm.Product.objects.get(sku='sku').allocation_strategy == 'earliest_eta'
+
+
+@pytest.mark.django_db
+def test_can_store_a_line_split_across_batches(repo):
+    product = domain_.Product('sku', [domain_.Batch('b1', 'sku', 3),
+                                      domain_.Batch('b2', 'sku', 4)])
+    repo.add(product)
+    product = DjangoRepository().get('sku')
+    product.allocate_split('o1', 'sku', 5)
+    repo.update(product)
+    
+    assert repo.get_allocations_for_order('o1') == [{'sku': 'b1'}, {'sku': 'b2'}]
+    assert [b.allocated_qty for b in DjangoRepository().get('sku').batches] == [3, 2]
+
+
+@pytest.mark.django_db
+def test_iterates_over_every_allocation_in_chunks(domain_product, repo):
+    repo.add(domain_product)
+    
+    rows = list(repo.iter_allocations(chunk_size=2))
+    
+    assert sorted(rows) == [
+        ('order1', 'skew', 1, 'batch'),
+        ('order2', 'skew', 2, 'batch'),
+        ('order3', 'skew', 3, 'batch'),
+    ]
@@ -0,0 +1,64 @@
+import csv
+import io
+import json
+import pytest
+from django.core.management import call_command
+from allocation.domain.exceptions import InvalidExportFormat
+from dddjango.alloc import exports
+from dddjango.alloc import models as orm
+
+
+@pytest.fixture
+def allocations():
+    orm.Product.objects.create(sku='sku')
+    orm.Batch.objects.create(ref='batch', product_id='sku', qty=100)
+    for i in range(5):
+        orm.Allocation.objects.create(
+            batch_id='batch', order_id=f'order{i}', sku='sku', qty=i + 1,
+        )
+
+
+def export(**options):
+    out = io.StringIO()
+    call_command('export_allocations', stdout=out, **options)
+    return out.getvalue()
+
+
+@pytest.mark.django_db
+def test_exports_allocations_as_ndjson(allocations):
+    lines = export(chunk_size=2).splitlines()
+    
+    assert [json.loads(line) for line in lines] == [
+        {'order_id': f'order{i}', 'sku': 'sku', 'qty': i + 1, 'batch_ref': 'batch'}
+        for i in range(5)
+    ]
+
+
+@pytest.mark.django_db
+def test_exports_allocations_as_csv(allocations, tmp_path):
+    output = tmp_path / 'allocations.csv'
+    export(format='csv', chunk_size=2, output=str(output))
+    
+    with open(output, newline='') as file:
+        rows = list(csv.reader(file))
+    
+    assert rows[0] == ['order_id', 'sku', 'qty', 'batch_ref']
+    assert rows[1:] == [[f'order{i}', 'sku', str(i + 1), 'batch'] for i in range(5)]
+
+
+@pytest.mark.django_db
+def test_export_is_written_in_chunks(allocations):
+    chunks = list(exports.export_allocations('ndjson', chunk_size=2))
+    
+    assert [chunk.count('\n') for chunk in chunks] == [2, 2, 1]
+
+
+@pytest.mark.django_db
+def test_nothing_is_exported_without_allocations():
+    assert export() == ''
+    assert export(format='csv') == 'order_id,sku,qty,batch_ref\r\n'
+
+
+def test_cannot_export_in_unknown_format():
+    with pytest.raises(InvalidExportFormat):
+        exports.export_allocations('xml')
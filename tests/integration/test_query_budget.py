@@ -0,0 +1,128 @@
+"""SQL query budgets for the write-side flows, run against a product with
+`N_BATCHES` batches holding `N_LINES` allocated lines each."""
+import pytest
+from allocation.domain import commands
+from allocation.domain.exceptions import OutOfStock
+from allocation.domain.ports import AbstractPublisher, AbstractQueryRepository
+from allocation.orchestration import bootstrapper
+from allocation.orchestration.uow import DjangoUoW
+from allocation.profiling import assert_query_budget, profile
+
+
+N_BATCHES = 3
+N_LINES = 5
+
+QUERY_BUDGETS = {
+    # batches are hydrated without their lines, which are only loaded to
+    # deallocate (and then once more to diff them on commit). Each unit of
+    # work counts a BEGIN as well, which SQLite issues explicitly for `atomic`
+    'add_batch': 6,
+    'allocate': 7,
+    'deallocate': 9,
+    # every line lands in batch0 (no ETAs), so shrinking it reallocates 11
+    # lines, each in its own unit of work starting from the database
+    'change_batch_quantity': 88,
+    # rejected off the read model, before a transaction is opened
+    'allocate_out_of_stock': 0,
+}
+
+
+class FakeQueryRepo(AbstractQueryRepository):
+    def add_batch(self, *args, **kwargs): ...
+    def get_batch(self, *args, **kwargs): ...
+    def update_batch_quantity(self, *args, **kwargs): ...
+    def add_allocation_for_line(self, *args, **kwargs): ...
+    def get_allocation_for_line(self, *args, **kwargs): ...
+    def remove_allocation_for_line(self, *args, **kwargs): ...
+    def add_allocation_for_order(self, *args, **kwargs): ...
+    def get_allocations_for_order(self, *args, **kwargs): ...
+    def remove_allocation_for_order(self, *args, **kwargs): ...
+    def change_available_to_promise(self, *args, **kwargs): ...
+    def get_batches(self, *args, **kwargs): ...
+    def get_allocations_for_orders(self, *args, **kwargs): ...
+    def get_batches_for_sku(self, *args, **kwargs): ...
+    def get_batch_version(self, *args, **kwargs): ...
+    def get_allocations_for_order_version(self, *args, **kwargs): ...
+    def get_free_capacity(self, *args, **kwargs): ...
+    def get_available_to_promise(self, *args, **kwargs): ...
+
+
+class SoldOutQueryRepo(FakeQueryRepo):
+    def get_free_capacity(self, *args, **kwargs):
+        return 0
+
+
+class FakePublisher(AbstractPublisher):
+    def publish_event(*args, **kwargs): ...
+
+
+def new_bus():
+    return bootstrapper.bootstrap(
+        uow=DjangoUoW(),
+        publisher=FakePublisher(),
+        query_repository=FakeQueryRepo(),
+    )
+
+
+@pytest.fixture
+def bus():
+    return new_bus()
+
+
+@pytest.fixture
+def stocked_bus(bus):
+    for i in range(N_BATCHES):
+        bus.handle(commands.CreateBatch(f'batch{i}', 'sku', 100))
+        for j in range(N_LINES):
+            bus.handle(commands.Allocate(f'order{i}-{j}', 'sku', 1))
+    
+    # a fresh bus, as each request gets, so nothing is cached in the UoW
+    return new_bus()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_add_batch_query_budget(stocked_bus):
+    with assert_query_budget(sql=QUERY_BUDGETS['add_batch']):
+        stocked_bus.handle(commands.CreateBatch('new_batch', 'sku', 10))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_allocate_query_budget(stocked_bus):
+    with assert_query_budget(sql=QUERY_BUDGETS['allocate']):
+        stocked_bus.handle(commands.Allocate('new_order', 'sku', 1))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_allocate_out_of_stock_query_budget(stocked_bus):
+    bus = bootstrapper.bootstrap(
+        uow=DjangoUoW(),
+        publisher=FakePublisher(),
+        query_repository=SoldOutQueryRepo(),
+    )
+    with assert_query_budget(sql=QUERY_BUDGETS['allocate_out_of_stock']):
+        with pytest.raises(OutOfStock):
+            bus.handle(commands.Allocate('new_order', 'sku', 1))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_deallocate_query_budget(stocked_bus):
+    with assert_query_budget(sql=QUERY_BUDGETS['deallocate']):
+        stocked_bus.handle(commands.Deallocate('order0-0', 'sku', 1))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_change_batch_quantity_query_budget(stocked_bus):
+    # shrinking batch0 below its allocations deallocates and reallocates a line
+    with assert_query_budget(sql=QUERY_BUDGETS['change_batch_quantity']):
+        stocked_bus.handle(commands.ChangeBatchQuantity('batch0', N_LINES - 1))
+
+
+
+@pytest.mark.django_db(transaction=True)
+def test_nested_profiles_count_each_query_once(bus):
+    with profile() as outer:
+        bus.handle(commands.CreateBatch('batch', 'sku', 10))
+        with profile() as inner:
+            bus.handle(commands.Allocate('order', 'sku', 1))
+
+    assert 0 < inner.sql_queries < outer.sql_queries
@@ -0,0 +1,131 @@
+import pytest
+import redis
+from allocation.adapters.redis_query_repository import RedisQueryRepository
+from allocation.adapters.redis_read_model_rebuild import ReadModelRebuild
+from allocation.domain import commands, queries
+from allocation.orchestration import bootstrapper
+
+
+@pytest.fixture
+def client(redis_host, redis_port):
+    return redis.Redis(redis_host, redis_port)
+
+
+@pytest.fixture
+def bus(redis_host, redis_port):
+    return bootstrapper.bootstrap(
+        query_repository=RedisQueryRepository(redis_host, redis_port)
+    )
+
+
+@pytest.fixture(autouse=True)
+def clear_redis(client):
+    client.flushall()
+    yield
+    client.flushall()
+
+
+@pytest.fixture
+def allocations(bus, tomorrow):
+    bus.handle(commands.CreateBatch('in-stock', 'sku1', 10))
+    bus.handle(commands.CreateBatch('shipment', 'sku1', 20, tomorrow))
+    bus.handle(commands.CreateBatch('other', 'sku2', 5))
+    bus.handle(commands.Allocate('o1', 'sku1', 3))
+    bus.handle(commands.AllocateSplit('o1', 'sku2', 2))
+    bus.handle(commands.AllocateSplit('o2', 'sku1', 15))
+    bus.handle(commands.Allocate('o3', 'sku2', 1))
+    bus.handle(commands.Deallocate('o3', 'sku2', 1))
+
+
+def read_model(bus):
+    return {
+        'batches': bus.handle(queries.BatchesByRefs(('in-stock', 'shipment', 'other'))),
+        'sku1': bus.handle(queries.BatchesForSku('sku1')),
+        'lines': [bus.handle(queries.AllocationForLine(*line))
+                  for line in [('o1', 'sku1'), ('o1', 'sku2'), ('o2', 'sku1')]],
+        'orders': bus.handle(queries.AllocationsForOrders(('o1', 'o2'))),
+        'atp': [bus.handle(queries.AvailableToPromise(sku)) for sku in ['sku1', 'sku2']],
+    }
+
+
+def comparable(model):
+    # batches are compared by their properties
+    return {
+        **model,
+        'batches': {ref: b.properties_dict for ref, b in model['batches'].items()},
+        'sku1': [b.properties_dict for b in model['sku1'][0]],
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rebuilds_a_lost_read_model(allocations, bus, client):
+    expected = comparable(read_model(bus))
+    client.flushall()
+    
+    report = ReadModelRebuild(client, chunk_size=2).run()
+    
+    assert comparable(read_model(bus)) == expected
+    assert report.rows['batches'] == 3
+    assert report.behind == 0
+    assert not list(client.scan_iter('rebuild:*'))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rebuild_replaces_drifted_entries_and_bumps_versions(allocations, bus, client):
+    expected = comparable(read_model(bus))
+    version = bus.handle(queries.BatchVersion('in-stock'))
+    client.hset('allocation', 'stale--line', 'batch')
+    client.hincrby('atp:sku1:free', 0, 100)
+    
+    ReadModelRebuild(client).run()
+    
+    assert comparable(read_model(bus)) == expected
+    assert client.hget('allocation', 'stale--line') is None
+    assert bus.handle(queries.BatchVersion('in-stock')) > version
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rebuild_catches_up_with_changes_made_meanwhile(allocations, bus, client):
+    def allocate_while_rebuilding(message):
+        if message.startswith('batches'):
+            bus.handle(commands.Allocate('o4', 'sku1', 1))
+            bus.handle(commands.ChangeBatchQuantity('other', 50))
+    
+    ReadModelRebuild(client, progress=allocate_while_rebuilding).run()
+    
+    assert bus.handle(queries.AllocationsForOrder('o4')) == [{'sku1': 'in-stock'}]
+    assert bus.handle(queries.BatchByRef('other')).qty == 50
+    assert bus.handle(queries.AvailableToPromise('sku2')) == 48
+    assert client.zcard('changes') == 0
+    assert not client.exists('changes:rebuilds')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_failed_rebuild_leaves_live_read_model_alone(allocations, bus, client):
+    expected = comparable(read_model(bus))
+    
+    def fail(message):
+        raise RuntimeError()
+    
+    with pytest.raises(RuntimeError):
+        ReadModelRebuild(client, progress=fail).run()
+    
+    assert comparable(read_model(bus)) == expected
+    assert not list(client.scan_iter('rebuild:*'))
+    assert not client.exists('changes:rebuilds')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_change_log_keeps_what_rebuilds_still_running_read(allocations, bus, client):
+    client.zadd('changes:rebuilds', {'running': 0})
+    bus.handle(commands.Allocate('o4', 'sku1', 1))
+    
+    def allocate_while_rebuilding(message):
+        if message.startswith('batches'):
+            bus.handle(commands.Allocate('o5', 'sku1', 1))
+    
+    ReadModelRebuild(client, progress=allocate_while_rebuilding).run()
+    
+    assert {m.decode() for m in client.zrange('changes', 0, -1)} \
+        == {'order:o4', 'order:o5', 'sku:sku1'}
+    assert client.zrange('changes:rebuilds', 0, -1) == [b'running']
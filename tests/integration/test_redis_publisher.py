@@ -77,6 +77,7 @@ class TestRedisPublishesEvents:
         message = self.receive_message(subscriber)
         assert message['channel'] == RedisChannels.OUT_OF_STOCK
         assert json.loads(message['data'])['sku'] == 'skew'
+        assert json.loads(message['data'])['order_id'] == 'o1'
 
     
     @pytest.mark.django_db(transaction=True)
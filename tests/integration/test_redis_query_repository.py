@@ -1,4 +1,5 @@
 import pytest
+from allocation.adapters.django_repository import DjangoRepository
 from allocation.adapters.redis_query_repository import RedisQueryRepository
 from allocation.domain import commands, exceptions, queries
 from allocation.orchestration import bootstrapper
@@ -120,6 +121,39 @@ def test_deallocation_updates_order_allocations(tomorrow, bus):
                           ]
 
 
+@pytest.mark.django_db(transaction=True)
+def test_parts_of_a_split_line_are_reallocated_one_by_one(today, bus):
+    bus.handle(commands.CreateBatch('b1', 'sku', 3))
+    bus.handle(commands.CreateBatch('b2', 'sku', 6, today))
+    [parts] = bus.handle(commands.AllocateSplit('o1', 'sku', 8))
+    assert parts == [('b1', 3), ('b2', 5)]
+    
+    # the first part moves to the batch already holding the second one
+    bus.handle(commands.ChangeBatchQuantity('b2', 9))
+    bus.handle(commands.ChangeBatchQuantity('b1', 1))
+    
+    assert DjangoRepository.get_allocations_for_order('o1') == [
+        {'sku': 'b2'}, {'sku': 'b2'}
+    ]
+    assert bus.handle(queries.AllocationsForOrder('o1')) == [
+        {'sku': 'b2'}, {'sku': 'b2'}
+    ]
+    assert bus.handle(queries.AllocationForLine('o1', 'sku')).decode() == 'b2'
+    assert bus.handle(queries.BatchByRef('b2')).qty == 9
+    assert bus.handle(queries.AvailableToPromise('sku')) == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_cannot_allocate_a_line_twice(bus):
+    bus.handle(commands.CreateBatch('b1', 'sku', 1))
+    bus.handle(commands.CreateBatch('b2', 'sku', 1))
+    bus.handle(commands.Allocate('o1', 'sku', 1))
+    
+    with pytest.raises(exceptions.LineIsAlreadyAllocatedError):
+        bus.handle(commands.Allocate('o1', 'sku', 1))
+    assert bus.handle(queries.AllocationsForOrder('o1')) == [{'sku': 'b1'}]
+
+
 @pytest.mark.django_db(transaction=True)
 def test_changing_batch_quantity_updates_batch(today, bus):
     batch = {'ref': 'batch', 'sku': 'sku', 'qty': 10, 'eta': today}
@@ -129,3 +163,147 @@ def test_changing_batch_quantity_updates_batch(today, bus):
     bus.handle(commands.ChangeBatchQuantity(batch['ref'], 5))
     retrieved_batch = bus.handle(queries.BatchByRef(batch['ref']))
     assert retrieved_batch.qty == 5
+
+
+@pytest.mark.django_db(transaction=True)
+def test_can_query_available_to_promise_by_date(today, tomorrow, later, bus):
+    bus.handle(commands.CreateBatch('in-stock', 'sku', 10))
+    bus.handle(commands.CreateBatch('today', 'sku', 20, today))
+    bus.handle(commands.CreateBatch('later', 'sku', 30, later))
+    bus.handle(commands.Allocate('o1', 'sku', 4))
+    bus.handle(commands.ChangeBatchQuantity('today', 15))
+
+    assert bus.handle(queries.AvailableToPromise('sku', today)) == 6 + 15
+    assert bus.handle(queries.AvailableToPromise('sku', tomorrow)) == 6 + 15
+    assert bus.handle(queries.AvailableToPromise('sku')) == 6 + 15 + 30
+
+    bus.handle(commands.Deallocate('o1', 'sku', 4))
+    assert bus.handle(queries.AvailableToPromise('sku')) == 10 + 15 + 30
+
+
+def test_nothing_is_available_to_promise_for_unknown_sku(bus):
+    assert bus.handle(queries.AvailableToPromise('unknown')) == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_free_capacity_tracks_allocations(redis_repo, bus):
+    assert redis_repo.get_free_capacity('sku') is None
+    
+    bus.handle(commands.CreateBatch('batch', 'sku', 10))
+    bus.handle(commands.Allocate('o1', 'sku', 10))
+    assert redis_repo.get_free_capacity('sku') == 0
+    
+    with pytest.raises(exceptions.OutOfStock):
+        bus.handle(commands.Allocate('o2', 'sku', 1))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_untracked_skus_are_left_untracked(redis_client, redis_repo, bus):
+    bus.handle(commands.CreateBatch('b1', 'sku', 10))
+    # as written before the totals were tracked
+    redis_client.delete('atp:sku', 'atp:sku:free')
+    
+    bus.handle(commands.Allocate('o1', 'sku', 5))
+    bus.handle(commands.CreateBatch('b2', 'sku', 3))
+    assert redis_repo.get_free_capacity('sku') is None
+    
+    assert bus.handle(commands.Allocate('o2', 'sku', 5))[-1] == 'b1'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_batch_version_is_bumped_on_each_change(bus):
+    assert bus.handle(queries.BatchVersion('batch')) is None
+    
+    bus.handle(commands.CreateBatch('batch', 'sku', 10))
+    created = bus.handle(queries.BatchVersion('batch'))
+    bus.handle(commands.ChangeBatchQuantity('batch', 5))
+    
+    assert bus.handle(queries.BatchVersion('batch')) > created
+
+
+@pytest.mark.django_db(transaction=True)
+def test_allocations_for_order_version_is_bumped_on_each_change(bus):
+    assert bus.handle(queries.AllocationsForOrderVersion('o1')) is None
+    
+    bus.handle(commands.CreateBatch('batch', 'sku', 10))
+    bus.handle(commands.Allocate('o1', 'sku', 1))
+    allocated = bus.handle(queries.AllocationsForOrderVersion('o1'))
+    bus.handle(commands.Deallocate('o1', 'sku', 1))
+    
+    assert bus.handle(queries.AllocationsForOrderVersion('o1')) > allocated
+
+
+@pytest.mark.django_db(transaction=True)
+def test_can_query_many_batches_at_once(redis_repo, bus):
+    bus.handle(commands.CreateBatch('batch1', 'sku', 10))
+    bus.handle(commands.CreateBatch('batch2', 'sku', 20))
+    
+    hmget, calls = redis_repo._client.hmget, []
+    redis_repo._client.hmget = lambda *args: calls.append(args) or hmget(*args)
+    batches = bus.handle(queries.BatchesByRefs(('batch2', 'unknown', 'batch1')))
+    
+    assert len(calls) == 1
+    assert list(batches) == ['batch2', 'batch1']
+    assert batches['batch2'].qty == 20
+
+
+@pytest.mark.django_db(transaction=True)
+def test_can_query_allocations_for_many_orders_at_once(bus):
+    bus.handle(commands.CreateBatch('batch', 'sku', 10))
+    bus.handle(commands.Allocate('o1', 'sku', 1))
+    bus.handle(commands.Allocate('o2', 'sku', 1))
+    
+    allocations = bus.handle(queries.AllocationsForOrders(('o1', 'o2', 'o3')))
+    
+    assert allocations == {'o1': [{'sku': 'batch'}], 'o2': [{'sku': 'batch'}]}
+    assert bus.handle(queries.AllocationsForOrders(())) == {}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_can_page_through_batches_for_sku_in_eta_order(today, tomorrow, later, bus):
+    bus.handle(commands.CreateBatch('later', 'sku', 10, later))
+    bus.handle(commands.CreateBatch('in-stock', 'sku', 10))
+    bus.handle(commands.CreateBatch('tomorrow', 'sku', 10, tomorrow))
+    bus.handle(commands.CreateBatch('today', 'sku', 10, today))
+    bus.handle(commands.CreateBatch('other', 'other-sku', 10))
+    
+    first, after = bus.handle(queries.BatchesForSku('sku', limit=3))
+    assert [batch.ref for batch in first] == ['in-stock', 'today', 'tomorrow']
+    
+    bus.handle(commands.CreateBatch('even-later', 'sku', 10, later))
+    second, after = bus.handle(queries.BatchesForSku('sku', after, limit=3))
+    assert [batch.ref for batch in second] == ['even-later', 'later']
+    assert after is None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_batches_for_sku_reflect_quantity_changes(bus):
+    bus.handle(commands.CreateBatch('batch', 'sku', 10))
+    bus.handle(commands.ChangeBatchQuantity('batch', 5))
+    
+    batches, after = bus.handle(queries.BatchesForSku('sku'))
+    
+    assert [batch.qty for batch in batches] == [5]
+    assert after is None
+    assert bus.handle(queries.BatchesForSku('unknown')) == ([], None)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_writes_are_recorded_in_the_change_log_during_rebuilds(redis_client, bus):
+    redis_client.zadd('changes:rebuilds', {'rebuild': 0})
+    bus.handle(commands.CreateBatch('batch', 'sku', 10))
+    bus.handle(commands.Allocate('o1', 'sku', 1))
+    
+    changes = redis_client.zrange('changes', 0, -1, withscores=True)
+    
+    assert {entity for entity, _ in changes} == {'batch:batch', 'sku:sku', 'order:o1'}
+    assert changes[-1][1] == int(redis_client.get('changes:position'))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_writes_are_not_recorded_in_the_change_log_otherwise(redis_client, bus):
+    bus.handle(commands.CreateBatch('batch', 'sku', 10))
+    bus.handle(commands.Allocate('o1', 'sku', 1))
+    
+    assert redis_client.zcard('changes') == 0
+    assert redis_client.get('changes:position') is None
@@ -0,0 +1,67 @@
+"""Startup regressions, caught in a fresh interpreter run with
+`python -X importtime`: what the entrypoints import, rather than timings,
+which `benchmarks/test_startup.py` holds to a target."""
+import json
+import os
+import subprocess
+import sys
+from typing import Dict
+
+
+def imported_modules(code: str, **env) -> Dict[str, int]:
+    """Runs `code` in a fresh interpreter and returns the modules it imported
+    with their cumulative import time in microseconds, 0 for those imported
+    through `importlib` (e.g. Django apps), which `-X importtime` misses."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         f'{code}\nimport json, sys; print(json.dumps(list(sys.modules)))'],
+        env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path), **env},
+        capture_output=True, text=True, check=True,
+    )
+    modules = dict.fromkeys(json.loads(result.stdout.splitlines()[-1]), 0)
+
+    # `import time: self [us] | cumulative | <indent>module`
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('package'):
+            _, cumulative, module = line.split('|')
+            modules[module.strip()] = int(cumulative)
+
+    return modules
+
+
+def test_importing_the_consumer_does_not_set_django_up():
+    modules = imported_modules('import allocation.entrypoints.redis_consumer')
+    
+    assert 'dddjango.alloc.models' not in modules
+    assert 'django.db.models' not in modules
+
+
+def test_importing_the_consumer_does_not_configure_logging():
+    # `imported_modules` fails on the assertion failing
+    imported_modules('import allocation.entrypoints.redis_consumer\n'
+                     'from allocation import config\n'
+                     'assert config._listener is None')
+
+
+def test_consumer_setup_imports_only_the_allocation_app():
+    modules = imported_modules(
+        'from allocation.entrypoints import redis_consumer; redis_consumer.setup()',
+        DJANGO_SETTINGS_MODULE='dddjango.dddjango.consumer_settings',
+    )
+    
+    assert 'dddjango.alloc.models' in modules
+    assert 'django.contrib.auth.models' not in modules
+    assert 'django.contrib.admin' not in modules
+
+
+def test_bootstrapper_imports_redis_adapters_on_first_use():
+    modules = imported_modules(
+        'import django; django.setup(); '
+        'from allocation.orchestration import bootstrapper',
+        DJANGO_SETTINGS_MODULE='dddjango.dddjango.settings',
+    )
+    
+    assert 'allocation.orchestration.bootstrapper' in modules
+    assert 'allocation.adapters.redis_query_repository' not in modules
+    assert 'redis' not in modules
+    assert 'numpy' not in modules
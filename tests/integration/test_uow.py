@@ -1,3 +1,4 @@
+from django.db import transaction
 from allocation.domain.exceptions import InvalidSKU
 from allocation.orchestration.uow import DjangoUoW
 from dddjango.alloc import models as orm
@@ -77,6 +78,27 @@ def test_uow_rollbacks_on_error():
     assert retrieve_batch_from_db('batch') is None
 
 
+@pytest.mark.django_db(transaction=True)
+def test_uow_within_an_atomic_block_rolls_back_only_its_own_changes():
+    with transaction.atomic():
+        insert_product_into_db('skew')
+        with DjangoUoW():
+            insert_product_into_db('other')
+
+    assert orm.Product.objects.filter(sku='skew').exists()
+    assert not orm.Product.objects.filter(sku='other').exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_uow_leaves_the_connection_in_autocommit_mode():
+    with DjangoUoW() as uow:
+        uow.products.add(domain_.Product('skew'))
+        uow.commit()
+
+    assert transaction.get_autocommit()
+    assert orm.Product.objects.filter(sku='skew').exists()
+
+
 def insert_product_into_db(sku) -> orm.Product:
     return orm.Product.objects.create(sku=sku)
 
@@ -98,6 +120,9 @@ def insert_batch_into_db(ref, product: orm.Product, qty, eta=None) -> orm.Batch:
 
 
 def insert_allocation_into_db(batch, order_id, sku, qty) -> orm.Allocation:
+    # done by `DjangoRepository` outside of tests
+    batch.allocated_qty += qty
+    batch.save()
     return orm.Allocation.objects.create(
         batch=batch,
         order_id=order_id,
@@ -1,3 +1,4 @@
+import pickle
 from allocation.domain.model import Batch, OrderLine
 from allocation.domain.exceptions import (
     CannotOverallocateError, LineIsNotAllocatedError, SKUsDontMatchError)
@@ -67,6 +68,70 @@ class TestBatchDeallocation:
             batch.deallocate(order_line)
 
 
+class TestBatchWithLazyAllocations:
+
+    def test_uses_allocated_qty_without_loading_lines(self):
+        loader = LinesLoader([OrderLine('o1', 'sku', 3)])
+        batch = Batch.with_lazy_allocations('batch', 'sku', 10, None, 3, loader)
+        batch.allocate(OrderLine('o2', 'sku', 5))
+        
+        assert batch.available_qty == 2
+        assert not batch.can_allocate(OrderLine('o3', 'sku', 3))
+        assert loader.calls == 0
+        assert not batch.allocations_loaded
+        assert batch.pending_allocations == [OrderLine('o2', 'sku', 5)]
+
+
+    def test_loads_lines_once_when_needed(self):
+        line = OrderLine('o1', 'sku', 3)
+        loader = LinesLoader([line])
+        batch = Batch.with_lazy_allocations('batch', 'sku', 10, None, 3, loader)
+        batch.allocate(OrderLine('o2', 'sku', 5))
+        batch.deallocate(line)
+
+        assert batch.allocations == [OrderLine('o2', 'sku', 5)]
+        assert batch.available_qty == 5
+        assert loader.calls == 1
+        assert batch.pending_allocations == []
+
+
+class TestBatchPickling:
+
+    def test_lazy_batch_is_pickled_with_its_lines(self):
+        line = OrderLine('o1', 'sku', 3)
+        batch = Batch.with_lazy_allocations(
+            'batch', 'sku', 10, None, 3, LinesLoader([line])
+        )
+        unpickled = pickle.loads(pickle.dumps(batch))
+
+        assert unpickled.allocations == [line]
+        assert unpickled.available_qty == 7
+
+
+    def test_can_unpickle_state_from_before_slots(self):
+        batch = Batch.__new__(Batch)
+        # the `__dict__` of a batch pickled by an older release
+        batch.__setstate__(
+            {'ref': 'batch', 'sku': 'sku', '_qty': 10, 'eta': None,
+             '_allocations': {OrderLine('o1', 'sku', 3)}}
+        )
+
+        assert batch.available_qty == 7
+        assert batch.can_allocate(OrderLine('o2', 'sku', 7))
+
+
+class LinesLoader:
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.calls = 0
+
+
+    def __call__(self):
+        self.calls += 1
+        return list(self.lines)
+
+
 def create_batch_and_order_line(batch_qty, order_line_qty):
     dummy_sku = 'product_000'
     
@@ -0,0 +1,25 @@
+import random
+import pytest
+from allocation.domain.capacity import FreeCapacityIndex
+from allocation.domain.model import Batch, OrderLine
+
+
+@pytest.mark.parametrize('n_batches', [1, 2, 7, 16, 33])
+def test_covering_matches_a_linear_scan(n_batches):
+    rng = random.Random(n_batches)
+    batches = [Batch(f'b{i}', 'sku', rng.randint(0, 9)) for i in range(n_batches)]
+    index = FreeCapacityIndex(batches)
+    
+    for i in range(100):
+        batch = rng.choice(batches)
+        if batch.available_qty:
+            batch.allocate(OrderLine(f'o{i}', 'sku', rng.randint(1, batch.available_qty)))
+            index.update(batch)
+        
+        qty = rng.randint(1, 10 * n_batches)
+        free = [b.available_qty for b in batches]
+        expected = next((k + 1 for k in range(n_batches) if sum(free[:k + 1]) >= qty),
+                        None)
+        
+        assert index.total() == sum(free)
+        assert index.covering(qty) == expected
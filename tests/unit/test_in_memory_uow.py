@@ -0,0 +1,153 @@
+import pytest
+from allocation.domain import model as domain_
+from allocation.domain.exceptions import (
+    InexistentProduct, InvalidSKU, LineIsAlreadyAllocatedError,
+    OrderHasNoAllocations,
+)
+from allocation.orchestration.uow import InMemoryUoW
+
+
+@pytest.fixture
+def uow():
+    product = domain_.Product('skew', [domain_.Batch('batch', 'skew', 10)])
+    product.allocate('o1', 'skew', 1)
+    return InMemoryUoW([product])
+
+
+def test_uow_can_add_a_product_and_a_batch(uow):
+    with uow:
+        uow.products.add(domain_.Product('other'))
+        uow.products.get('other').add_batch('other-batch', 'other', 5)
+        uow.commit()
+
+    with uow:
+        product = uow.products.get_by_batch_ref('other-batch')
+        assert product.sku == 'other'
+        assert product.batches[0].available_qty == 5
+
+
+def test_uow_can_allocate_and_deallocate_lines(uow):
+    with uow:
+        uow.products.get('skew').allocate('o2', 'skew', 2)
+        uow.commit()
+
+    with uow:
+        batch = uow.products.get('skew').batches[0]
+        # lines are only loaded when needed
+        assert not batch.allocations_loaded
+        assert batch.allocated_qty == 3
+        batch.deallocate(domain_.OrderLine('o1', 'skew', 1))
+        uow.commit()
+
+    with uow:
+        batch = uow.products.get('skew').batches[0]
+        assert batch.allocations == [domain_.OrderLine('o2', 'skew', 2)]
+        assert batch.allocated_qty == 2
+
+
+def test_uow_does_not_commit_implicitly(uow):
+    with uow:
+        uow.products.add(domain_.Product('other'))
+        uow.products.get('skew').allocate('o2', 'skew', 2)
+
+    with uow:
+        with pytest.raises(InexistentProduct):
+            uow.products.get('other')
+        assert uow.products.get('skew').batches[0].allocated_qty == 1
+
+
+def test_uow_rollbacks_on_error(uow):
+    with pytest.raises(InvalidSKU):
+        with uow:
+            product = uow.products.get('skew')
+            product.add_batch('other-batch', 'skew', 10)
+            product.allocate('o2', 'invalid_sku', 1)
+            uow.commit()
+
+    with uow:
+        assert uow.products.get_by_batch_ref('other-batch') is None
+
+
+def test_uow_keeps_messages_of_a_rolled_back_block(uow):
+    with uow:
+        uow.products.get('skew').add_batch('other-batch', 'skew', 10)
+        uow.rollback()
+
+    assert [type(message).__name__
+            for message in uow.collect_new_messages()] == ['BatchCreated']
+
+
+def test_uow_rejects_a_line_already_allocated_to_the_batch(uow):
+    with uow:
+        uow.products.get('skew').allocate('o1', 'skew', 2)
+        with pytest.raises(LineIsAlreadyAllocatedError):
+            uow.commit()
+
+    with uow:
+        assert uow.products.get('skew').batches[0].allocated_qty == 1
+
+
+def test_uow_rejects_a_line_already_allocated_to_another_batch(uow):
+    with uow:
+        product = uow.products.get('skew')
+        product.add_batch('other-batch', 'skew', 10)
+        product.batches[1].allocate(domain_.OrderLine('o1', 'skew', 1))
+        with pytest.raises(LineIsAlreadyAllocatedError):
+            uow.commit()
+
+
+def test_uow_moves_a_part_to_a_batch_holding_another_part(uow):
+    with uow:
+        uow.products.add(domain_.Product('other', [
+            domain_.Batch('b1', 'other', 3), domain_.Batch('b2', 'other', 6)
+        ]))
+        uow.products.get('other').allocate_split('o1', 'other', 8)
+        uow.commit()
+
+    with uow:
+        product = uow.products.get('other')
+        product.change_batch_quantity('b2', 9)
+        product.change_batch_quantity('b1', 1)
+        uow.commit()
+
+    with uow:
+        assert uow.products.get('other').allocate('o1', 'other', 3, part=0) == 'b2'
+        uow.commit()
+
+    with uow:
+        b1, b2 = uow.products.get('other').batches
+        assert b1.allocations == []
+        assert sorted(line.part for line in b2.allocations) == [0, 1]
+        assert b2.allocated_qty == 8
+
+
+def test_repository_restores_a_snapshot(uow):
+    snapshot = uow.products.snapshot()
+
+    for _ in range(2):
+        with uow:
+            uow.products.get('skew').allocate('o2', 'skew', 9)
+            uow.commit()
+        
+        uow.products.restore(snapshot)
+        
+        with uow:
+            batch = uow.products.get('skew').batches[0]
+            assert batch.available_qty == 9
+            assert batch.allocations == [domain_.OrderLine('o1', 'skew', 1)]
+
+
+def test_allocations_for_order_are_read_without_loading_products(uow):
+    with uow:
+        uow.products.add(domain_.Product('other',
+                                         [domain_.Batch('b2', 'other', 5)]))
+        uow.products.get('other').allocate('o1', 'other', 1)
+        uow.commit()
+
+    with uow:
+        assert uow.products.get_allocations_for_order('o1') == [
+            {'skew': 'batch'}, {'other': 'b2'}
+        ]
+        assert not uow.products.seen
+        with pytest.raises(OrderHasNoAllocations):
+            uow.products.get_allocations_for_order('o2')
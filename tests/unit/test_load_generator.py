@@ -0,0 +1,123 @@
+from collections import Counter
+import random
+import pytest
+from allocation.entrypoints import load_generator as lg
+
+
+class FakeTarget(lg.AbstractTarget):
+    """Accepts allocations while the SKU has stock left, like the real thing."""
+
+    def __init__(self, stock_per_sku: int) -> None:
+        self.sent = []
+        self._stock = Counter()
+        self._stock_per_sku = stock_per_sku
+
+
+    def send(self, operation: lg.Operation) -> str:
+        self.sent.append(operation)
+        sku = operation.payload.get('sku')
+
+        if operation.kind == lg.ALLOCATE:
+            if self._stock[sku] + operation.payload['qty'] > self._stock_per_sku:
+                return lg.OUT_OF_STOCK
+            self._stock[sku] += operation.payload['qty']
+        
+        elif operation.kind == lg.DEALLOCATE:
+            self._stock[sku] -= operation.payload['qty']
+        
+        return lg.OK
+
+
+@pytest.fixture
+def profile():
+    return lg.LoadProfile(skus=10, batches_per_sku=2, batch_qty=10,
+                          requests=500, burst_size=5, seed=42)
+
+
+def test_zipf_sampler_favours_lower_ranks():
+    sampler = lg.ZipfSampler(50, 1.2, random.Random(1))
+    counts = Counter(sampler.sample() for _ in range(10_000))
+    
+    assert set(counts) <= set(range(50))
+    assert counts[0] > counts[1] > counts[10]
+
+
+def test_setup_creates_every_batch(profile):
+    operations = lg.TrafficGenerator(profile).setup_operations()
+    
+    assert len(operations) == profile.skus * profile.batches_per_sku
+    assert {op.kind for op in operations} == {lg.CREATE_BATCH}
+
+
+def test_runs_use_distinct_ids(profile):
+    first = lg.TrafficGenerator(profile).setup_operations()
+    second = lg.TrafficGenerator(
+        lg.LoadProfile(skus=10, batches_per_sku=2, seed=42)
+    ).setup_operations()
+
+    assert not {op.payload['ref'] for op in first} \
+        & {op.payload['ref'] for op in second}
+    assert all(op.payload['sku'].startswith(f'load-{profile.run_id}-')
+               for op in first)
+
+
+def test_traffic_emits_the_requested_number_of_operations(profile):
+    operations = list(lg.TrafficGenerator(profile).traffic())
+    
+    assert len(operations) == profile.requests
+    assert {op.kind for op in operations} <= set(profile.mix)
+
+
+def test_deallocations_only_target_allocated_lines(profile):
+    generator = lg.TrafficGenerator(profile)
+    allocated = set()
+
+    for operation in generator.traffic():
+        key = (operation.payload.get('order_id'), operation.payload.get('sku'))
+        
+        if operation.kind == lg.ALLOCATE:
+            generator.record_allocation(operation.payload)
+            allocated.add(key)
+        
+        elif operation.kind == lg.DEALLOCATE:
+            assert key in allocated
+            allocated.remove(key)
+
+
+def test_runner_reports_throughput_and_out_of_stock_rate(profile):
+    target = FakeTarget(stock_per_sku=20)
+    report = lg.LoadRunner(target, lg.TrafficGenerator(profile),
+                           concurrency=4).run()
+    setup_ops = profile.skus * profile.batches_per_sku
+
+    assert report.total == profile.requests
+    assert report.setup.total == setup_ops
+    assert len(target.sent) == profile.requests + setup_ops
+    assert report.count(lg.CREATE_BATCH, lg.OK) == 0
+    assert report.throughput == report.total / report.elapsed
+    assert 0 < report.out_of_stock_rate() < 1
+    assert 'out of stock rate' in report.render()
+
+
+def test_timeouts_and_lost_lines_are_counted_apart_from_latencies():
+    report = lg.LoadReport()
+    report.record(lg.DEALLOCATE, lg.OK, 0.001)
+    report.record(lg.DEALLOCATE, lg.TIMEOUT, 10)
+    report.record(lg.DEALLOCATE, lg.LOST, 0)
+
+    assert report.percentile(lg.DEALLOCATE, 99) == 0.001
+    assert report.count(lg.DEALLOCATE, lg.TIMEOUT) == 1
+    assert report.render().splitlines()[-1].split()[1:5] == ['3', '0', '1', '1']
+
+
+@pytest.mark.parametrize(
+    ('values', 'p', 'expected'),
+    [
+        ([], 50, 0.0),
+        ([3.0], 99, 3.0),
+        ([1.0, 2.0, 3.0, 4.0], 50, 2.0),
+        (list(range(1, 101)), 99, 99),
+    ]
+)
+def test_percentile(values, p, expected):
+    assert lg.percentile(values, p) == expected
@@ -0,0 +1,75 @@
+import json
+import os
+import pytest
+from allocation import config
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    config.shutdown_logging()
+    yield tmp_path / 'logs.log'
+    config.shutdown_logging()
+
+
+def read_records(log_file):
+    config.shutdown_logging()  # flushes the queue
+    return [json.loads(line) for line in log_file.read_text().splitlines()]
+
+
+def test_writes_json_records(log_file):
+    config.configure_logging(filename=str(log_file))
+    config.get_logger('allocation.tests').info('hello %s', 'world')
+    [record] = read_records(log_file)
+    
+    assert record['message'] == 'hello world'
+    assert record['level'] == 'INFO'
+    assert record['logger'] == 'allocation.tests'
+
+
+def test_records_exceptions(log_file):
+    config.configure_logging(filename=str(log_file))
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        config.get_logger('allocation.tests').exception('failed')
+    [record] = read_records(log_file)
+    
+    assert 'ValueError: boom' in record['exception']
+
+
+def test_samples_debug_records_only(log_file):
+    config.configure_logging(filename=str(log_file), debug_sample_rate=0)
+    logger = config.get_logger('allocation.tests')
+    logger.debug('dropped')
+    logger.warning('kept')
+    
+    assert [r['message'] for r in read_records(log_file)] == ['kept']
+
+
+def test_configures_only_once(log_file, tmp_path):
+    config.configure_logging(filename=str(log_file))
+    config.configure_logging(filename=str(tmp_path / 'other.log'))
+    config.get_logger('allocation.tests').info('once')
+    
+    assert len(read_records(log_file)) == 1
+    assert not (tmp_path / 'other.log').exists()
+
+
+def test_logger_defaults_to_callers_module_under_namespace(log_file):
+    assert config.get_logger().name == f'allocation.{__name__}'
+    assert config.get_logger('allocation.x').name == 'allocation.x'
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_forked_children_log_through_a_pipeline_of_their_own(log_file):
+    config.configure_logging(filename=str(log_file))
+    config.get_logger('allocation.tests').info('parent')
+    
+    pid = os.fork()
+    if pid == 0:
+        config.get_logger('allocation.tests').info('child')
+        config.shutdown_logging()
+        os._exit(0)
+    
+    os.waitpid(pid, 0)
+    assert sorted(r['message'] for r in read_records(log_file)) == ['child', 'parent']
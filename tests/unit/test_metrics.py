@@ -0,0 +1,39 @@
+from allocation.adapters.metrics import PrometheusMetrics, StatsDMetrics
+
+
+def test_prometheus_renders_counters():
+    metrics = PrometheusMetrics()
+    metrics.increment('bus_messages_total', tags={'message': 'Allocate'})
+    metrics.increment('bus_messages_total', tags={'message': 'Allocate'})
+    
+    assert 'bus_messages_total{message="Allocate"} 2' in metrics.render()
+
+
+def test_prometheus_renders_cumulative_histogram_buckets():
+    metrics = PrometheusMetrics(buckets={'latency': (0.1, 1)})
+    metrics.observe('latency', 0.05)
+    metrics.observe('latency', 0.5)
+    metrics.observe('latency', 5)
+    rendered = metrics.render().splitlines()
+    
+    assert 'latency_bucket{le="0.1"} 1' in rendered
+    assert 'latency_bucket{le="1"} 2' in rendered
+    assert 'latency_bucket{le="+Inf"} 3' in rendered
+    assert 'latency_sum 5.55' in rendered
+    assert 'latency_count 3' in rendered
+
+
+def test_prometheus_escapes_label_values():
+    metrics = PrometheusMetrics()
+    metrics.increment('errors', tags={'error': 'say "hi"'})
+    
+    assert r'errors{error="say \"hi\""} 1' in metrics.render()
+
+
+def test_statsd_line_format():
+    metrics = StatsDMetrics('localhost', 8125, prefix='alloc')
+    line = metrics.format('bus_handler_seconds', 0.25, 'h',
+                          {'message': 'Allocate', 'handler': 'handlers.allocate'})
+    
+    assert line == 'alloc.bus_handler_seconds:0.25|h' \
+                   '|#handler:handlers.allocate,message:Allocate'
@@ -1,10 +1,11 @@
 from typing import List, Optional
 import pytest
+from allocation.adapters.metrics import InMemoryMetrics
 from allocation.domain import commands, events
 from allocation.domain.exceptions import (
     InexistentProduct, LineIsNotAllocatedError, OutOfStock
 )
-from allocation.domain.model import Product
+from allocation.domain.model import Batch, Product
 from allocation.domain.ports import (
     AbstractPublisher, AbstractQueryRepository, AbstractWriteRepository
 )
@@ -56,6 +57,16 @@ class FakeWriteRepository(AbstractWriteRepository):
             )
 
 
+        def get_allocations_for_order(self, order_id):
+            return [
+                {line.sku: batch.ref}
+                for product in self._products
+                for batch in product.batches
+                for line in batch.allocations
+                if line.order_id == order_id
+            ]
+
+
 class FakeQueryRepo(AbstractQueryRepository):
     def add_batch(self, *args, **kwargs): ...
     def get_batch(self, *args, **kwargs): ...
@@ -66,6 +77,14 @@ class FakeQueryRepo(AbstractQueryRepository):
     def add_allocation_for_order(self, *args, **kwargs): ...
     def get_allocations_for_order(self, *args, **kwargs): ...
     def remove_allocation_for_order(self, *args, **kwargs): ...
+    def change_available_to_promise(self, *args, **kwargs): ...
+    def get_batches(self, *args, **kwargs): ...
+    def get_allocations_for_orders(self, *args, **kwargs): ...
+    def get_batches_for_sku(self, *args, **kwargs): ...
+    def get_batch_version(self, *args, **kwargs): ...
+    def get_allocations_for_order_version(self, *args, **kwargs): ...
+    def get_free_capacity(self, *args, **kwargs): ...
+    def get_available_to_promise(self, *args, **kwargs): ...
 
 
 class FakePublisher(AbstractPublisher):
@@ -78,6 +97,7 @@ class FakeProductUoW(AbstractUnitOfWork):
                 self,
                 repo: AbstractWriteRepository,
         ) -> None:
+            super().__init__()
             self._products = repo
             self._commited = False
             self.collected_messages = []
@@ -203,6 +223,106 @@ class TestOrchestrationAllocate:
         assert uow.commited is False
     
 
+class FreeCapacityQueryRepo(FakeQueryRepo):
+    """Read model reporting a fixed free quantity per SKU."""
+
+    def __init__(self, free_capacity) -> None:
+        self._free_capacity = free_capacity
+    
+
+    def get_free_capacity(self, sku):
+        return self._free_capacity.get(sku)
+
+
+class TestOrchestrationOutOfStockFastPath:
+
+    @pytest.fixture
+    def metrics(self):
+        return InMemoryMetrics()
+
+
+    def bus(self, uow, metrics, free_capacity):
+        return bootstrapper.bootstrap(
+            uow=uow,
+            publisher=FakePublisher(),
+            query_repository=FreeCapacityQueryRepo(free_capacity),
+            metrics=metrics,
+        )
+
+
+    @pytest.mark.parametrize('command', [commands.Allocate, commands.AllocateSplit])
+    def test_rejects_lines_without_loading_the_product(
+        self, batch, uow, metrics, command
+    ):
+        # the product has stock, but the read model says it is sold out
+        uow.products.add(Product('skew', [Batch(*batch)]))
+        bus = self.bus(uow, metrics, {'skew': 0})
+
+        with pytest.raises(OutOfStock):
+            bus.handle(command('o1', 'skew', 1))
+        
+        assert not uow.products.seen
+        assert metrics.counter('allocate_fast_rejections_total') == 1
+        assert len(metrics.observed('bus_handler_seconds',
+                                    message='OutOfStock',
+                                    handler='handlers.publish_event')) == 1
+
+
+    @pytest.mark.parametrize('free_capacity', [None, -5])
+    def test_untracked_or_negative_totals_take_the_full_path(
+        self, batch, uow, metrics, free_capacity
+    ):
+        uow.products.add(Product('skew', [Batch(*batch)]))
+        bus = self.bus(uow, metrics, {'skew': free_capacity})
+
+        results = bus.handle(commands.Allocate('o1', 'skew', 1))
+        assert results[-1] == 'batch'
+        assert metrics.counter('allocate_fast_rejections_total') == 0
+
+
+    def test_allocates_when_the_read_model_has_enough(self, batch, uow, metrics):
+        uow.products.add(Product('skew', [Batch(*batch)]))
+        bus = self.bus(uow, metrics, {'skew': 1})
+
+        results = bus.handle(commands.Allocate('o1', 'skew', 1))
+        assert results[-1] == 'batch'
+        assert metrics.counter('allocate_fast_rejections_total') == 0
+
+
+class TestOrchestrationAllocateSplit:
+
+    def test_allocate_split_returns_parts_and_commits(self, today, later, uow, bus):
+        bus.handle(commands.CreateBatch('earlier', 'skew', 2, today))
+        bus.handle(commands.CreateBatch('later', 'skew', 2, later))
+        
+        results = bus.handle(commands.AllocateSplit('o1', 'skew', 3))
+        assert results[-1] == [('earlier', 2), ('later', 1)]
+        assert uow.commited is True
+
+
+class TestOrchestrationAllocateWave:
+
+    def test_allocate_wave_returns_batch_refs_and_commits(self, today, later, uow, bus):
+        bus.handle(commands.CreateBatch('earlier', 'skew', 2, today))
+        bus.handle(commands.CreateBatch('later', 'skew', 10, later))
+        wave = (('o1', 1), ('o2', 2), ('o3', 1))
+        
+        results = bus.handle(commands.AllocateWave('skew', wave))
+        assert results[-1] == ['earlier', 'later', 'earlier']
+        assert uow.commited is True
+        assert uow.products.get(sku='skew').batches[0].available_qty == 0
+
+
+class TestOrchestrationChangeAllocationStrategy:
+
+    def test_can_change_allocation_strategy(self, batch, uow, bus):
+        bus.handle(commands.CreateBatch(*batch))
+        bus.handle(commands.ChangeAllocationStrategy('skew', 'best_fit'))
+        
+        assert uow.products.get(sku='skew').allocation_strategy == 'best_fit'
+        assert uow.commited is True
+
+
 class TestOrchestrationDeallocate:
 
     def test_deallocate_returns_batch_ref(self, bus):
@@ -279,3 +399,52 @@ class TestOrchestrationChangeBatchQuantity:
         assert batch1.qty == 5
         assert batch1.available_qty == 5
         assert batch2.allocated_qty == 10
+
+
+class TestOrchestrationMetrics:
+
+    @pytest.fixture
+    def metrics(self):
+        return InMemoryMetrics()
+
+
+    @pytest.fixture
+    def bus(self, uow, metrics):
+        return bootstrapper.bootstrap(
+            uow=uow,
+            publisher=FakePublisher(),
+            query_repository=FakeQueryRepo(),
+            metrics=metrics,
+        )
+
+
+    def test_records_latency_per_message_and_handler(self, batch, bus, metrics):
+        bus.handle(commands.CreateBatch(*batch))
+        
+        assert metrics.counter('bus_messages_total', message='CreateBatch') == 1
+        assert metrics.counter('bus_messages_total', message='BatchCreated') == 1
+        assert len(metrics.observed('bus_handler_seconds',
+                                    message='CreateBatch',
+                                    handler='handlers.add_batch')) == 1
+        assert len(metrics.observed('bus_handler_seconds',
+                                    message='BatchCreated',
+                                    handler='query_handlers.add_batch')) == 1
+    
+
+    def test_records_queue_depth_and_commit_time(self, batch, bus, metrics):
+        bus.handle(commands.CreateBatch(*batch))
+        
+        assert metrics.observed('bus_queue_depth') == [1]
+        assert len(metrics.observed('uow_commit_seconds')) == 1
+
+
+    def test_counts_handler_errors(self, batch, bus, metrics):
+        bus.handle(commands.CreateBatch(*batch))
+        
+        with pytest.raises(OutOfStock):
+            bus.handle(commands.Allocate('o1', 'skew', 1_000))
+        
+        assert metrics.counter('bus_handler_errors_total',
+                               message='Allocate',
+                               handler='handlers.allocate',
+                               error='OutOfStock') == 1
@@ -1,6 +1,9 @@
+import random
 from allocation.domain import commands, events
 from allocation.domain.model import Batch, OrderLine, Product
-from allocation.domain.exceptions import InvalidSKU, LineIsNotAllocatedError, OutOfStock
+from allocation.domain.exceptions import (
+    InvalidAllocationStrategy, InvalidSKU, LineIsNotAllocatedError, OutOfStock
+)
 import pytest
 
 
@@ -44,6 +47,174 @@ class TestProductAllocation:
         assert batch_ref == earliest_batch.ref
 
 
+class TestProductWaveAllocation:
+
+    @pytest.mark.parametrize('seed', range(5))
+    def test_wave_matches_allocating_lines_one_by_one(self, seed, today):
+        rng = random.Random(seed)
+        etas = [None, today, today, None, today]
+        # long runs of equal qty as well as a mix, enough to run out of stock
+        lines = [(f'o{i}', rng.choice([1, 1, 1, 2, 5])) for i in range(120)]
+        
+        def new_product():
+            return Product('skew', [Batch(f'b{i}', 'skew', 20 + 7 * i, eta)
+                                    for i, eta in enumerate(etas)])
+        
+        sequential = new_product()
+        sequential_refs = []
+        for order_id, qty in lines:
+            try:
+                sequential_refs.append(sequential.allocate(order_id, 'skew', qty))
+            except OutOfStock:
+                sequential_refs.append(None)
+        
+        wave = new_product()
+        
+        assert wave.allocate_wave('skew', lines) == sequential_refs
+        assert wave.messages == sequential.messages
+        assert None in sequential_refs
+        for batch, expected in zip(wave.batches, sequential.batches):
+            assert set(batch.allocations) == set(expected.allocations)
+
+
+    def test_wave_raises_error_for_invalid_sku(self):
+        product = Product('skew', [Batch('batch', 'skew', 10)])
+
+        with pytest.raises(InvalidSKU):
+            product.allocate_wave('invalid_skew', [('o1', 1)])
+
+
+class TestProductAllocationStrategies:
+
+    def test_best_fit_picks_the_smallest_batch_the_line_fits(self, today, tomorrow):
+        sku = 'skew'
+        big_batch = Batch('big', sku, 10, eta=None)
+        tight_batch = Batch('tight', sku, 3, eta=tomorrow)
+        small_batch = Batch('small', sku, 2, eta=today)
+        product = Product(sku, [big_batch, tight_batch, small_batch], 'best_fit')
+
+        assert product.allocate('o1', sku, 3) == tight_batch.ref
+
+
+    def test_best_fit_avoids_out_of_stock_from_fragmentation(self):
+        sku = 'skew'
+        lines = [('o1', sku, 3), ('o2', sku, 10)]
+        
+        def allocate_all(strategy):
+            product = Product(sku, [Batch('big', sku, 10), Batch('small', sku, 5)],
+                              strategy)
+            for line in lines:
+                product.allocate(*line)
+        
+        with pytest.raises(OutOfStock):
+            allocate_all('earliest_eta')
+        allocate_all('best_fit')
+
+
+    @pytest.mark.parametrize('seed', range(3))
+    def test_best_fit_index_follows_allocations_and_deallocations(self, seed):
+        rng = random.Random(seed)
+        sku = 'skew'
+        product = Product(sku, [Batch(f'b{i}', sku, rng.randint(5, 30))
+                                for i in range(8)], 'best_fit')
+        allocated = []
+        
+        for i in range(200):
+            if allocated and rng.random() < 0.3:
+                product.deallocate(*allocated.pop(rng.randrange(len(allocated))))
+                continue
+            
+            line = (f'o{i}', sku, rng.randint(1, 6))
+            available = {b.ref: b.available_qty for b in product.batches}
+            best_fit = min((qty for qty in available.values() if qty >= line[2]),
+                           default=None)
+            
+            try:
+                batch_ref = product.allocate(*line)
+            except OutOfStock:
+                assert best_fit is None
+                continue
+            
+            assert available[batch_ref] == best_fit
+            allocated.append(line)
+
+
+    def test_change_allocation_strategy_message(self):
+        product = Product('skew')
+        product.change_allocation_strategy('best_fit')
+
+        assert product.allocation_strategy == 'best_fit'
+        assert product.messages[-1] == events.AllocationStrategyChanged('skew', 'best_fit')
+
+
+    def test_cannot_use_inexistent_strategy(self):
+        with pytest.raises(InvalidAllocationStrategy):
+            Product('skew', allocation_strategy='fefo')
+
+
+class TestProductSplitAllocation:
+
+    def test_uses_a_single_batch_when_one_fits(self, tomorrow):
+        sku = 'skew'
+        product = Product(sku, [Batch('small', sku, 3), Batch('big', sku, 10, tomorrow)])
+        
+        assert product.allocate_split('o1', sku, 5) == [('big', 5)]
+        assert product.messages[-1] == events.LineAllocated('o1', sku, 5, 'big')
+
+
+    def test_splits_line_across_batches_in_eta_order(self, today, tomorrow):
+        sku = 'skew'
+        later_batch = Batch('later', sku, 4, tomorrow)
+        earlier_batch = Batch('earlier', sku, 3, today)
+        product = Product(sku, [later_batch, earlier_batch, Batch('stock', sku, 2)])
+        
+        parts = product.allocate_split('o1', sku, 7)
+        assert parts == [('stock', 2), ('earlier', 3), ('later', 2)]
+        assert product.messages == [
+            events.LineSplitAllocated('o1', sku, 7, tuple(parts))
+        ]
+        assert later_batch.available_qty == 2
+
+
+    def test_out_of_stock_when_batches_hold_too_little_together(self):
+        sku = 'skew'
+        product = Product(sku, [Batch('b1', sku, 3), Batch('b2', sku, 3)])
+        
+        with pytest.raises(OutOfStock):
+            product.allocate_split('o1', sku, 7)
+        assert product.messages == [events.OutOfStock(sku, 'o1')]
+        assert [b.available_qty for b in product.batches] == [3, 3]
+
+
+    def test_deallocating_a_split_line_frees_every_part(self):
+        sku = 'skew'
+        product = Product(sku, [Batch('b1', sku, 3), Batch('b2', sku, 3)])
+        product.allocate_split('o1', sku, 5)
+        
+        assert product.deallocate('o1', sku, 5) == 'b1'
+        assert [b.available_qty for b in product.batches] == [3, 3]
+        assert product.messages[-2:] == [
+            events.LineDeallocated('o1', sku, 3, 'b1', part=0),
+            events.LineDeallocated('o1', sku, 2, 'b2', part=1),
+        ]
+
+
+    def test_a_part_of_a_split_line_is_reallocated_as_that_part(self):
+        sku = 'skew'
+        product = Product(sku, [Batch('b1', sku, 3), Batch('b2', sku, 3)])
+        product.allocate_split('o1', sku, 5)
+        
+        product.change_batch_quantity('b2', 1)
+        assert product.messages[-3:-1] == [
+            events.LineDeallocated('o1', sku, 2, 'b2', part=1),
+            commands.Reallocate('o1', sku, 2, part=1),
+        ]
+        
+        product.change_batch_quantity('b1', 5)
+        assert product.allocate('o1', sku, 2, part=1) == 'b1'
+        assert sorted(line.part for line in product.batches[0].allocations) == [0, 1]
+
+
 class TestProductDeallocation:
     
     def test_deallocate_returns_batch_ref(self):
@@ -120,7 +291,7 @@ class TestProductMessages:
             product.allocate('o1', sku, 2)
         except OutOfStock:
             pass
-        assert product.messages[-1] == events.OutOfStock(sku)
+        assert product.messages[-1] == events.OutOfStock(sku, 'o1')
     
     
     def test_batch_created_message(self, tomorrow):
@@ -1,10 +1,13 @@
 from datetime import date, timedelta
 import pytest
 
-from allocation.domain import commands
+from allocation.domain import commands, queries
 from allocation.domain.exceptions import (
-    InvalidETAFormat, InvalidQuantity, InvalidTypeForQuantity, PastETANotAllowed
+    InvalidAllocationStrategy, InvalidETAFormat, InvalidPageSize,
+    InvalidQuantity, InvalidQueryKeys, InvalidTypeForQuantity,
+    PastETANotAllowed
 )
+from allocation.domain.validators import MAX_PAGE_SIZE, MAX_QUERY_KEYS
 
 
 @pytest.mark.parametrize(
@@ -64,3 +67,43 @@ def test_cannot_set_invalid_eta(eta_value, expected_error):
 
 def test_current_day_is_a_valid_eta(today):
     commands.CreateBatch('foo', 'bar', 1, today)
+
+
+def test_iso_eta_is_converted_to_a_date(tomorrow):
+    batch = commands.CreateBatch('foo', 'bar', 1, tomorrow.isoformat())
+    assert batch.eta == tomorrow
+
+
+@pytest.mark.parametrize(
+    ('qty_value', 'expected_error'),
+    [
+        ('a', InvalidTypeForQuantity),
+        (0, InvalidQuantity),
+        (-1, InvalidQuantity),
+    ]
+)
+def test_cannot_allocate_wave_with_invalid_quantity(qty_value, expected_error):
+    with pytest.raises(expected_error):
+        commands.AllocateWave('sku', (('o1', 1), ('o2', qty_value)))
+
+
+def test_cannot_change_to_inexistent_allocation_strategy():
+    with pytest.raises(InvalidAllocationStrategy):
+        commands.ChangeAllocationStrategy('sku', 'fefo')
+
+
+@pytest.mark.parametrize('query', [queries.BatchesByRefs, queries.AllocationsForOrders])
+def test_cannot_query_too_many_keys_at_once(query):
+    keys = tuple(str(i) for i in range(MAX_QUERY_KEYS + 1))
+    query(keys[:-1])
+
+    with pytest.raises(InvalidQueryKeys):
+        query(keys)
+
+
+@pytest.mark.parametrize('limit', [0, -1, MAX_PAGE_SIZE + 1, '10'])
+def test_cannot_query_pages_of_invalid_size(limit):
+    queries.BatchesForSku('sku', limit=MAX_PAGE_SIZE)
+    
+    with pytest.raises(InvalidPageSize):
+        queries.BatchesForSku('sku', limit=limit)